@@ -0,0 +1,121 @@
+# ai/bar_cache.py
+# ===============================
+# 1分足のディスクキャッシュ（銘柄×営業日ごとに追記専用のバイナリ）
+#
+#   data/bars/20251029/7203.T.bin
+#
+# 1本 = struct "<qddddd" (epoch秒, open, high, low, close, volume) = 48byte 固定長。
+# 最後の1本は末尾48byteを読むだけで分かるので、
+# 「最後に持っている足より新しい分だけ取りに行く」が O(1) で判断できる。
+# ATR / VWAP の再計算やバックテストからも read() でそのまま使える。
+# ===============================
+
+import os
+import struct
+import threading
+from datetime import datetime, timezone, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+JST = timezone(timedelta(hours=9))
+
+BARS_DIR = "data/bars"
+
+REC = struct.Struct("<qddddd")
+Bar = Tuple[int, float, float, float, float, float]  # ts, o, h, l, c, v
+
+
+def session_day(ts: int) -> str:
+    return datetime.fromtimestamp(ts, JST).strftime("%Y%m%d")
+
+
+def session_open_ts(day: Optional[str] = None) -> int:
+    """ その日の 9:00 JST（day 省略で今日） """
+    if day is None:
+        d = datetime.now(JST)
+    else:
+        d = datetime.strptime(day, "%Y%m%d").replace(tzinfo=JST)
+    return int(d.replace(hour=9, minute=0, second=0, microsecond=0).timestamp())
+
+
+class BarCache:
+    def __init__(self, root: str = BARS_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, symbol: str, day: str) -> str:
+        return os.path.join(self.root, day, symbol.replace("/", "_") + ".bin")
+
+    def last_bar(self, symbol: str, day: Optional[str] = None) -> Optional[Bar]:
+        day = day or datetime.now(JST).strftime("%Y%m%d")
+        path = self._path(symbol, day)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        size -= size % REC.size  # 書きかけの端数は無視
+        if size <= 0:
+            return None
+        with open(path, "rb") as f:
+            f.seek(size - REC.size)
+            return REC.unpack(f.read(REC.size))
+
+    def last_ts(self, symbol: str, day: Optional[str] = None) -> Optional[int]:
+        b = self.last_bar(symbol, day)
+        return b[0] if b else None
+
+    def append(self, symbol: str, bars: Iterable[Bar]) -> int:
+        """ 既存の最後の足より新しいものだけ追記する。追記した本数を返す """
+        written = 0
+        with self._lock:
+            last = {}
+            for bar in sorted(bars, key=lambda b: b[0]):
+                ts = int(bar[0])
+                day = session_day(ts)
+                if day not in last:
+                    last[day] = self.last_ts(symbol, day)
+                if last[day] is not None and ts <= last[day]:
+                    continue
+                path = self._path(symbol, day)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "ab") as f:
+                    f.write(REC.pack(ts, *(float(x) for x in bar[1:6])))
+                last[day] = ts
+                written += 1
+        return written
+
+    def read(self, symbol: str, day: Optional[str] = None, since_ts: Optional[int] = None) -> List[Bar]:
+        day = day or datetime.now(JST).strftime("%Y%m%d")
+        path = self._path(symbol, day)
+        if not os.path.exists(path):
+            return []
+        with open(path, "rb") as f:
+            data = f.read()
+        data = data[:len(data) - len(data) % REC.size]
+        bars = [REC.unpack_from(data, i) for i in range(0, len(data), REC.size)]
+        if since_ts is not None:
+            bars = [b for b in bars if b[0] >= since_ts]
+        return bars
+
+    # ---- 指標（ATR / VWAP の再計算用） ----
+
+    def vwap(self, symbol: str, day: Optional[str] = None) -> Optional[float]:
+        pv = vol = 0.0
+        for _, _, h, l, c, v in self.read(symbol, day):
+            pv += (h + l + c) / 3.0 * v
+            vol += v
+        return pv / vol if vol > 0 else None
+
+    def atr(self, symbol: str, n: int = 14, day: Optional[str] = None) -> Optional[float]:
+        bars = self.read(symbol, day)
+        if len(bars) < 2:
+            return None
+        trs = []
+        prev_c = bars[0][4]
+        for _, _, h, l, c, _ in bars[1:]:
+            trs.append(max(h - l, abs(h - prev_c), abs(l - prev_c)))
+            prev_c = c
+        trs = trs[-n:]
+        return sum(trs) / len(trs)
+
+
+BAR_CACHE = BarCache()
@@ -1,53 +1,281 @@
 # ai/net_guard.py
 import time, random, threading
-from collections import deque
-from typing import Optional, Dict, Tuple
+import os
+from collections import deque, OrderedDict
+from typing import Callable, Optional, Dict, List, Tuple
+
+from utils.jsonlog import get_logger
+
+log = get_logger("net_guard")
+
 
 class TokenBucket:
-    def __init__(self, capacity: int = 35, window_sec: int = 60):
+    """
+    window_sec 秒あたり capacity 回までのレート制限。
+    使ったトークンは「使った時刻 + window_sec」にちょうど1個戻る（スライディングウィンドウ）。
+    なので次のトークンまでの待ち時間は q[0] + window_sec - now で正確に出せる。
+
+    acquire()        : 取れれば True、無ければすぐ False
+    wait(timeout)    : 取れるまで Condition で寝て待つ（ポーリングしない）
+    await acquire_async() : asyncio 版
+    level()          : 今すぐ使える残数（メトリクス用）
+    """
+
+    def __init__(self, capacity: int = 35, window_sec: int = 60, name: str = ""):
+        self.name = name
         self.capacity = capacity
         self.window_sec = window_sec
-        self.tokens = capacity
-        self.q = deque()
+        self.q = deque()   # 使った時刻
         self.lock = threading.Lock()
+        self.cv = threading.Condition(self.lock)
+        self.granted = 0
+        self.waited = 0
+        self.wait_sec_total = 0.0
+
+    # ---- ロック内ヘルパ ----
+
+    def _expire_locked(self, now: float):
+        while self.q and now - self.q[0] >= self.window_sec:
+            self.q.popleft()
+
+    def _try_take_locked(self, now: float) -> float:
+        """ 取れたら 0.0、取れなければ次のトークンまでの秒数 """
+        self._expire_locked(now)
+        if len(self.q) < self.capacity:
+            self.q.append(now)
+            self.granted += 1
+            return 0.0
+        return self.q[0] + self.window_sec - now
+
+    # ---- 公開API ----
 
     def acquire(self) -> bool:
+        with self.lock:
+            return self._try_take_locked(time.time()) == 0.0
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        start = time.time()
+        deadline = None if timeout is None else start + timeout
+        slept = False
+        with self.cv:
+            while True:
+                now = time.time()
+                delay = self._try_take_locked(now)
+                if delay == 0.0:
+                    if slept:
+                        self.waited += 1
+                        self.wait_sec_total += now - start
+                    return True
+                if deadline is not None:
+                    if now >= deadline:
+                        return False
+                    delay = min(delay, deadline - now)
+                slept = True
+                self.cv.wait(delay)
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> bool:
+        import asyncio
+
+        start = time.time()
+        deadline = None if timeout is None else start + timeout
+        slept = False
+        while True:
+            with self.lock:
+                now = time.time()
+                delay = self._try_take_locked(now)
+                if delay == 0.0:
+                    if slept:
+                        self.waited += 1
+                        self.wait_sec_total += now - start
+                    return True
+            if deadline is not None:
+                if now >= deadline:
+                    return False
+                delay = min(delay, deadline - now)
+            slept = True
+            await asyncio.sleep(delay)
+
+    def level(self) -> int:
+        with self.lock:
+            self._expire_locked(time.time())
+            return self.capacity - len(self.q)
+
+    def next_token_in(self) -> float:
+        """ 次のトークンまでの秒数（今あるなら 0） """
         with self.lock:
             now = time.time()
-            while self.q and now - self.q[0] > self.window_sec:
-                self.q.popleft()
-                self.tokens = min(self.capacity, self.tokens + 1)
-            if self.tokens > 0:
-                self.tokens -= 1
-                self.q.append(now)
-                return True
-            return False
-
-    def wait(self):
-        while not self.acquire():
-            time.sleep(0.25)
+            self._expire_locked(now)
+            if len(self.q) < self.capacity:
+                return 0.0
+            return self.q[0] + self.window_sec - now
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            self._expire_locked(time.time())
+            return {
+                "capacity": self.capacity,
+                "window_sec": self.window_sec,
+                "available": self.capacity - len(self.q),
+                "fill_ratio": (self.capacity - len(self.q)) / self.capacity if self.capacity else 0.0,
+                "granted": self.granted,
+                "waited": self.waited,
+                "wait_sec_total": round(self.wait_sec_total, 3),
+            }
+
+
+_BUCKETS: Dict[str, TokenBucket] = {}
+_BUCKETS_LOCK = threading.Lock()
+
+
+def get_bucket(name: str, capacity: int = 35, window_sec: int = 60) -> TokenBucket:
+    """ 名前つきバケツ（price / discord など）。初回だけ capacity/window_sec が効く """
+    with _BUCKETS_LOCK:
+        b = _BUCKETS.get(name)
+        if b is None:
+            b = TokenBucket(capacity=capacity, window_sec=window_sec, name=name)
+            _BUCKETS[name] = b
+        return b
+
+
+def bucket_stats() -> Dict[str, Dict[str, float]]:
+    with _BUCKETS_LOCK:
+        buckets = dict(_BUCKETS)
+    return {name: b.stats() for name, b in buckets.items()}
 
 class PriceCache:
-    def __init__(self, ttl_sec: int = 60):
+    """
+    銘柄 -> (価格, 保存時刻) の LRU + TTL キャッシュ。
+    - max_entries を超えたら一番使われていないものから捨てる
+    - ttl_sec を過ぎたものは get 時に捨てる（まとめ掃除も set の合間にやる）
+    - stale_ttl_sec > 0 かつ refresher があれば stale-while-revalidate（既定はオフ）:
+      ttl 切れから stale_ttl_sec 以内なら古い値をすぐ返し、裏で取り直す。
+      取り直しは REVALIDATE_COALESCE_SEC の間に古くなった銘柄をまとめて
+      refresher([symbol, ...]) 1回で行う（まとめ取りなら BUCKET も1トークン）
+    """
+
+    PURGE_EVERY = 256
+    REVALIDATE_COALESCE_SEC = 0.05
+
+    def __init__(self, ttl_sec: int = 60, max_entries: int = 2048,
+                 stale_ttl_sec: float = 0, refresher: Optional[Callable[[List[str]], object]] = None):
         self.ttl = ttl_sec
-        self.store: Dict[str, Tuple[float, float]] = {}
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl_sec
+        self.refresher = refresher
+        self.store: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
         self.lock = threading.Lock()
+        self._refreshing = set()      # 取り直し待ち + 取り直し中
+        self._stale_batch = []        # 次の refresher 呼び出しに載せる銘柄
+        self._revalidator = None      # 取り直しスレッド（動いていなければ None）
+        self._sets = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.refreshes = 0
+
+    def set_refresher(self, refresher: Optional[Callable[[List[str]], object]]):
+        self.refresher = refresher
 
     def get(self, symbol: str) -> Optional[float]:
+        revalidate = False
         with self.lock:
             v = self.store.get(symbol)
-            if not v: return None
+            if not v:
+                self.misses += 1
+                return None
             price, ts = v
-            if time.time() - ts <= self.ttl:
+            age = time.time() - ts
+            if age <= self.ttl:
+                self.store.move_to_end(symbol)
+                self.hits += 1
                 return price
-            return None
+            if self.refresher is not None and age <= self.ttl + self.stale_ttl:
+                self.store.move_to_end(symbol)
+                self.stale_hits += 1
+                if symbol not in self._refreshing:
+                    self._refreshing.add(symbol)
+                    self._stale_batch.append(symbol)
+                    if self._revalidator is None:
+                        self._revalidator = threading.Thread(
+                            target=self._revalidate_loop, name="price-swr", daemon=True
+                        )
+                        revalidate = True
+            else:
+                del self.store[symbol]
+                self.expired += 1
+                self.misses += 1
+                return None
+
+        if revalidate:
+            self._revalidator.start()
+        return price
 
     def set(self, symbol: str, price: float):
         with self.lock:
             self.store[symbol] = (price, time.time())
+            self.store.move_to_end(symbol)
+            self._sets += 1
+            if self._sets % self.PURGE_EVERY == 0:
+                self._purge_expired_locked()
+            while len(self.store) > self.max_entries:
+                self.store.popitem(last=False)
+                self.evictions += 1
+
+    def age(self, symbol: str) -> Optional[float]:
+        """ 保存からの経過秒（無ければ None）。統計には数えない """
+        with self.lock:
+            v = self.store.get(symbol)
+            return None if not v else time.time() - v[1]
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "size": len(self.store),
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "stale_hits": self.stale_hits,
+                "evictions": self.evictions,
+                "refreshes": self.refreshes,
+            }
+
+    def _purge_expired_locked(self):
+        limit = time.time() - (self.ttl + (self.stale_ttl if self.refresher else 0))
+        dead = [k for k, (_, ts) in self.store.items() if ts < limit]
+        for k in dead:
+            del self.store[k]
+        self.expired += len(dead)
+
+    def _revalidate_loop(self):
+        """ 溜まった古い銘柄をまとめて取り直す。溜まりがなくなったら終わる """
+        while True:
+            time.sleep(self.REVALIDATE_COALESCE_SEC)
+            with self.lock:
+                batch, self._stale_batch = self._stale_batch, []
+                if not batch:
+                    self._revalidator = None
+                    return
+                self.refreshes += 1
+            try:
+                self.refresher(batch)
+            except Exception as e:
+                # 失敗しても古い値を返し続けるだけ。次に読まれたときにまた取り直しを積む
+                log.error("revalidate_failed", symbols=len(batch), exc=e)
+            finally:
+                with self.lock:
+                    self._refreshing.difference_update(batch)
 
-BUCKET = TokenBucket(capacity=35, window_sec=60)
-CACHE  = PriceCache(ttl_sec=60)
+BUCKET = get_bucket("price", capacity=35, window_sec=60)
+DISCORD_BUCKET = get_bucket(
+    "discord", capacity=int(os.getenv("DISCORD_RATE_PER_MIN", "30")), window_sec=60
+)
+CACHE  = PriceCache(
+    ttl_sec=60,
+    max_entries=int(os.getenv("PRICE_CACHE_MAX", "2048")),
+    stale_ttl_sec=float(os.getenv("PRICE_CACHE_STALE_SEC", "0")),   # >0 で stale-while-revalidate
+)
 
 def backoff_sleep(attempt: int):
     wait = min(2 ** attempt, 16) + random.uniform(0, 0.25)
@@ -0,0 +1,149 @@
+# ai/prefetcher.py
+# ===============================
+# 価格の先読み（予算つき・優先度つき）
+#
+# 価格APIの予算は BUCKET（35回/分）。それを遊ばせずに CACHE を温めておく。
+#   1. orchestrator の active_symbols と、store.open_symbols() の保有ポジ → 最優先
+#      （server は position_manager を渡す。TrailingAI なら StateStore を渡す）
+#   2. data/universe.txt の残り → 余った枠でラウンドロビン
+# 1回の取得は BatchPriceClient.refresh のまとめ取り（最大 PREFETCH_BATCH 銘柄で1トークン）。
+# BUCKET の残りが PREFETCH_RESERVE 以下のときは先読みしない（オンデマンド取得の分を残す）。
+# 取得は失敗して取り直すときも1回ごとに BUCKET.wait() を通るので、予算を超えることはない。
+# 空振り（寄り前・休日）は取り直さない。失敗が続くとバックオフで最大 30 秒ほど止まる。
+# ===============================
+
+import os
+import threading
+from typing import List, Optional
+
+from ai.net_guard import BUCKET, CACHE
+from ai.price_fetcher import PRICES, BatchPriceClient, to_yf_symbol
+from utils.jsonlog import get_logger
+
+log = get_logger("prefetcher")
+
+UNIVERSE_PATH = "data/universe.txt"
+
+PREFETCH_BATCH        = int(os.getenv("PREFETCH_BATCH", "20"))
+PREFETCH_RESERVE      = int(os.getenv("PREFETCH_RESERVE", "5"))
+PREFETCH_INTERVAL_SEC = float(os.getenv("PREFETCH_INTERVAL_SEC", "10"))
+# CACHE の TTL のこの割合を過ぎたら取り直し対象にする
+PREFETCH_REFRESH_RATIO = float(os.getenv("PREFETCH_REFRESH_RATIO", "0.7"))
+
+
+def load_universe(path: str = UNIVERSE_PATH) -> List[str]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def _active_symbols() -> List[str]:
+    try:
+        import orchestrator
+        return list(orchestrator.load_orch().get("active_symbols", []))
+    except Exception:
+        return []
+
+
+class Prefetcher:
+    def __init__(self, prices: BatchPriceClient = PRICES, bucket=BUCKET, cache=CACHE,
+                 store=None, universe: Optional[List[str]] = None,
+                 batch_size: int = PREFETCH_BATCH, reserve: int = PREFETCH_RESERVE):
+        self.prices = prices
+        self.bucket = bucket
+        self.cache = cache
+        self.store = store          # open_symbols() を持つもの（position_manager / TrailingAI の StateStore）
+        self.universe = universe if universe is not None else load_universe()
+        self.batch_size = batch_size
+        self.reserve = reserve
+        self._rr = 0                # universe のラウンドロビン位置
+        self._stop = threading.Event()
+        self._thread = None
+        self.fetches = 0
+        self.symbols_fetched = 0
+
+    # ---- 計画 ----
+
+    def _stale(self, key: str) -> bool:
+        age = self.cache.age(key)
+        return age is None or age >= self.cache.ttl * PREFETCH_REFRESH_RATIO
+
+    def priority_symbols(self) -> List[str]:
+        syms = _active_symbols()
+        if self.store is not None:
+            try:
+                syms += self.store.open_symbols()
+            except Exception:
+                pass
+        return syms
+
+    def plan(self, skip=()) -> List[str]:
+        """ 次の1回で取る銘柄（CACHE の表記 "7203.T" 形式）。skip は今回もう取りに行ったもの """
+        batch = []
+        seen = set(skip)
+        for s in self.priority_symbols():
+            k = to_yf_symbol(s)
+            if k in seen:
+                continue
+            seen.add(k)
+            if self._stale(k):
+                batch.append(k)
+                if len(batch) >= self.batch_size:
+                    return batch
+
+        n = len(self.universe)
+        for i in range(n):
+            if len(batch) >= self.batch_size:
+                break
+            k = to_yf_symbol(self.universe[(self._rr + i) % n])
+            if k in seen:
+                continue
+            seen.add(k)
+            if self._stale(k):
+                batch.append(k)
+        if n:
+            self._rr = (self._rr + self.batch_size) % n
+        return batch
+
+    # ---- 実行 ----
+
+    def run_cycle(self) -> int:
+        """ 予算の範囲で取れるだけ取る。取りに行った回数を返す """
+        calls = 0
+        tried = set()
+        while not self._stop.is_set() and self.bucket.level() > self.reserve:
+            batch = self.plan(skip=tried)
+            if not batch:
+                break
+            tried.update(batch)
+            self.prices.refresh(batch, force=True)
+            calls += 1
+            self.fetches += 1
+            self.symbols_fetched += len(batch)
+        return calls
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_cycle()
+            except Exception as e:
+                log.error("prefetch_failed", exc=e)
+            self._stop.wait(PREFETCH_INTERVAL_SEC)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="price-prefetcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            "fetches": self.fetches,
+            "symbols_fetched": self.symbols_fetched,
+            "universe": len(self.universe),
+        }
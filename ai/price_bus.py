@@ -0,0 +1,71 @@
+# ai/price_bus.py
+# ===============================
+# プロセス内の価格バス
+#
+# server.webhook が PRICE_TICK を受けるたびに publish() し、
+# TrailingAI（後追い監視）は yfinance より先にここを見る。
+# 銘柄が SILENCE_SEC 以上黙ったときだけ従来の取得(_last_price)にフォールバックする。
+#
+# subscribe(cb) した関数は publish したスレッドでそのまま呼ばれるので、
+# 重い処理はせず「起こすだけ」にすること。
+# ===============================
+
+import os
+import time
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+SILENCE_SEC = float(os.getenv("PRICE_BUS_SILENCE_SEC", "90"))  # 毎分tick想定なので1.5分
+
+
+def bus_key(symbol: str) -> str:
+    """ "7203.T" / "7203" / "7203.t" を同じ銘柄として扱う """
+    s = (symbol or "").strip().upper()
+    return s[:-2] if s.endswith(".T") else s
+
+
+class PriceBus:
+    def __init__(self):
+        self._last: Dict[str, Tuple[float, float]] = {}
+        self._subs = []
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def publish(self, symbol: str, price: float, ts: Optional[float] = None):
+        if not symbol or price is None:
+            return
+        try:
+            price = float(price)
+        except (TypeError, ValueError):
+            return
+        if price <= 0:
+            return
+        ts = time.time() if ts is None else ts
+        self._last[bus_key(symbol)] = (price, ts)
+        self.published += 1
+        for cb in self._subs:
+            try:
+                cb(symbol, price, ts)
+            except Exception:
+                pass
+
+    def last(self, symbol: str, max_age: float = SILENCE_SEC) -> Optional[float]:
+        v = self._last.get(bus_key(symbol))
+        if not v:
+            return None
+        price, ts = v
+        if time.time() - ts > max_age:
+            return None
+        return price
+
+    def subscribe(self, cb: Callable[[str, float, float], None]):
+        with self._lock:
+            # 差し替え式にして publish 側はロックなしで回す
+            self._subs = self._subs + [cb]
+
+    def unsubscribe(self, cb):
+        with self._lock:
+            self._subs = [c for c in self._subs if c is not cb]
+
+
+PRICE_BUS = PriceBus()
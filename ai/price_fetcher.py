@@ -0,0 +1,246 @@
+# ai/price_fetcher.py
+# ===============================
+# 価格取得の差し替え口 + まとめ取り + single-flight
+#
+# - PriceFetcher      : 「銘柄リスト → 最新値」のインターフェース
+# - YFinanceFetcher   : yfinance で全銘柄を1回の download で取る本番用
+#                       （ai.bar_cache に無い新しい足だけ取り、確定足はディスクに追記）
+# - StaticFetcher     : 手元の dict を返すだけの代役（テスト/オフライン用）
+# - BatchPriceClient  : CACHE/BUCKET を挟んで fetcher を呼ぶ窓口。
+#                       同じ銘柄への同時リクエストは実行中の1本に相乗りさせる。
+# ===============================
+
+import abc
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+from ai.net_guard import BUCKET, CACHE, backoff_sleep
+from ai.bar_cache import BAR_CACHE, BarCache, session_open_ts
+from utils.jsonlog import get_logger
+
+log = get_logger("price_fetcher")
+
+
+def to_yf_symbol(symbol: str) -> str:
+    """ "7203" / "285A" みたいな東証コードは ".T" を付ける。それ以外はそのまま """
+    s = (symbol or "").strip().upper()
+    if "." not in s and len(s) == 4 and s.isalnum():
+        return s + ".T"
+    return s
+
+
+class PriceFetcher(abc.ABC):
+    """ fetch_latest(symbols) -> {symbol: price}。取れなかった銘柄は入れない """
+
+    @abc.abstractmethod
+    def fetch_latest(self, symbols: List[str]) -> Dict[str, float]:
+        ...
+
+
+class YFinanceFetcher(PriceFetcher):
+    """
+    bars(BarCache) があれば、各銘柄の「ディスクにある最後の足の次」からだけ取りに行き、
+    確定した足はディスクに追記する。無ければ従来どおり当日分をまとめて取る。
+    新しい足が1本も無い銘柄は、ディスクの最後の足の終値を返す。
+    """
+
+    def __init__(self, to_yf: Callable[[str], str] = to_yf_symbol, bars: Optional[BarCache] = BAR_CACHE):
+        self.to_yf = to_yf
+        self.bars = bars
+
+    def _start_ts(self, keys) -> int:
+        now = int(time.time())
+        start = None
+        for k in keys:
+            last = self.bars.last_ts(k)
+            t = last + 60 if last is not None else session_open_ts()
+            start = t if start is None else min(start, t)
+        if start is None or start > now:
+            start = now - 3600  # 場前など。直近1時間だけ見る
+        return start
+
+    def fetch_latest(self, symbols: List[str]) -> Dict[str, float]:
+        import yfinance as yf
+
+        yf_map = {self.to_yf(s): s for s in symbols}
+        kw = dict(interval="1m", group_by="ticker", progress=False, prepost=False,
+                  auto_adjust=False, threads=False)
+        if self.bars is None:
+            df = yf.download(list(yf_map.keys()), period="1d", **kw)
+        else:
+            start = datetime.fromtimestamp(self._start_ts(yf_map.keys()), timezone.utc)
+            df = yf.download(list(yf_map.keys()), start=start, **kw)
+
+        out = {}
+        if df is not None and not df.empty:
+            now = time.time()
+            for yfs, sym in yf_map.items():
+                frame = _ticker_frame(df, yfs, len(yf_map))
+                if frame is None:
+                    continue
+                if self.bars is not None:
+                    # 分が確定した足だけ保存（進行中の足は次回また取る）
+                    self.bars.append(yfs, [b for b in _frame_bars(frame) if b[0] + 60 <= now])
+                close = frame["Close"].dropna()
+                if not close.empty:
+                    out[sym] = float(close.iloc[-1])
+
+        if self.bars is not None:
+            # 昼休み・引け後・売買停止などで新しい足が無い銘柄は、ディスクの最後の足の終値
+            # （差分取得にする前の period 指定で返っていたのと同じ値）
+            for yfs, sym in yf_map.items():
+                if sym not in out:
+                    last = self.bars.last_bar(yfs)
+                    if last is not None:
+                        out[sym] = float(last[4])
+        return out
+
+
+def _ticker_frame(df, yfs: str, n_tickers: int):
+    """ download の結果から1銘柄ぶんの OHLCV を取り出す（列の段数の差を吸収） """
+    cols = df.columns
+    try:
+        if getattr(cols, "nlevels", 1) > 1:
+            if yfs in cols.get_level_values(0):
+                return df[yfs]
+            if yfs in cols.get_level_values(-1):  # (Price, Ticker) 形式
+                return df.xs(yfs, axis=1, level=-1)
+            return None
+        return df if n_tickers == 1 else None
+    except KeyError:
+        return None
+
+
+def _frame_bars(frame):
+    bars = []
+    for idx, row in frame[["Open", "High", "Low", "Close", "Volume"]].dropna().iterrows():
+        bars.append((int(idx.timestamp()), row["Open"], row["High"], row["Low"], row["Close"], row["Volume"]))
+    return bars
+
+
+class StaticFetcher(PriceFetcher):
+    """ prices を返すだけ。calls に呼ばれた銘柄リストを積む """
+
+    def __init__(self, prices: Optional[Dict[str, float]] = None):
+        self.prices = dict(prices or {})
+        self.calls: List[List[str]] = []
+
+    def fetch_latest(self, symbols: List[str]) -> Dict[str, float]:
+        self.calls.append(list(symbols))
+        return {s: self.prices[s] for s in symbols if s in self.prices}
+
+
+class _Call:
+    __slots__ = ("done", "result")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Dict[str, float] = {}
+
+
+class BatchPriceClient:
+    """
+    get(symbol)       : キャッシュ → 無ければ1銘柄で取りに行く
+    refresh(symbols)  : キャッシュに無い銘柄をまとめて1回で取りに行く（BUCKETは1トークン）
+    どちらも、既に取りに行っている銘柄はその結果を待つだけ（single-flight）。
+    """
+
+    def __init__(self, fetcher: PriceFetcher, cache=CACHE, bucket=BUCKET, retries: int = 5):
+        self.fetcher = fetcher
+        self.cache = cache
+        self.bucket = bucket
+        self.retries = retries
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, _Call] = {}
+
+    def get(self, symbol: str) -> Optional[float]:
+        cached = self.cache.get(to_yf_symbol(symbol))
+        if cached is not None:
+            return cached
+        return self.refresh([symbol]).get(symbol)
+
+    def refresh(self, symbols: Iterable[str], force: bool = False) -> Dict[str, float]:
+        """ 戻り値は呼び出し側の表記のまま。CACHE は "7203.T" 形式に揃えて持つ """
+        asked = {}
+        for s in symbols:
+            asked.setdefault(to_yf_symbol(s), []).append(s)
+
+        got = self._refresh_keys(list(asked.keys()), force)
+        out: Dict[str, float] = {}
+        for k, p in got.items():
+            for s in asked[k]:
+                out[s] = p
+        return out
+
+    def _refresh_keys(self, keys: List[str], force: bool) -> Dict[str, float]:
+        out: Dict[str, float] = {}
+        need: List[str] = []
+        for s in keys:
+            cached = None if force else self.cache.get(s)
+            if cached is not None:
+                out[s] = cached
+            else:
+                need.append(s)
+        if not need:
+            return out
+
+        # 実行中の取得に相乗りするもの / 自分で取りに行くもの に分ける
+        mine = _Call()
+        waits = {}
+        with self._lock:
+            todo = []
+            for s in need:
+                call = self._inflight.get(s)
+                if call is None:
+                    self._inflight[s] = mine
+                    todo.append(s)
+                else:
+                    waits[s] = call
+
+        if todo:
+            try:
+                mine.result = self._fetch(todo)
+            finally:
+                with self._lock:
+                    for s in todo:
+                        if self._inflight.get(s) is mine:
+                            del self._inflight[s]
+                mine.done.set()
+            for s in todo:
+                if s in mine.result:
+                    out[s] = mine.result[s]
+
+        for s, call in waits.items():
+            call.done.wait()
+            if s in call.result:
+                out[s] = call.result[s]
+        return out
+
+    def _fetch(self, symbols: List[str]) -> Dict[str, float]:
+        attempt = 0
+        while attempt < self.retries:
+            # レート整流（まとめ取りでも1回ぶん。リトライも1回として数える）
+            self.bucket.wait()
+            try:
+                got = self.fetcher.fetch_latest(symbols)
+            except Exception as e:
+                log.warning("price_fetch_failed", attempt=attempt + 1, symbols=len(symbols), exc=e)
+                attempt += 1
+                if attempt < self.retries:
+                    backoff_sleep(attempt)
+                continue
+            # 空（寄り前・休日など）は取り直しても同じなのでそのまま返す
+            got = got or {}
+            for s, p in got.items():
+                self.cache.set(s, p)
+            return got
+        return {}
+
+
+PRICES = BatchPriceClient(YFinanceFetcher())
+
+# CACHE の stale-while-revalidate（PRICE_CACHE_STALE_SEC>0 のとき）は
+# 古くなった銘柄をまとめて PRICES から1回で取り直す
+CACHE.set_refresher(lambda symbols: PRICES.refresh(symbols, force=True))
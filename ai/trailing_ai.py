@@ -1,135 +1,308 @@
 # ai/trailing_ai.py
+import os
 import time
+import heapq
+import sqlite3
+import threading
 from typing import Literal, Optional
-import yfinance as yf
-import pandas as pd
-from sqlalchemy import create_engine
-from ai.net_guard import BUCKET, CACHE, backoff_sleep
-import pytz, datetime as dt
+from ai.price_fetcher import BatchPriceClient, PRICES
+from ai.price_bus import PRICE_BUS, PriceBus, SILENCE_SEC, bus_key
+import datetime as dt
+
+# pytz は重いので使う直前に import する
+# （cron の短命プロセスが import しただけで数百ms 持っていかれないように）
 
 Direction = Literal["BUY","SELL"]
 
 def _is_market_open_now(tz_str="Asia/Tokyo") -> bool:
+    import pytz
     tz = pytz.timezone(tz_str)
     now = dt.datetime.now(tz)
     hm = now.hour * 100 + now.minute
     return (900 <= hm < 1130) or (1230 <= hm < 1500)
 
 class StateStore:
+    """
+    後追いポジの保存先（SQLite）。
+    - 接続は1本を使い回し（WAL + synchronous=NORMAL）、SQLは定数文字列なので sqlite3 の文キャッシュに乗る
+    - 保有中ポジはプロセス内 dict にも持ち、get は dict だけで返す（read-through）
+    - set/close は DB と dict の両方に書く（write-through）
+    """
+
+    _SELECT_ALL = "SELECT symbol,direction,entry_price,entry_ts FROM positions"
+    _REPLACE = "REPLACE INTO positions(symbol,direction,entry_price,entry_ts) VALUES(?,?,?,?)"
+    _DELETE = "DELETE FROM positions WHERE symbol=?"
+
     def __init__(self, path="data/state.db"):
-        self.engine = create_engine(f"sqlite:///{path}", echo=False)
-        with self.engine.begin() as conn:
-            conn.exec_driver_sql("""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, cached_statements=32, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
             CREATE TABLE IF NOT EXISTS positions(
                 symbol TEXT PRIMARY KEY,
                 direction TEXT NOT NULL,
                 entry_price REAL NOT NULL,
                 entry_ts INTEGER NOT NULL
             )""")
+        self._open = {row[0]: tuple(row) for row in self.conn.execute(self._SELECT_ALL)}
 
     def get_position(self, symbol: str):
-        with self.engine.begin() as conn:
-            return conn.exec_driver_sql(
-                "SELECT symbol,direction,entry_price,entry_ts FROM positions WHERE symbol=?",
-                (symbol,)
-            ).fetchone()
+        return self._open.get(symbol)
+
+    def open_symbols(self):
+        return list(self._open.keys())
 
     def set_position(self, symbol: str, direction: str, entry_price: float, entry_ts: int):
-        with self.engine.begin() as conn:
-            conn.exec_driver_sql(
-                "REPLACE INTO positions(symbol,direction,entry_price,entry_ts) VALUES(?,?,?,?)",
-                (symbol, direction, entry_price, entry_ts)
-            )
+        row = (symbol, direction, entry_price, entry_ts)
+        with self.lock:
+            self.conn.execute(self._REPLACE, row)
+            self._open[symbol] = row
 
     def close_position(self, symbol: str):
-        with self.engine.begin() as conn:
-            conn.exec_driver_sql("DELETE FROM positions WHERE symbol=?", (symbol,))
+        with self.lock:
+            self.conn.execute(self._DELETE, (symbol,))
+            self._open.pop(symbol, None)
 
 class TrailingAI:
-    def __init__(self, store: StateStore, tp_pct: float, sl_pct: float, poll_secs: int = 45, max_minutes: int = 20):
+    def __init__(self, store: StateStore, tp_pct: float, sl_pct: float, poll_secs: int = 45, max_minutes: int = 20,
+                 prices: Optional[BatchPriceClient] = None, bus: Optional[PriceBus] = PRICE_BUS):
         self.store = store
+        self.prices = prices or PRICES
+        self.bus = bus  # None なら従来どおりポーリングだけ
         self.tp_pct = tp_pct
         self.sl_pct = sl_pct
         self.poll_secs = poll_secs
         self.max_minutes = max_minutes
 
-    def _yf_symbol(self, symbol: str) -> str:
-        # 必要に応じて .T 付与などをここで調整
-        return symbol
+    def _bus_price(self, symbol: str) -> Optional[float]:
+        return self.bus.last(symbol, SILENCE_SEC) if self.bus is not None else None
 
     def _last_price(self, symbol: str) -> Optional[float]:
-        # 1) キャッシュ
-        cached = CACHE.get(symbol)
-        if cached is not None:
-            return cached
-
-        # 2) レート整流
-        BUCKET.wait()
-
-        s = self._yf_symbol(symbol)
-        attempt = 0
-        while attempt < 5:
-            try:
-                df = yf.download(s, interval="1m", period="60m", progress=False, prepost=False, auto_adjust=False, threads=False)
-                if df is not None and not df.empty:
-                    p = float(df["Close"].iloc[-1])
-                    CACHE.set(symbol, p)
-                    return p
-            except Exception:
-                pass
-            attempt += 1
-            backoff_sleep(attempt)
-        return None
+        # 1) webhook の PRICE_TICK（黙っていなければ外部取得ゼロ）
+        p = self._bus_price(symbol)
+        if p is not None:
+            return p
+        # 2) キャッシュ → 無ければ fetcher でまとめ取り（同時要求は1本に相乗り）
+        return self.prices.get(symbol)
 
-    def run_once(self, symbol: str, direction: Direction, ref_price: float, ts: int, notify):
+    # ---- 状態機械（run_once と TrailingScheduler で共用）----
+
+    def _precheck(self, symbol: str, notify) -> bool:
         # 場中のみ
         if not _is_market_open_now():
             notify(f"🕒 {symbol} は場外のため監視スキップ")
-            return
+            return False
 
         # 既存ポジチェック
         if self.store.get_position(symbol):
             notify(f"ℹ️ {symbol} 既存ポジ稼働中のため後追いはスキップ")
-            return
+            return False
+        return True
+
+    def _step(self, w: "_Watch", p: float) -> bool:
+        """ 価格 p で1回判定する。TP/SLで監視終了なら True """
+        pos = self.store.get_position(w.symbol)
+        if pos is None:
+            if (w.direction=="BUY" and p >= w.in_trigger) or (w.direction=="SELL" and p <= w.in_trigger):
+                self.store.set_position(w.symbol, w.direction, p, int(time.time()))
+                w.notify(f"✅ IN: {w.symbol} {w.direction} @ {p:.2f}")
+                pos = self.store.get_position(w.symbol)
+            else:
+                return False
+
+        _, d, entry, _ = pos
+        tp = entry * (1 + self.tp_pct/100.0) if d=="BUY" else entry * (1 - self.tp_pct/100.0)
+        sl = entry * (1 - self.sl_pct/100.0) if d=="BUY" else entry * (1 + self.sl_pct/100.0)
 
+        hit_tp = (p >= tp) if d=="BUY" else (p <= tp)
+        hit_sl = (p <= sl) if d=="BUY" else (p >= sl)
+
+        if hit_tp:
+            self.store.close_position(w.symbol)
+            w.notify(f"🎯 TP: {w.symbol} {d} @ {p:.2f} (entry {entry:.2f}, +{self.tp_pct:.2f}%)")
+            return True
+        if hit_sl:
+            self.store.close_position(w.symbol)
+            w.notify(f"🛑 SL: {w.symbol} {d} @ {p:.2f} (entry {entry:.2f}, -{self.sl_pct:.2f}%)")
+            return True
+        return False
+
+    def _timeout(self, w: "_Watch"):
+        if self.store.get_position(w.symbol) is None:
+            w.notify(f"⏱️ 後追い監視タイムアウト: {w.symbol}（IN未達）")
+        else:
+            w.notify(f"⏱️ 後追い監視タイムアウト: {w.symbol}（ポジ維持中）")
+
+    def _new_watch(self, symbol: str, direction: Direction, ref_price: float, notify) -> "_Watch":
         # INトリガ（ref_price ±0.05%）
         in_trigger = ref_price * (1 + (0.0005 if direction=="BUY" else -0.0005))
         start = time.time()
+        return _Watch(symbol, direction, in_trigger, start + self.max_minutes * 60, notify)
+
+    def run_once(self, symbol: str, direction: Direction, ref_price: float, ts: int, notify):
+        """ 1銘柄を呼び出しスレッドでブロッキング監視する（従来版） """
+        if not self._precheck(symbol, notify):
+            return
 
-        while time.time() - start < self.max_minutes * 60:
+        w = self._new_watch(symbol, direction, ref_price, notify)
+        while time.time() < w.deadline:
             p = self._last_price(symbol)
             if p is None:
-                time.sleep(1.6); continue
-
-            pos = self.store.get_position(symbol)
-            if pos is None:
-                if (direction=="BUY" and p >= in_trigger) or (direction=="SELL" and p <= in_trigger):
-                    self.store.set_position(symbol, direction, p, int(time.time()))
-                    notify(f"✅ IN: {symbol} {direction} @ {p:.2f}")
-                else:
-                    time.sleep(self.poll_secs)
+                time.sleep(PRICE_RETRY_SECS); continue
+            if self._step(w, p):
+                return
+            time.sleep(self.poll_secs)
+
+        self._timeout(w)
+
+
+PRICE_RETRY_SECS = 1.6
+
+
+class _Watch:
+    __slots__ = ("symbol", "direction", "in_trigger", "deadline", "notify", "gen", "running")
+
+    def __init__(self, symbol, direction, in_trigger, deadline, notify):
+        self.symbol = symbol
+        self.direction = direction
+        self.in_trigger = in_trigger
+        self.deadline = deadline
+        self.notify = notify
+        self.gen = 0          # ヒープ上の古い予約を無視するための世代番号
+        self.running = False  # 判定中（tick で二重に起こさない）
+
+
+class TrailingScheduler:
+    """
+    多銘柄の後追い監視を1本のタイマースレッドで回す。
+    run_once と同じ IN/TP/SL/タイムアウト判定・同じ notify を、
+    銘柄ごとの「次に見る時刻」が来たものだけ起こして実行する。
+    ai.bus があれば PRICE_TICK が来た銘柄はその場で起こす（poll_secs を待たない）。
+
+        sched = TrailingScheduler(ai)
+        sched.watch("7203.T", "BUY", 3012.0, ts, notify)
+    """
+
+    def __init__(self, ai: TrailingAI):
+        self.ai = ai
+        self._heap = []          # (due, seq, gen, _Watch)
+        self._watching = {}      # symbol -> _Watch
+        self._seq = 0
+        self._cv = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._by_key = {}        # bus_key -> _Watch
+        if ai.bus is not None:
+            ai.bus.subscribe(self._on_tick)
+
+    def watch(self, symbol: str, direction: Direction, ref_price: float, ts: int, notify) -> bool:
+        """ 監視を登録してすぐ戻る。登録しなかったら False """
+        if not self.ai._precheck(symbol, notify):
+            return False
+        with self._cv:
+            if symbol in self._watching:
+                notify(f"ℹ️ {symbol} は後追い監視中のためスキップ")
+                return False
+            w = self.ai._new_watch(symbol, direction, ref_price, notify)
+            self._watching[symbol] = w
+            self._by_key[bus_key(symbol)] = w
+            self._push(time.time(), w)
+            self._ensure_thread()
+            self._cv.notify()
+        return True
+
+    def watched_symbols(self):
+        with self._cv:
+            return list(self._watching.keys())
+
+    def stop(self):
+        with self._cv:
+            self._stopped = True
+            self._cv.notify()
+        if self.ai.bus is not None:
+            self.ai.bus.unsubscribe(self._on_tick)
+
+    def _on_tick(self, symbol, price, ts):
+        """ PRICE_BUS から。監視中の銘柄なら今すぐ判定するよう予約し直す """
+        with self._cv:
+            w = self._by_key.get(bus_key(symbol))
+            if w is None or w.running:
+                return
+            self._push(time.time(), w)
+            self._cv.notify()
+
+    # ---- 内部 ----
+
+    def _push(self, due: float, w: _Watch):
+        self._seq += 1
+        w.gen += 1
+        heapq.heappush(self._heap, (due, self._seq, w.gen, w))
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self._loop, name="trailing-scheduler", daemon=True)
+            self._thread.start()
+
+    def _pop_due(self):
+        """ 期限が来た監視をまとめて取り出す。無ければ次の期限まで待つ """
+        with self._cv:
+            while not self._stopped:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    due = []
+                    while self._heap and self._heap[0][0] <= now:
+                        _, _, gen, w = heapq.heappop(self._heap)
+                        if gen == w.gen and self._watching.get(w.symbol) is w:
+                            w.running = True
+                            due.append(w)
+                    if due:
+                        return due
                     continue
-            else:
-                _, d, entry, _ = self.store.get_position(symbol)
-                tp = entry * (1 + self.tp_pct/100.0) if d=="BUY" else entry * (1 - self.tp_pct/100.0)
-                sl = entry * (1 - self.sl_pct/100.0) if d=="BUY" else entry * (1 + self.sl_pct/100.0)
-
-                hit_tp = (p >= tp) if d=="BUY" else (p <= tp)
-                hit_sl = (p <= sl) if d=="BUY" else (p >= sl)
-
-                if hit_tp:
-                    self.store.close_position(symbol)
-                    notify(f"🎯 TP: {symbol} {d} @ {p:.2f} (entry {entry:.2f}, +{self.tp_pct:.2f}%)")
-                    return
-                if hit_sl:
-                    self.store.close_position(symbol)
-                    notify(f"🛑 SL: {symbol} {d} @ {p:.2f} (entry {entry:.2f}, -{self.sl_pct:.2f}%)")
-                    return
-
-                time.sleep(self.poll_secs)
-
-        # タイムアウト
-        if self.store.get_position(symbol) is None:
-            notify(f"⏱️ 後追い監視タイムアウト: {symbol}（IN未達）")
-        else:
-            notify(f"⏱️ 後追い監視タイムアウト: {symbol}（ポジ維持中）")
+                timeout = (self._heap[0][0] - now) if self._heap else None
+                self._cv.wait(timeout)
+            return None
+
+    def _loop(self):
+        while True:
+            due = self._pop_due()
+            if due is None:
+                return
+            # tick が来ていない銘柄だけ、1回のまとめ取りで温めてから判定する
+            silent = [s for s in self.watched_symbols() if self.ai._bus_price(s) is None]
+            if silent:
+                try:
+                    self.ai.prices.refresh(silent)
+                except Exception:
+                    pass
+            for w in due:
+                try:
+                    nxt = self._run_watch(w)
+                except Exception as e:
+                    w.notify(f"⚠ 後追い監視エラー: {w.symbol} {e}")
+                    nxt = None
+                with self._cv:
+                    w.running = False
+                    if nxt is None:
+                        if self._watching.get(w.symbol) is w:
+                            del self._watching[w.symbol]
+                            self._by_key.pop(bus_key(w.symbol), None)
+                    else:
+                        self._push(nxt, w)
+
+    def _run_watch(self, w: _Watch) -> Optional[float]:
+        """ 1回ぶん判定して次に起こす時刻を返す。監視終了なら None """
+        now = time.time()
+        if now >= w.deadline:
+            self.ai._timeout(w)
+            return None
+
+        p = self.ai._last_price(w.symbol)
+        if p is None:
+            return min(time.time() + PRICE_RETRY_SECS, w.deadline)
+        if self.ai._step(w, p):
+            return None
+        return min(time.time() + self.ai.poll_secs, w.deadline)
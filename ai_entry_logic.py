@@ -6,6 +6,8 @@
 
 import os, json
 
+import ai_online_learner
+
 ENTRY_MODEL_PATH = "data/entry_stats.json"
 
 DEFAULT_BREAK_PCT   = 0.05   # 初期ブレイク幅(%) 0.1%
@@ -24,14 +26,19 @@ def _load_entry_model():
     }
 
     無かったら空{}返す。
+    クローズ時のオンライン更新分(ai_online_learner)があれば上書きで重ねる。
     """
-    if not os.path.exists(ENTRY_MODEL_PATH):
-        return {}
-    try:
-        with open(ENTRY_MODEL_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        return {}
+    model = {}
+    if os.path.exists(ENTRY_MODEL_PATH):
+        try:
+            with open(ENTRY_MODEL_PATH, "r", encoding="utf-8") as f:
+                model = json.load(f)
+        except:
+            model = {}
+    online = ai_online_learner.entry_overrides()
+    if online:
+        model.update(online)
+    return model
 
 def should_accept_entry(symbol, side, vol_mult, vwap, atr, last_pct):
     """
@@ -71,18 +78,88 @@ def should_accept_entry(symbol, side, vol_mult, vwap, atr, last_pct):
 
     accept = strong_vol and trending and atr_condition and breakout_ok
 
+    return accept, _entry_reason(accept, vol_req, brk_req)
+
+
+def _entry_reason(accept, vol_req, brk_req, over_limit=False):
     if accept:
-        reason = (
-            "出来高/勢い/ボラOK→即エントリー採用\n"
-            f"(要求vol≧{vol_req:.2f}x, 要求ブレイク≧{brk_req:.3f}%)"
-        )
+        head = "出来高/勢い/ボラOK→即エントリー採用"
+    elif over_limit:
+        head = "条件OKだが本ポジ枠(TOP_LIMIT)超えのため保留監視（shadow）"
     else:
-        reason = (
-            "条件が弱いので保留監視（shadow）\n"
-            f"(要求vol≧{vol_req:.2f}x, 要求ブレイク≧{brk_req:.3f}%)"
-        )
+        head = "条件が弱いので保留監視（shadow）"
+    return head + "\n" + f"(要求vol≧{vol_req:.2f}x, 要求ブレイク≧{brk_req:.3f}%)"
+
+
+def admit_entries(cands, slots):
+    """
+    寄り付きのまとめ採否。cands の ENTRY を1回でまとめて採点し、
+    should_accept_entry と同じ条件を満たしたものの中からスコア上位 slots 件だけ real にする。
 
-    return accept, reason
+    cands : [(symbol, side, vol_mult, vwap, atr, last_pct), ...]
+    slots : 今回 real にしてよい残り枠（TOP_LIMIT - 保有中real数）
+    return: [(accept, reason), ...]  cands と同じ順
+
+    スコア = vol_mult/要求vol + |last_pct|/要求ブレイク（しきい値に対する余裕の合計）
+    同じ銘柄が複数あれば最後の1件だけを採点対象にする（後の ENTRY が前のポジを上書きするので、
+    前の分で枠を使わない）。
+    """
+    n = len(cands)
+    if n == 0:
+        return []
+    last_of = {c[0]: i for i, c in enumerate(cands)}
+    latest = [last_of[c[0]] == i for i, c in enumerate(cands)]
+
+    model = _load_entry_model()
+    vol_req = []
+    brk_req = []
+    for c in cands:
+        per_symbol = model.get(c[0], {})
+        vol_req.append(float(per_symbol.get("vol_mult_req", DEFAULT_VOL_REQ)))
+        brk_req.append(float(per_symbol.get("break_pct",    DEFAULT_BREAK_PCT)))
+
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    if np is not None:
+        vol  = np.fromiter((c[2] for c in cands), dtype=float, count=n)
+        atr  = np.fromiter((c[4] for c in cands), dtype=float, count=n)
+        last = np.abs(np.fromiter((c[5] for c in cands), dtype=float, count=n))
+        vr   = np.asarray(vol_req, dtype=float)
+        br   = np.asarray(brk_req, dtype=float)
+
+        ok = (
+            (vol >= vr)
+            & (last >= DEFAULT_TREND_ABS_P)
+            & ((atr == 0) | ((atr >= DEFAULT_ATR_MIN) & (atr <= DEFAULT_ATR_MAX)))
+            & (last >= br)
+            & np.asarray(latest, dtype=bool)
+        )
+        score = vol / vr + last / br
+        ok_idx = np.flatnonzero(ok)
+        # 同点は到着順（安定ソート）
+        ranked = ok_idx[np.argsort(-score[ok_idx], kind="stable")]
+        admitted = set(ranked[:max(slots, 0)].tolist())
+        ok = ok.tolist()
+    else:
+        ok = []
+        score = []
+        for c, vr, br in zip(cands, vol_req, brk_req):
+            a, lp = c[4], abs(c[5])
+            ok.append(c[2] >= vr and lp >= DEFAULT_TREND_ABS_P
+                      and ((a == 0) or (DEFAULT_ATR_MIN <= a <= DEFAULT_ATR_MAX)) and lp >= br)
+            score.append(c[2] / vr + lp / br)
+        ok = [o and l for o, l in zip(ok, latest)]
+        ranked = sorted((i for i in range(n) if ok[i]), key=lambda i: -score[i])
+        admitted = set(ranked[:max(slots, 0)])
+
+    out = []
+    for i in range(n):
+        real = i in admitted
+        out.append((real, _entry_reason(real, vol_req[i], brk_req[i], over_limit=ok[i] and not real)))
+    return out
 
 
 def should_promote_to_real(position_dict):
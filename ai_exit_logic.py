@@ -2,24 +2,126 @@
 # ===============================
 # ポジション保有中の「利確/損切/タイムアウト」判断
 # PRICE_TICKごとに呼ばれる
+#
+# ほとんどの tick は TP/SL のだいぶ内側なので、ポジごとに
+# 「この pct の間なら絶対に決済しない」帯 (sl, tp下限) を覚えておき、
+# モデル / VWAPの上下 / 熱さの段 が前回と同じなら比較2回で返す。
+# 帯はモデル更新・VWAP反転・熱さの段が変わったときだけ全判定で作り直す。
+# 件数は stats()（server の /metrics）。
 # ===============================
 
 import os, json
 
+import ai_online_learner
+from utils.jsonlog import get_logger
+
+log = get_logger("ai_exit_logic")
+
 MODEL_PATH = "data/ai_dynamic_thresholds.json"
 
+# Pine側の保険は30分で強制クローズだから、AI側も30分で逃がす
+AI_TIMEOUT_MIN = 30
+
+# 熱さ(heat 0〜2)をこの幅の段に分ける。段の中ならTPは「段の下端×ベース」以上
+HEAT_BUCKET = 0.25
+
+_model_cache = {"key": None, "model": {}, "gen": 0}
+_bands = {}   # symbol -> (entry_time, 帯のキー, sl, tp下限)
+_stats = {"skipped": 0, "full": 0, "rebuilt": 0, "batch": 0}
+_reload_listeners = []   # fn(generation, n_symbols)。MODEL_PATH が書き直されたときだけ呼ぶ
+
+
+def add_reload_listener(fn):
+    _reload_listeners.append(fn)
+
+
 def _load_model():
     """
-    銘柄ごとのTP/SLしきい値を毎回読み直す。
-    学習ジョブ(ai_model_trainer.py)が走ったあとの最新値を使うため。
+    銘柄ごとのTP/SLしきい値。
+    学習ジョブ(ai_model_trainer.py)が MODEL_PATH を書き直したら（mtimeが変わったら）読み直す。
+    さらにクローズ時のオンライン更新分(ai_online_learner)を上書きで重ねる。
+    戻り値は共有なので書き換えないこと。
+    """
+    try:
+        mtime = os.path.getmtime(MODEL_PATH)
+    except OSError:
+        mtime = None
+    key = (mtime, ai_online_learner.version())
+    if key == _model_cache["key"]:
+        return _model_cache["model"]
+
+    model = {}
+    if mtime is not None:
+        with open(MODEL_PATH, encoding="utf-8") as f:
+            try:
+                model = json.load(f)
+            except:
+                model = {}
+    online = ai_online_learner.exit_overrides()
+    if online:
+        model.update(online)
+    prev = _model_cache["key"]
+    _model_cache["key"] = key
+    _model_cache["model"] = model
+    _model_cache["gen"] += 1
+    # オンライン更新（クローズごと）での読み直しは知らせない。学習ジョブがファイルを書いたときだけ
+    if prev is not None and prev[0] != mtime:
+        for fn in _reload_listeners:
+            try:
+                fn(_model_cache["gen"], len(model))
+            except Exception as e:
+                log.error("reload_listener_failed", exc=e)
+    return model
+
+
+def _heat_bucket(vol_now, atr_now):
+    """ 熱さの段。出来高かATRが無ければ None（TPはベースのまま） """
+    if vol_now > 0 and atr_now > 0:
+        heat = min(vol_now / (atr_now * 10000.0), 2.0)
+        return int(heat / HEAT_BUCKET)
+    return None
+
+
+def _tp_floor(tp_base, bucket):
+    """ 同じ段のどの heat でも、実際の tp はこれを下回らない """
+    if bucket is None:
+        return tp_base
+    lo = bucket * HEAT_BUCKET
+    hi = min(lo + HEAT_BUCKET, 2.0)
+    return min(tp_base * lo, tp_base * hi)
+
+
+def stats():
+    return dict(_stats, bands=len(_bands))
+
+
+def _band_key(side, price_now, vol_now, atr_now, vwap_now):
+    """
+    帯のキー: モデルの世代 / VWAP逆行か / 熱さの段。
+    どれも前回と同じなら sl は同じ、tp は下限以上。(key, adverse) を返す
     """
-    if not os.path.exists(MODEL_PATH):
-        return {}
-    with open(MODEL_PATH, encoding="utf-8") as f:
-        try:
-            return json.load(f)
-        except:
-            return {}
+    adverse = bool(vwap_now) and (
+        (side == "BUY" and price_now < vwap_now) or (side == "SELL" and price_now > vwap_now)
+    )
+    return (_model_cache["gen"], adverse, _heat_bucket(vol_now, atr_now)), adverse
+
+
+def _in_band(sym, entry_time, band_key, pct, mins_open):
+    """ 帯の中なら True（全判定不要）。件数もここで数える """
+    band = _bands.get(sym)
+    if band is not None and band[0] == entry_time and band[1] == band_key:
+        if band[2] < pct < band[3] and mins_open < AI_TIMEOUT_MIN:
+            _stats["skipped"] += 1
+            return True
+    else:
+        _stats["rebuilt"] += 1
+    _stats["full"] += 1
+    return False
+
+
+def _store_band(sym, entry_time, band_key, sl, tp_base):
+    _bands[sym] = (entry_time, band_key, sl, _tp_floor(tp_base, band_key[2]))
+
 
 def should_exit_now(position_dict):
     """
@@ -56,13 +158,19 @@ def should_exit_now(position_dict):
     atr_now     = float(last.get("atr", 0) or 0)
     vwap_now    = float(last.get("vwap", 0) or 0)
 
+    # --- 帯の中なら全判定しない ---
+    MODEL = _load_model()
+    band_key, _ = _band_key(side, price_now, vol_now, atr_now, vwap_now)
+    entry_time = position_dict.get("entry_time")
+    if _in_band(sym, entry_time, band_key, pct, mins_open):
+        return False, None
+
     # --- ベースラインTP/SLを決める ---
     # 学習済みモデルがあればそれを使う。
     # まだ学習データが無い銘柄は
     #   tp = +3.0%
     #   sl = -1.5%
     # を初期値として使う。（あなたの希望値）
-    MODEL = _load_model()
     thresholds = MODEL.get(sym, {"tp": 3.0, "sl": -1.5})
     tp = float(thresholds.get("tp", 3.0))
     sl = float(thresholds.get("sl", -1.5))
@@ -87,6 +195,8 @@ def should_exit_now(position_dict):
     if side == "SELL" and vwap_now and price_now > vwap_now:
         sl = max(sl, -0.4)
 
+    _store_band(sym, entry_time, band_key, sl, float(thresholds.get("tp", 3.0)))
+
     # --- リアルタイム調整その3: あえて少し我慢もする ---
     # まだ崩れてないなら、slをちょい深めに許容するロジック。
     # ここ、もともとは -1.0%ベースで「-1.5%まで許容」ってしてたけど、
@@ -116,7 +226,98 @@ def should_exit_now(position_dict):
 
     # 3) タイムアウト
     #   Pine側の保険は30分で強制クローズだから、AI側も30分で逃がす
-    if mins_open >= 30:
+    if mins_open >= AI_TIMEOUT_MIN:
         return True, ("AI_TIMEOUT", price_now)
 
     return False, None
+
+
+# ===============================
+# まとめ判定（保有中 real を1回の NumPy 計算で）
+# ===============================
+
+EXIT_NONE, EXIT_TP, EXIT_SL, EXIT_TIMEOUT = 0, 1, 2, 3
+EXIT_NAMES = [None, "AI_TP", "AI_SL", "AI_TIMEOUT"]
+_SIDE_CODE = {"BUY": 1, "SELL": -1}
+
+
+def exit_decisions(tp, sl, side, pct, price, mins, vol, atr, vwap):
+    """
+    配列版の本体。引数はどれも同じ長さの numpy 配列
+    （tp/sl はモデルのベース値、side は BUY=1 / SELL=-1 / それ以外=0）。
+    return: EXIT_NONE / EXIT_TP / EXIT_SL / EXIT_TIMEOUT の int 配列
+    should_exit_now と同じ式・同じ順番（TP → SL → タイムアウト）。
+    """
+    import numpy as np
+
+    hot = (vol > 0) & (atr > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        heat = np.minimum(vol / (atr * 10000.0), 2.0)
+    tp = np.where(hot, tp * heat, tp)
+
+    has_vwap = vwap != 0
+    adverse = has_vwap & (((side == 1) & (price < vwap)) | ((side == -1) & (price > vwap)))
+    sl = np.where(adverse, np.maximum(sl, -0.4), sl)
+
+    return np.select(
+        [pct >= tp, pct <= sl, mins >= AI_TIMEOUT_MIN],
+        [EXIT_TP, EXIT_SL, EXIT_TIMEOUT],
+        EXIT_NONE,
+    )
+
+
+def should_exit_batch(positions):
+    """
+    positions の各ポジについて should_exit_now と同じ結果を返す（同じ順のリスト）。
+    最後の tick だけ見るので、呼び出し側は判定したい tick を ticks の末尾に置いておくこと。
+    帯の中のポジは配列に載せずに (False, None)。帯は判定したポジの分だけ作り直す。
+    numpy が無ければ should_exit_now を順に呼ぶだけ。
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        return [should_exit_now(p) for p in positions]
+
+    out = [(False, None)] * len(positions)
+    idx = []
+    rows = []
+    model = _load_model()
+    for i, p in enumerate(positions):
+        if not p or p.get("closed"):
+            continue
+        ticks = p.get("ticks", [])
+        if not ticks:
+            continue
+        last = ticks[-1]
+        sym = p.get("symbol")
+        side = p.get("side")
+        pct = float(last.get("pct", 0) or 0)
+        price_now = float(last.get("price", 0) or 0)
+        mins_open = float(last.get("mins_from_entry", 0) or 0)
+        vol_now = float(last.get("volume", 0) or 0)
+        atr_now = float(last.get("atr", 0) or 0)
+        vwap_now = float(last.get("vwap", 0) or 0)
+
+        band_key, adverse = _band_key(side, price_now, vol_now, atr_now, vwap_now)
+        entry_time = p.get("entry_time")
+        if _in_band(sym, entry_time, band_key, pct, mins_open):
+            continue
+
+        th = model.get(sym, {"tp": 3.0, "sl": -1.5})
+        tp_base = float(th.get("tp", 3.0))
+        sl_base = float(th.get("sl", -1.5))
+        _store_band(sym, entry_time, band_key, max(sl_base, -0.4) if adverse else sl_base, tp_base)
+        idx.append(i)
+        rows.append((
+            tp_base, sl_base, _SIDE_CODE.get(side, 0),
+            pct, price_now, mins_open, vol_now, atr_now, vwap_now,
+        ))
+    if not rows:
+        return out
+    _stats["batch"] += len(rows)
+
+    a = np.array(rows, dtype=float)
+    code = exit_decisions(*a.T)
+    for j in np.flatnonzero(code).tolist():
+        out[idx[j]] = (True, (EXIT_NAMES[code[j]], rows[j][4]))
+    return out
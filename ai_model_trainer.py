@@ -1,12 +1,12 @@
 # ai_model_trainer.py
 # ===============================
 # 1. エグジット学習:
-#    data/learning_log.jsonl から
+#    学習ログ（learning_store: data/learning/ の日付別セグメント）から
 #    銘柄別の「どこで利確/損切りしたのが現実的か」を学習し、
 #    data/ai_dynamic_thresholds.json に書く
 #
 # 2. エントリー学習:
-#    同じ learning_log.jsonl から
+#    同じ学習ログから
 #    「どんなブレイク幅 / 出来高倍率で入ったとき勝ちやすかったか」
 #    を銘柄別に集計して
 #    data/entry_stats.json に書く
@@ -19,7 +19,14 @@
 import os, json, statistics
 from datetime import datetime, timezone, timedelta
 
-LEARN_PATH = "data/learning_log.jsonl"
+import ai_online_learner
+import learning_store
+from utils.jsonlog import get_logger
+
+log = get_logger("ai_model_trainer")
+
+# 移行前の旧ファイル（python learning_store.py migrate で data/learning/ へ移す）
+LEARN_PATH = learning_store.LEGACY_PATH
 
 TP_SL_MODEL_PATH   = "data/ai_dynamic_thresholds.json"  # 利確/損切り用
 ENTRY_MODEL_PATH   = "data/entry_stats.json"            # エントリー判定用
@@ -36,7 +43,7 @@ def _safe_float(v, default=None):
 
 def _load_learning_rows():
     """
-    learning_log.jsonl を全部読む。
+    学習ログを全部読む（セグメント + 未移行の旧 learning_log.jsonl があればそれも）。
     各行は position_manager.force_close() 時に吐かれる想定で、こんな感じ:
     {
       "symbol": "7203.T",
@@ -52,7 +59,7 @@ def _load_learning_rows():
       ]
     }
     """
-    rows = []
+    rows = list(learning_store.iter_rows())
     if not os.path.exists(LEARN_PATH):
         return rows
     with open(LEARN_PATH, "r", encoding="utf-8") as f:
@@ -90,9 +97,15 @@ def train_dynamic_thresholds():
         per_symbol_returns.setdefault(sym, []).append(final_pct)
 
     model = {}
+    online_stats = {}  # ai_online_learner 用 (件数/平均/M2)
     for sym, vals in per_symbol_returns.items():
         avg = statistics.mean(vals)
         std = statistics.pstdev(vals) if len(vals) > 1 else 0.3
+        online_stats[sym] = {
+            "n": len(vals),
+            "mean": avg,
+            "m2": statistics.pvariance(vals) * len(vals) if len(vals) > 1 else 0.0,
+        }
 
         # だいたいこのくらいで利確しておくと良かった？という閾値(tp)
         # だいたいこれくらい悪化したらやばかった、っていう下限(sl)
@@ -105,6 +118,8 @@ def train_dynamic_thresholds():
         }
 
     _write_json(TP_SL_MODEL_PATH, model)
+    # サーバ側のオンライン学習はこの統計から続きを積む
+    ai_online_learner.save_stats("exit", online_stats)
     return model
 
 # ---------------------------
@@ -162,10 +177,12 @@ def train_entry_thresholds():
         })
 
     entry_model = {}
+    online_stats = {}  # ai_online_learner 用 (件数/平均)
     for sym, arr in per_symbol_samples.items():
         # 平均値ベースで「これぐらいは欲しい」という下限を作る
         avg_pct = statistics.mean([x["pct"] for x in arr])
         avg_vol = statistics.mean([x["vol"] for x in arr])
+        online_stats[sym] = {"n": len(arr), "pct_mean": avg_pct, "vol_mean": avg_vol}
 
         # 最低ブレイク幅は勝ちパターン平均pctの80%
         learned_break = round(avg_pct * 0.8, 3)
@@ -197,6 +214,7 @@ def train_entry_thresholds():
     merged.update(entry_model)
 
     _write_json(ENTRY_MODEL_PATH, merged)
+    ai_online_learner.save_stats("entry", online_stats, merge=True)
     return merged
 
 # ---------------------------
@@ -205,19 +223,16 @@ def train_entry_thresholds():
 
 def run_daily_training():
     """
-    1日のクローズ済みデータ (learning_log.jsonl) から
+    1日のクローズ済みデータ (learning_store) から
     - 利確/損切りAIモデル (ai_dynamic_thresholds.json)
     - エントリーAIモデル (entry_stats.json)
-    を両方更新して、軽くprintする。
+    を両方更新して、軽くログに出す。
     """
     tp_sl_model = train_dynamic_thresholds()
     entry_model = train_entry_thresholds()
 
-    print("=== AIモデル更新完了 ===")
-    print("利確/損切りモデル更新 -> data/ai_dynamic_thresholds.json")
-    print(tp_sl_model)
-    print("エントリーモデル更新 -> data/entry_stats.json")
-    print(entry_model)
+    log.info("training_done", exit_model_path="data/ai_dynamic_thresholds.json", exit_model=tp_sl_model,
+             entry_model_path="data/entry_stats.json", entry_model=entry_model)
 
 
 # スクリプトとして直接叩いたとき用
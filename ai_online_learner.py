@@ -0,0 +1,337 @@
+# ai_online_learner.py
+# ===============================
+# クローズ時のオンライン学習
+#
+# 夜の cron (run_reports_daily → ai_model_trainer) を待たずに、
+# position_manager.force_close() で閉じたポジを1件ずつ取り込み、
+# 銘柄別の EXIT(tp/sl) / ENTRY(break_pct/vol_mult_req) 統計を O(1) で更新する。
+#
+# - 統計は Welford 法（件数/平均/M2）で持つので全件読み直し不要
+# - 更新後のしきい値はプロセス内で即公開（ai_exit_logic / ai_entry_logic が上書きで使う）
+# - モデルJSON（ai_dynamic_thresholds.json / entry_stats.json）は夜間バッチだけが書く。
+#   オンライン分は STATS_PATH の統計と "touched"（バッチ以降に更新した銘柄）から毎回計算し直す
+#   → モデルの mtime は夜間学習でしか変わらない（model_reload もそのときだけ）
+# - STATS_PATH への書き出しは ONLINE_FLUSH_SEC ごとに間引く。
+#   gunicorn の各ワーカーは前回の flush 以降に自分で足した分（_pending）だけを持ち、
+#   flush でファイルロックを取って 読む→足す→書く。他のワーカーの更新は消さない
+# - STATS_PATH が書き直されたら（他のワーカーの flush / 夜間バッチ）読み直して公開値も作り直す
+#   （読む側 exit_overrides / entry_overrides / version でも mtime を見るので、次のクローズを待たない）
+#   夜間バッチ（"batch" が進んだとき）は学習ログを全部読み直しているので、未 flush の分は捨てる
+# - 終了時に書き残しを flush する（atexit）
+# ===============================
+
+import os
+import json
+import math
+import time
+import atexit
+import threading
+
+from utils.file_lock import locked
+
+STATS_PATH         = "data/online_stats.json"
+
+FLUSH_INTERVAL_SEC = float(os.getenv("ONLINE_FLUSH_SEC", "60"))
+
+_lock = threading.Lock()
+_stats = None            # {"exit": {sym: {...}}, "entry": {sym: {...}}} ファイル + _pending
+_stats_mtime = None      # 最後に読んだ/書いた STATS_PATH の mtime
+_batch = 0               # 最後に読んだ STATS_PATH の "batch"（夜間バッチの回数）
+_touched = {"exit": set(), "entry": set()}     # バッチ以降にオンラインで更新された銘柄
+_pending = {"exit": {}, "entry": {}}           # 前回の flush 以降にこのプロセスで足した分
+_last_flush = 0.0
+
+# 公開中のしきい値（差し替え式。読む側はロック不要）
+_exit_published = {}     # sym -> {"tp":..,"sl":..}
+_entry_published = {}    # sym -> {"break_pct":..,"vol_mult_req":..}
+_version = 0
+
+
+def _safe_float(v, default=None):
+    try:
+        return float(v)
+    except:
+        return default
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except:
+        return {}
+
+
+def _write_json(path, obj):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+# ---------------------------
+# しきい値の計算式（ai_model_trainer と同じ）
+# ---------------------------
+
+def exit_thresholds(st):
+    """ {"n","mean","m2"} -> {"tp","sl"} """
+    n = st["n"]
+    std = math.sqrt(st["m2"] / n) if n > 1 else 0.3
+    return {
+        "tp": round(st["mean"] + std * 1.2, 2),
+        "sl": round(st["mean"] - std * 1.5, 2),
+    }
+
+
+def entry_thresholds(st):
+    """ {"n","pct_mean","vol_mean"} -> {"break_pct","vol_mult_req"} """
+    learned_break = round(st["pct_mean"] * 0.8, 3)
+    learned_vol = round(st["vol_mean"] * 0.8, 3)
+    if learned_break < 0.05:
+        learned_break = 0.05
+    if learned_vol < 1.2:
+        learned_vol = 1.2
+    return {"break_pct": learned_break, "vol_mult_req": learned_vol}
+
+
+# ---------------------------
+# 統計のマージ（別々に数えた2つを1つに）
+# ---------------------------
+
+def _merge_exit(a, b):
+    """ Welford の並列版（Chan et al.） """
+    if not a:
+        return dict(b)
+    n = a["n"] + b["n"]
+    if n == 0:
+        return dict(a)
+    delta = b["mean"] - a["mean"]
+    return {
+        "n": n,
+        "mean": a["mean"] + delta * b["n"] / n,
+        "m2": a["m2"] + b["m2"] + delta * delta * a["n"] * b["n"] / n,
+    }
+
+
+def _merge_entry(a, b):
+    if not a:
+        return dict(b)
+    n = a["n"] + b["n"]
+    if n == 0:
+        return dict(a)
+    return {
+        "n": n,
+        "pct_mean": (a["pct_mean"] * a["n"] + b["pct_mean"] * b["n"]) / n,
+        "vol_mean": (a["vol_mean"] * a["n"] + b["vol_mean"] * b["n"]) / n,
+    }
+
+
+_MERGE = {"exit": _merge_exit, "entry": _merge_entry}
+
+
+def _apply_pending(base):
+    """ ファイルの統計 base に _pending を足したもの（base は書き換えない） """
+    out = {}
+    for section in ("exit", "entry"):
+        sec = dict(base.get(section, {}) or {})
+        for sym, d in _pending[section].items():
+            sec[sym] = _MERGE[section](sec.get(sym), d)
+        out[section] = sec
+    return out
+
+
+# ---------------------------
+# 統計ファイル
+#   {"exit": {...}, "entry": {...}, "touched": {"exit": [sym...], "entry": [...]}, "batch": 3}
+# ---------------------------
+
+def _republish():
+    """ _stats と touched/_pending から公開値を作り直す（ロック内で呼ぶ） """
+    global _exit_published, _entry_published, _version
+    exit_syms = _touched["exit"] | set(_pending["exit"])
+    entry_syms = _touched["entry"] | set(_pending["entry"])
+    _exit_published = {s: exit_thresholds(_stats["exit"][s]) for s in exit_syms if s in _stats["exit"]}
+    _entry_published = {s: entry_thresholds(_stats["entry"][s]) for s in entry_syms if s in _stats["entry"]}
+    _version += 1
+
+
+def _load_file(loaded):
+    """ 読んだ STATS_PATH の中身を取り込む（ロック内で呼ぶ） """
+    global _stats, _batch, _touched, _pending
+    batch = int(loaded.get("batch", 0) or 0)
+    if _stats is not None and batch != _batch:
+        # 夜間バッチは学習ログを全部読んで作り直しているので、未 flush の分も入っている
+        _pending = {"exit": {}, "entry": {}}
+    _batch = batch
+    touched = loaded.get("touched", {}) or {}
+    _touched = {"exit": set(touched.get("exit", [])), "entry": set(touched.get("entry", []))}
+    _stats = _apply_pending(loaded)
+    _republish()
+
+
+def _reload_if_changed():
+    """ 他のワーカーの flush / 夜間バッチで STATS_PATH が書き直されていたら読み直す（ロック内で呼ぶ） """
+    global _stats_mtime
+    mt = _mtime(STATS_PATH)
+    if _stats is not None and mt == _stats_mtime:
+        return
+    _load_file(_read_json(STATS_PATH))
+    _stats_mtime = mt
+
+
+def save_stats(section, stats, merge=False):
+    """
+    ai_model_trainer から呼ぶ。全件学習で作り直した統計で section を置き換える。
+    section: "exit" / "entry"
+    merge=True なら既存の銘柄は残して上書きマージ（entry_stats.json と同じ扱い）
+    モデルJSONにはバッチ値が入るので、置き換えた銘柄は touched から外す。
+    """
+    with _lock, locked(STATS_PATH):
+        cur = _read_json(STATS_PATH)
+        touched = cur.get("touched", {}) or {}
+        touched[section] = sorted(set(touched.get(section, [])) - set(stats)) if merge else []
+        if merge:
+            merged = cur.get(section, {}) or {}
+            merged.update(stats)
+            stats = merged
+        cur[section] = stats
+        cur["touched"] = touched
+        cur["batch"] = int(cur.get("batch", 0) or 0) + 1
+        _write_json(STATS_PATH, cur)
+
+
+def _flush_locked(now):
+    """ ファイルロックを取って STATS_PATH に _pending を足し込む（_lock 内で呼ぶ） """
+    global _last_flush, _stats_mtime, _pending
+    _last_flush = now
+    if not any(_pending.values()):
+        return
+    with locked(STATS_PATH):
+        cur = _read_json(STATS_PATH)
+        if int(cur.get("batch", 0) or 0) != _batch:
+            # 読んだあとに夜間バッチが書き直していた。未 flush の分はバッチに入っている
+            _load_file(cur)
+            _stats_mtime = _mtime(STATS_PATH)
+            return
+        merged = _apply_pending(cur)
+        touched = cur.get("touched", {}) or {}
+        for section in ("exit", "entry"):
+            touched[section] = sorted(set(touched.get(section, [])) | set(_pending[section]))
+        merged["touched"] = touched
+        merged["batch"] = _batch
+        for k, v in cur.items():
+            merged.setdefault(k, v)
+        _pending = {"exit": {}, "entry": {}}
+        _write_json(STATS_PATH, merged)
+        _stats_mtime = _mtime(STATS_PATH)
+        _load_file(merged)
+
+
+# ---------------------------
+# 取り込み
+# ---------------------------
+
+def observe_close(row: dict):
+    """
+    force_close() が学習ログに書いたのと同じ行を受け取って統計を更新する。
+    学習対象の条件は ai_model_trainer と揃えてある:
+      - EXIT : final_pct がある行は全部（shadowも含む）
+      - ENTRY: status=="real" かつ final_pct>0、最初のtickに pct/volume/atr が揃っている行
+    """
+    global _exit_published, _entry_published, _version
+    if not row:
+        return
+    sym = row.get("symbol")
+    final_pct = _safe_float(row.get("final_pct"), None)
+    if sym is None or final_pct is None:
+        return
+
+    with _lock:
+        _reload_if_changed()
+
+        # --- EXIT: Welford（見える統計と、未 flush の分の両方に足す） ---
+        one = {"n": 1, "mean": final_pct, "m2": 0.0}
+        st = _merge_exit(_stats["exit"].get(sym), one)
+        _stats["exit"][sym] = st
+        _pending["exit"][sym] = _merge_exit(_pending["exit"].get(sym), one)
+
+        exit_pub = dict(_exit_published)
+        exit_pub[sym] = exit_thresholds(st)
+        _exit_published = exit_pub
+
+        # --- ENTRY: 勝ちトレの最初のtickの平均 ---
+        ticks = row.get("ticks") or []
+        if row.get("status") == "real" and final_pct > 0 and ticks:
+            first_tick = ticks[0]
+            pct0 = _safe_float(first_tick.get("pct"), None)
+            vol0 = _safe_float(first_tick.get("volume"), None)
+            atr0 = _safe_float(first_tick.get("atr"), None)
+            if pct0 is not None and vol0 is not None and atr0 is not None:
+                one = {"n": 1, "pct_mean": pct0, "vol_mean": vol0}
+                est = _merge_entry(_stats["entry"].get(sym), one)
+                _stats["entry"][sym] = est
+                _pending["entry"][sym] = _merge_entry(_pending["entry"].get(sym), one)
+
+                entry_pub = dict(_entry_published)
+                entry_pub[sym] = entry_thresholds(est)
+                _entry_published = entry_pub
+
+        _version += 1
+
+        now = time.time()
+        if now - _last_flush >= FLUSH_INTERVAL_SEC:
+            _flush_locked(now)
+
+
+def flush():
+    """ 間引きを無視して今すぐ書き出す（終了時など） """
+    with _lock:
+        if _stats is not None:
+            _flush_locked(time.time())
+
+
+# ONLINE_FLUSH_SEC 以内に終了しても更新分を落とさない
+atexit.register(flush)
+
+
+# ---------------------------
+# 判定側から読む
+# ---------------------------
+
+def _check_reload():
+    """
+    夜間バッチが統計を書き直していたら読み直して公開上書きを捨てる。
+    普段は stat 1回だけ（ロックも取らない）
+    """
+    if _stats is not None and _mtime(STATS_PATH) == _stats_mtime:
+        return
+    with _lock:
+        _reload_if_changed()
+
+
+def exit_overrides():
+    """ sym -> {"tp","sl"}（オンライン更新分のみ） """
+    _check_reload()
+    return _exit_published
+
+
+def entry_overrides():
+    """ sym -> {"break_pct","vol_mult_req"}（オンライン更新分のみ） """
+    _check_reload()
+    return _entry_published
+
+
+def version():
+    """ 公開値が変わるたびに増える番号（統計ファイルの書き直しでも増える） """
+    _check_reload()
+    return _version
@@ -0,0 +1,209 @@
+# bench/bench_nightly.py
+# ==========================================
+# 夜間ジョブ（学習 + レポート）の所要時間 / ピークメモリの計測
+#
+# 使い方（リポジトリ直下で）:
+#   python bench/bench_nightly.py                          # 10k / 100k / 1M
+#   python bench/bench_nightly.py 10k 100k --repeat 3
+#   python bench/bench_nightly.py 1M --only train_entry_thresholds --window-min 20
+#   python bench/bench_nightly.py 100k --regen --out bench/results.jsonl
+#
+# データは bench/gen_synthetic.py で作ったもの（無い/設定が違えばその場で作る）。
+# --end を付けなければ時刻は実行日基準なので、作ってから MAX_AGE_SEC 以上経ったデータは作り直す
+# （毎回その日のデータで測る）。--end を付ければ日付で照合して使い回す。
+# 計測対象の関数ごとに新しいインタプリタを立て、データのディレクトリを cwd にして
+# 1回呼ぶ。ピーク RSS はそのプロセスの ru_maxrss（import 後の値も別に出す）。
+# 学習が書き出すモデルファイルは毎回消してから走らせる（前回の結果をマージさせない）。
+# 子プロセスの「今」はデータの end の大引け後（15:30 JST）に固定する（BENCH_NOW）。
+# レポートは utcnow() から 24h/7d/30d を切るので、--end が過去でも空の集計を測らない。
+#
+# --window-min を付けると、cron で毎日走る分
+#   (train_dynamic_thresholds + train_entry_thresholds + generate_daily_report)
+# の合計がその枠に収まるかを最後に出す。
+# ==========================================
+
+import os
+import sys
+import json
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import gen_synthetic  # noqa: E402
+
+REPO_ROOT = gen_synthetic.REPO_ROOT
+
+DEFAULT_SIZES = ["10k", "100k", "1M"]
+
+# --end 無しで作ったデータの使い回し期限
+MAX_AGE_SEC = 24 * 3600
+
+TARGETS = {
+    "train_dynamic_thresholds": ("ai_model_trainer", "train_dynamic_thresholds"),
+    "train_entry_thresholds":   ("ai_model_trainer", "train_entry_thresholds"),
+    "generate_daily_report":    ("report_daily", "generate_daily_report"),
+    "generate_weekly_report":   ("report_weekly", "generate_weekly_report"),
+    "generate_monthly_report":  ("report_monthly", "generate_monthly_report"),
+}
+
+# run_reports_daily.py が毎日やる分
+NIGHTLY = ("train_dynamic_thresholds", "train_entry_thresholds", "generate_daily_report")
+
+# 学習の出力（前回分が残っていると entry_stats はマージされる）
+MODEL_OUTPUTS = ("data/ai_dynamic_thresholds.json", "data/entry_stats.json", "data/online_stats.json")
+
+# 子プロセス側: import → 計測 → 結果を1行で出す
+_CHILD = r"""
+import os, sys, time, json, resource, importlib
+import datetime as _dt
+mod, fn = sys.argv[1], sys.argv[2]
+if os.environ.get("BENCH_NOW"):
+    # 計測対象を import する前に datetime.now / utcnow を差し替える（from datetime import datetime で拾われる）
+    _FROZEN = _dt.datetime.fromisoformat(os.environ["BENCH_NOW"])
+    class _FrozenDatetime(_dt.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return _FROZEN.astimezone(tz) if tz else _FROZEN.astimezone().replace(tzinfo=None)
+        @classmethod
+        def utcnow(cls):
+            return _FROZEN.astimezone(_dt.timezone.utc).replace(tzinfo=None)
+        @classmethod
+        def today(cls):
+            return cls.now()
+    _dt.datetime = _FrozenDatetime
+scale = 1 if sys.platform == "darwin" else 1024   # ru_maxrss は Linux だと KB
+t0 = time.perf_counter()
+m = importlib.import_module(mod)
+import_sec = time.perf_counter() - t0
+rss_import = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+t0 = time.perf_counter()
+getattr(m, fn)()
+wall = time.perf_counter() - t0
+rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+print("BENCH_RESULT " + json.dumps({
+    "wall_sec": wall, "import_sec": import_sec, "rss_import": rss_import, "rss_peak": rss_peak,
+}))
+"""
+
+
+def _matches(manifest, n, kw):
+    if not manifest or manifest.get("positions") != n:
+        return False
+    for k, v in kw.items():
+        if k == "end":
+            continue
+        if manifest.get(k if k != "fmt" else "format") != v:
+            return False
+    if kw.get("end") is not None:
+        return manifest.get("end") == gen_synthetic.end_date(kw["end"]).isoformat()
+    # 実行日基準のデータ。作ってから1日以上経っていれば（日付も変わっているので）作り直す
+    try:
+        made = datetime.fromisoformat(manifest["generated_at"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    now = datetime.now(gen_synthetic.JST)
+    return (manifest.get("end") == now.date().isoformat()
+            and now - made < timedelta(seconds=MAX_AGE_SEC))
+
+
+def ensure_dataset(n, kw, regen=False):
+    m = gen_synthetic.load_manifest(n)
+    if regen or not _matches(m, n, kw):
+        print(f"-- {gen_synthetic.size_label(n)}: 合成データを作成中 ...", flush=True)
+        m = gen_synthetic.generate(n, **kw)
+    return gen_synthetic.dataset_dir(n), m
+
+
+def bench_now(manifest) -> str:
+    """ 子プロセスの「今」: データの最後の営業日の大引け後 """
+    return f"{manifest['end']}T15:30:00+09:00"
+
+
+def run_one(name, data_dir, now=None):
+    mod, fn = TARGETS[name]
+    for p in MODEL_OUTPUTS:
+        path = os.path.join(data_dir, p)
+        if os.path.exists(path):
+            os.remove(path)
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO_ROOT + (os.pathsep + env["PYTHONPATH"] if env.get("PYTHONPATH") else "")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    if now:
+        env["BENCH_NOW"] = now
+    proc = subprocess.run(
+        [sys.executable, "-c", _CHILD, mod, fn],
+        cwd=data_dir, env=env, capture_output=True, text=True,
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith("BENCH_RESULT "):
+            return json.loads(line[len("BENCH_RESULT "):])
+    last = (proc.stderr.strip().splitlines() or ["?"])[-1]
+    raise RuntimeError(f"{name} が失敗 (rc={proc.returncode}): {last}")
+
+
+def bench(name, data_dir, repeat, now=None):
+    """ repeat 回走らせて wall は最小、RSS は最大を採る """
+    runs = [run_one(name, data_dir, now) for _ in range(repeat)]
+    return {
+        "wall_sec": min(r["wall_sec"] for r in runs),
+        "import_sec": min(r["import_sec"] for r in runs),
+        "rss_import_mb": max(r["rss_import"] for r in runs) / 1e6,
+        "rss_peak_mb": max(r["rss_peak"] for r in runs) / 1e6,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="学習/レポートのベンチ（wall time / peak RSS）")
+    ap.add_argument("sizes", nargs="*", default=DEFAULT_SIZES)
+    ap.add_argument("--only", action="append", choices=sorted(TARGETS), help="この関数だけ（複数可）")
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--regen", action="store_true", help="データを作り直す")
+    ap.add_argument("--window-min", type=float, default=None, help="cron の枠（分）")
+    ap.add_argument("--out", default=None, help="結果を JSONL で追記するパス")
+    gen_synthetic.add_generate_args(ap)
+    args = ap.parse_args()
+
+    kw = gen_synthetic.gen_kwargs(args)
+    names = args.only or list(TARGETS)
+    stamp = datetime.now(gen_synthetic.JST).isoformat(timespec="seconds")
+    results = []
+
+    for s in args.sizes:
+        n = gen_synthetic.parse_size(s)
+        label = gen_synthetic.size_label(n)
+        data_dir, manifest = ensure_dataset(n, kw, args.regen)
+        print(f"== {label}: {manifest['positions']} positions ({manifest['real']} real), "
+              f"learning {manifest['learning_bytes'] / 1e6:.1f} MB, "
+              f"trade_log {manifest['trade_log_bytes'] / 1e6:.1f} MB")
+
+        nightly = 0.0
+        for name in names:
+            try:
+                r = bench(name, data_dir, args.repeat, bench_now(manifest))
+            except RuntimeError as e:
+                print(f"   {name:<26} {e}")
+                continue
+            print(f"   {name:<26} {r['wall_sec']:9.2f} s   peak {r['rss_peak_mb']:8.1f} MB"
+                  f"   (import {r['import_sec'] * 1000:.0f} ms / {r['rss_import_mb']:.1f} MB)")
+            if name in NIGHTLY:
+                nightly += r["wall_sec"]
+            results.append({"time": stamp, "size": label, "target": name, **r,
+                            "manifest": manifest, "python": platform.python_version()})
+
+        if args.window_min is not None and all(t in names for t in NIGHTLY):
+            window = args.window_min * 60.0
+            verdict = "OK" if nightly <= window else "OVER"
+            print(f"   nightly {nightly:.1f} s / window {window:.0f} s → {verdict} ({nightly / window * 100:.0f}%)")
+
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            for r in results:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+# bench/gen_synthetic.py
+# ==========================================
+# ベンチ用の合成データを作る（seed と --end の日付が同じなら毎回同じ中身）
+#
+# 使い方（リポジトリ直下で）:
+#   python bench/gen_synthetic.py 10k
+#   python bench/gen_synthetic.py 100k 1M --format jsonl
+#   python bench/gen_synthetic.py 1M --ticks-mean 8 --days 120 --seed 7
+#   python bench/gen_synthetic.py 100k --end 2025-10-31          # 日付を固定（実行日が変わっても同じ中身）
+#
+# 出力: bench/data/<size>/data/ 以下に、本番と同じ相対パスで
+#   learning/YYYYMMDD.seg/.idx   学習ログ（learning_store の形式。--format jsonl なら learning_log.jsonl）
+#   trade_log.csv                本ポジの ENTRY 行と決済行（時系列順）
+# と bench/data/<size>/manifest.json（件数・seed・end・サイズ）。
+# bench/bench_nightly.py はこのディレクトリを cwd にして学習/レポートを走らせる。
+#
+# 中身の作り:
+#   - 銘柄は data/universe.txt から。出現頻度は順位の 0.8 乗に反比例（偏りあり）
+#   - 直近 --days 営業日の場中（9:00-11:30 / 12:30-15:25 JST）にエントリー時刻を散らす
+#   - tick は1分1本。保有分数は対数正規（平均 --ticks-mean 本、上限 SHADOW/AI のタイムアウト相当）
+#   - 本ポジ（--real-ratio）は AI_/Pine の決済理由、残りは shadow_pending → expired_pending
+#   - 件数を稼ぐため同じ銘柄のポジが時間的に重なることもある（本番は1銘柄1ポジ）
+#   - 時刻は --end（既定は実行日）から遡って振る（レポートの 24h/7d/30d 窓に乗るように）。
+#     --end を付けないと日付が変われば中身も変わる。seed と end が同じときだけ同じ中身
+#   1M 件・平均 15 本だと学習ログは gzip 後でも GB 単位になるので空き容量に注意。
+# ==========================================
+
+import os
+import sys
+import csv
+import json
+import math
+import heapq
+import random
+import argparse
+from datetime import date, datetime, timedelta, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import learning_store  # noqa: E402
+
+JST = timezone(timedelta(hours=9))
+
+BENCH_DATA_DIR = os.path.join(REPO_ROOT, "bench", "data")
+UNIVERSE_PATH = os.path.join(REPO_ROOT, "data", "universe.txt")
+
+MAX_HOLD_MIN = 35          # AI_TIMEOUT_MIN + 猶予 / SHADOW_EXPIRE_MIN あたり
+SESSIONS = ((9 * 60, 11 * 60 + 30), (12 * 60 + 30, 15 * 60 + 25))   # 場中（分）
+
+TRADE_FIELDS = ["timestamp", "symbol", "side", "entry_price", "exit_price", "pnl_pct", "reason"]
+
+
+def parse_size(s) -> int:
+    """ "10k" / "100k" / "1M" / "2500" → 件数 """
+    s = str(s).strip().lower()
+    mult = 1
+    if s.endswith("k"):
+        mult, s = 1000, s[:-1]
+    elif s.endswith("m"):
+        mult, s = 1000000, s[:-1]
+    return int(float(s) * mult)
+
+
+def size_label(n) -> str:
+    if n >= 1000000 and n % 1000000 == 0:
+        return f"{n // 1000000}M"
+    if n >= 1000 and n % 1000 == 0:
+        return f"{n // 1000}k"
+    return str(n)
+
+
+def dataset_dir(n) -> str:
+    return os.path.join(BENCH_DATA_DIR, size_label(n))
+
+
+def load_universe():
+    syms = []
+    with open(UNIVERSE_PATH, "r", encoding="utf-8") as f:
+        for line in f:
+            s = line.strip()
+            if s and not s.startswith("#"):
+                syms.append(s)
+    return syms
+
+
+def end_date(end=None):
+    """ None（今日）/ "2025-10-31" / date / datetime → date（JST） """
+    if end is None:
+        return datetime.now(JST).date()
+    if isinstance(end, datetime):
+        return end.astimezone(JST).date() if end.tzinfo else end.date()
+    if isinstance(end, date):
+        return end
+    return date.fromisoformat(str(end))
+
+
+def _trading_days(n_days, end):
+    out = []
+    d = end
+    while len(out) < n_days:
+        if d.weekday() < 5:
+            out.append(d)
+        d -= timedelta(days=1)
+    return sorted(out)
+
+
+def _session_minute(rng):
+    """ 場中のどこか（寄り付き直後に少し寄せる） """
+    total = sum(b - a for a, b in SESSIONS)
+    m = int(total * (rng.random() ** 1.3))
+    for a, b in SESSIONS:
+        if m < b - a:
+            return a + m
+        m -= b - a
+    return SESSIONS[-1][1] - 1
+
+
+def _entry_times(rng, n, days):
+    """ n 件のエントリー時刻（JST, 昇順） """
+    ts = []
+    for _ in range(n):
+        d = days[rng.randrange(len(days))]
+        m = _session_minute(rng)
+        ts.append(datetime(d.year, d.month, d.day, m // 60, m % 60, rng.randrange(60), tzinfo=JST))
+    ts.sort()
+    return ts
+
+
+class _SymbolProfile:
+    __slots__ = ("base", "atr", "drift", "vol", "tp", "sl")
+
+    def __init__(self, rng):
+        self.base = rng.choice((300, 800, 1500, 3000, 6000, 12000)) * rng.uniform(0.8, 1.2)
+        self.atr = self.base * rng.uniform(0.002, 0.006)
+        self.drift = rng.uniform(-0.004, 0.006)      # 1分あたりの pct ドリフト
+        self.vol = rng.uniform(0.04, 0.12)           # 1分あたりの pct のブレ
+        self.tp = rng.uniform(0.6, 1.4)
+        self.sl = -rng.uniform(0.4, 1.0)
+
+
+def _position(rng, sym, prof, entry_t, real, ticks_mean):
+    side = "BUY" if rng.random() < 0.6 else "SELL"
+    entry_price = round(prof.base * rng.uniform(0.97, 1.03), 1)
+    sigma = 0.6
+    mu = math.log(max(ticks_mean, 1)) - sigma * sigma / 2
+    hold = max(1, min(int(rng.lognormvariate(mu, sigma)) + 1, MAX_HOLD_MIN))
+
+    ticks = []
+    pct = rng.uniform(0.05, 0.4)                     # ブレイク直後の勢い
+    vwap = entry_price
+    vol_mult = rng.uniform(1.1, 3.5)
+    reason = None
+    for i in range(hold):
+        if i:
+            pct += prof.drift + rng.gauss(0, prof.vol)
+        sign = 1 if side == "BUY" else -1
+        price = round(entry_price * (1 + sign * pct / 100.0), 1)
+        vwap = round(vwap * 0.9 + price * 0.1, 2)
+        ticks.append({
+            "t": (entry_t + timedelta(minutes=i)).isoformat(timespec="seconds"),
+            "price": price,
+            "pct": round(pct, 3),
+            "mins_from_entry": float(i),
+            "volume": round(vol_mult * rng.uniform(0.7, 1.3), 2),
+            "vwap": vwap,
+            "atr": round(prof.atr * rng.uniform(0.9, 1.1), 2),
+        })
+        if real and i and (pct >= prof.tp or pct <= prof.sl):
+            reason = "AI_TP" if pct >= prof.tp else "AI_SL"
+            break
+
+    close_t = entry_t + timedelta(minutes=len(ticks))
+    if real:
+        if reason is None:
+            reason = "AI_TIMEOUT"
+        if rng.random() < 0.1:                       # Pine 側の保険決済
+            reason = {"AI_TP": "TP", "AI_SL": "SL", "AI_TIMEOUT": "TIMEOUT"}[reason]
+        status = "real"
+    else:
+        reason = "expired_pending"
+        status = "shadow_pending"
+
+    last = ticks[-1]
+    return {
+        "symbol": sym,
+        "side": side,
+        "status": status,
+        "entry_price": entry_price,
+        "entry_time": entry_t.isoformat(timespec="seconds"),
+        "close_price": last["price"],
+        "close_time": close_t.isoformat(timespec="seconds"),
+        "close_reason": reason,
+        "final_pct": last["pct"],
+        "ticks": ticks,
+    }
+
+
+def generate(n, out_dir=None, seed=42, days=60, ticks_mean=15.0, real_ratio=0.4, fmt="store", end=None):
+    """ n 件ぶん書いて manifest を返す """
+    out_dir = out_dir or dataset_dir(n)
+    data_dir = os.path.join(out_dir, "data")
+    store_dir = os.path.join(data_dir, "learning")
+    jsonl_path = os.path.join(data_dir, "learning_log.jsonl")
+    trade_path = os.path.join(data_dir, "trade_log.csv")
+
+    # 前回の中身が残っていると件数が合わなくなるので消してから作る
+    if os.path.isdir(store_dir):
+        for name in os.listdir(store_dir):
+            os.remove(os.path.join(store_dir, name))
+    for p in (jsonl_path, trade_path):
+        if os.path.exists(p):
+            os.remove(p)
+    os.makedirs(data_dir, exist_ok=True)
+
+    rng = random.Random(seed)
+    universe = load_universe()
+    order = universe[:]
+    rng.shuffle(order)
+    weights = [1.0 / (i + 1) ** 0.8 for i in range(len(order))]
+    profiles = {s: _SymbolProfile(rng) for s in order}
+
+    end = end_date(end)
+    entry_times = _entry_times(rng, n, _trading_days(days, end))
+
+    n_real = 0
+    pending = []       # (決済時刻, 連番, 決済行) — trade_log を時系列順に書くため
+    seq = 0
+    jsonl = open(jsonl_path, "w", encoding="utf-8") if fmt == "jsonl" else None
+    with open(trade_path, "w", encoding="utf-8", newline="") as tf:
+        writer = csv.DictWriter(tf, fieldnames=TRADE_FIELDS)
+        writer.writeheader()
+        for entry_t in entry_times:
+            sym = rng.choices(order, weights)[0]
+            real = rng.random() < real_ratio
+            row = _position(rng, sym, profiles[sym], entry_t, real, ticks_mean)
+
+            if jsonl is not None:
+                jsonl.write(json.dumps(row, ensure_ascii=False) + "\n")
+            else:
+                learning_store.append(row, root=store_dir)
+
+            if not real:
+                continue
+            n_real += 1
+            while pending and pending[0][0] <= entry_t:
+                writer.writerow(heapq.heappop(pending)[2])
+            writer.writerow({
+                "timestamp": row["entry_time"], "symbol": sym, "side": row["side"],
+                "entry_price": row["entry_price"], "exit_price": "", "pnl_pct": "", "reason": "ENTRY",
+            })
+            seq += 1
+            heapq.heappush(pending, (datetime.fromisoformat(row["close_time"]), seq, {
+                "timestamp": row["close_time"], "symbol": sym, "side": row["side"],
+                "entry_price": row["entry_price"], "exit_price": row["close_price"],
+                "pnl_pct": round(row["final_pct"], 2), "reason": row["close_reason"],
+            }))
+        while pending:
+            writer.writerow(heapq.heappop(pending)[2])
+    if jsonl is not None:
+        jsonl.close()
+
+    def _size(path):
+        if os.path.isdir(path):
+            return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    manifest = {
+        "positions": n,
+        "real": n_real,
+        "seed": seed,
+        "days": days,
+        "ticks_mean": ticks_mean,
+        "real_ratio": real_ratio,
+        "format": fmt,
+        "end": end.isoformat(),
+        "symbols": len(universe),
+        "learning_bytes": _size(jsonl_path) if fmt == "jsonl" else _size(store_dir),
+        "trade_log_bytes": _size(trade_path),
+        "generated_at": datetime.now(JST).isoformat(timespec="seconds"),
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def load_manifest(n, out_dir=None):
+    path = os.path.join(out_dir or dataset_dir(n), "manifest.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def add_generate_args(ap):
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--days", type=int, default=60, help="何営業日ぶんに散らすか")
+    ap.add_argument("--ticks-mean", type=float, default=15.0, help="1ポジあたりの平均 tick 本数")
+    ap.add_argument("--real-ratio", type=float, default=0.4, help="本ポジの割合（残りは shadow）")
+    ap.add_argument("--format", choices=("store", "jsonl"), default="store",
+                    help="学習ログの形式（store=日付別セグメント / jsonl=移行前の1ファイル）")
+    ap.add_argument("--end", type=date.fromisoformat, default=None,
+                    help="最後の営業日 YYYY-MM-DD（省略時は実行日）")
+
+
+def gen_kwargs(args):
+    return {
+        "seed": args.seed, "days": args.days, "ticks_mean": args.ticks_mean,
+        "real_ratio": args.real_ratio, "fmt": args.format, "end": args.end,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="学習ログ/trade_log の合成データ生成")
+    ap.add_argument("sizes", nargs="*", default=["10k"], help="件数（10k / 100k / 1M など）")
+    add_generate_args(ap)
+    args = ap.parse_args()
+
+    for s in args.sizes:
+        n = parse_size(s)
+        m = generate(n, **gen_kwargs(args))
+        print(f"== {size_label(n)}: {m['positions']} positions ({m['real']} real) "
+              f"learning {m['learning_bytes'] / 1e6:.1f} MB, trade_log {m['trade_log_bytes'] / 1e6:.1f} MB "
+              f"→ {dataset_dir(n)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# bench/import_time.py
+# ==========================================
+# import 時間の計測（python -X importtime を集計するだけ）
+#
+# 使い方（リポジトリ直下で）:
+#   python bench/import_time.py
+#   python bench/import_time.py run_reports_daily ai.trailing_ai --top 15
+#
+# 各モジュールを新しいインタプリタで -X importtime 付きで import し、
+#   - 合計 import 時間（そのモジュールの cumulative）
+#   - 重い順 top N の内訳
+# を表示する。cron 起動の短命ジョブで重い依存を引き込んでないか確認する用。
+# ==========================================
+
+import os
+import sys
+import argparse
+import subprocess
+
+DEFAULT_MODULES = [
+    "run_reports",
+    "run_reports_daily",
+    "run_reports_weekly",
+    "run_reports_monthly",
+    "ai.trailing_ai",
+    "ai_model_trainer",
+]
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module, repeat=3):
+    """
+    -X importtime の出力を読んで {モジュール名: cumulative us} を返す。
+    repeat 回測って各モジュールの最小値を採る（ディスクキャッシュのブレ対策）。
+    """
+    best = {}
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=REPO_ROOT, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            last = proc.stderr.strip().splitlines()[-1:] or ["?"]
+            raise RuntimeError(f"{module} の import に失敗: {last[0]}")
+        for line in proc.stderr.splitlines():
+            # "import time: self [us] | cumulative | imported package"
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            try:
+                _, rest = line.split(":", 1)
+                self_us, cum_us, name = rest.split("|", 2)
+                cum = int(cum_us.strip())
+            except ValueError:
+                continue
+            name = name.strip()
+            if name not in best or cum < best[name]:
+                best[name] = cum
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description="import時間ベンチ (-X importtime)")
+    ap.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    for mod in args.modules:
+        try:
+            res = measure(mod, repeat=args.repeat)
+        except RuntimeError as e:
+            print(f"== {mod}: {e}")
+            continue
+        total = res.get(mod, 0)
+        print(f"== {mod}: {total / 1000.0:.1f} ms")
+        heavy = sorted(
+            ((n, us) for n, us in res.items() if n != mod),
+            key=lambda x: x[1], reverse=True,
+        )[:args.top]
+        for name, us in heavy:
+            print(f"   {us / 1000.0:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# event_lanes.py
+# ===============================
+# webhook イベントの優先レーン
+#
+# 09:00 の寄りは ENTRY と PRICE_TICK がユニバース分まとめて来るので、
+# 全部を到着順に処理すると shadow の tick が本ポジの決済を待たせてしまう。
+# そこで server.webhook は受けたイベントをレーンに積むだけにして、
+# ワーカースレッドが優先度の高いレーンから順に処理する。
+#
+#   0: EXIT        Pine保険(TP/SL/TIMEOUT) や本ポジの決済系
+#   1: ENTRY       ENTRY_BUY / ENTRY_SELL
+#   2: REAL_TICK   本ポジの PRICE_TICK
+#   3: SHADOW_TICK shadow（と未保持銘柄）の PRICE_TICK
+#
+# SHADOW_TICK は銘柄ごとに最新の1件へまとめる（coalesce）。
+# それでも未処理の銘柄数が SHADOW_BACKLOG_MAX を超えたら新しい銘柄の tick は捨てる（shed）。
+# 件数は stats() で見られる（server の /metrics）。
+#
+# batch_lanes={lane: (window_sec, max_items)} を渡したレーンは、先頭が積まれてから
+# window_sec 経つまで溜めてから最大 max_items 件まとめて handler に渡す
+# （ENTRY の寄り付きまとめ採否用。待っている間も他のレーンは処理する）。
+# ===============================
+
+import os
+import time
+import threading
+from collections import deque, OrderedDict
+
+from utils.jsonlog import get_logger
+
+log = get_logger("event_lanes")
+
+LANE_EXIT        = 0
+LANE_ENTRY       = 1
+LANE_REAL_TICK   = 2
+LANE_SHADOW_TICK = 3
+
+LANE_NAMES = ["exit", "entry", "real_tick", "shadow_tick"]
+
+SHADOW_BACKLOG_MAX = int(os.getenv("SHADOW_BACKLOG_MAX", "200"))
+
+
+class LaneDispatcher:
+    """
+    handler(lane, items) を1本のワーカースレッドで優先度順に呼ぶ。
+    items は通常1件のリスト、batch_lanes のレーンだけ複数件。
+    同じレーン内は到着順（SHADOW_TICK は銘柄ごとに最新だけ）。
+    """
+
+    def __init__(self, handler, shadow_backlog_max: int = SHADOW_BACKLOG_MAX, batch_lanes=None):
+        self.handler = handler
+        self.shadow_backlog_max = shadow_backlog_max
+        self.batch_lanes = dict(batch_lanes or {})
+        self._lanes = [deque(), deque(), deque()]   # EXIT / ENTRY / REAL_TICK  要素は (積んだ時刻, item)
+        self._shadow = OrderedDict()                # symbol -> item（最新だけ）
+        self._cv = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self.enqueued = [0] * len(LANE_NAMES)
+        self.processed = [0] * len(LANE_NAMES)
+        self.coalesced = 0
+        self.shed = 0
+        self.errors = 0
+
+    # ---- 投入 ----
+
+    def submit(self, lane: int, symbol: str, item) -> bool:
+        """ 積めたら True。shadow tick を捨てたときだけ False """
+        with self._cv:
+            if lane == LANE_SHADOW_TICK:
+                if symbol in self._shadow:
+                    self._shadow[symbol] = item
+                    self.coalesced += 1
+                    return True
+                if len(self._shadow) >= self.shadow_backlog_max:
+                    self.shed += 1
+                    return False
+                self._shadow[symbol] = item
+            else:
+                self._lanes[lane].append((time.time(), item))
+            self.enqueued[lane] += 1
+            self._ensure_thread()
+            self._cv.notify()
+        return True
+
+    # ---- 取り出し ----
+
+    def _take_locked(self):
+        """ (lane, items) か、何も出せなければ (None, 次に出せる時刻 or None) """
+        now = time.time()
+        wake = None
+        for lane, q in enumerate(self._lanes):
+            if not q:
+                continue
+            if lane in self.batch_lanes:
+                window, max_items = self.batch_lanes[lane]
+                ready_at = q[0][0] + window
+                if ready_at > now and len(q) < max_items:
+                    wake = ready_at if wake is None else min(wake, ready_at)
+                    continue
+                items = [q.popleft()[1] for _ in range(min(len(q), max_items))]
+                return lane, items
+            return lane, [q.popleft()[1]]
+        if self._shadow:
+            _, item = self._shadow.popitem(last=False)
+            return LANE_SHADOW_TICK, [item]
+        return None, wake
+
+    def backlog(self):
+        with self._cv:
+            return [len(q) for q in self._lanes] + [len(self._shadow)]
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                lane, items = self._take_locked()
+                while lane is None and not self._stopped:
+                    self._cv.wait(None if items is None else max(items - time.time(), 0.001))
+                    lane, items = self._take_locked()
+                if lane is None:
+                    return
+                self.processed[lane] += len(items)
+            try:
+                self.handler(lane, items)
+            except Exception as e:
+                self.errors += 1
+                log.error("lane_failed", lane=LANE_NAMES[lane], n=len(items), exc=e)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self._loop, name="event-lanes", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cv:
+            self._stopped = True
+            self._cv.notify_all()
+
+    def stats(self):
+        backlog = self.backlog()
+        with self._cv:
+            return {
+                "backlog": dict(zip(LANE_NAMES, backlog)),
+                "enqueued": dict(zip(LANE_NAMES, self.enqueued)),
+                "processed": dict(zip(LANE_NAMES, self.processed)),
+                "coalesced": self.coalesced,
+                "shed": self.shed,
+                "errors": self.errors,
+            }
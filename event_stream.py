@@ -0,0 +1,111 @@
+# event_stream.py
+# ===============================
+# /events（Server-Sent Events）用のブローカー
+#
+# server のハンドラが publish(kind, data) すると、購読中の全員のキューに1件ずつ積む。
+# 送る文字列（"id: / event: / data:"）は publish で1回だけ作って全員で共有する。
+#   kind: entry / promotion / exit / shadow_expiry / model_reload
+#
+# 購読者ごとのキューは SSE_QUEUE_MAX 件まで。溢れた（読むのが遅い）購読者は切る。
+# publish はキューに put_nowait するだけなので webhook の処理は待たされない。
+# 1本の接続は SSE_MAX_LIFETIME_SEC で閉じる（event: reconnect を送る）。EventSource は retry 後に
+# 自動で繋ぎ直すので、ワーカーの再起動やスレッドの偏りを溜め込まない。
+# 繋いでいる間はリクエストのスレッドを1本使うので、gunicorn は gthread / gevent で動かすこと。
+# ===============================
+
+import os
+import json
+import queue
+import threading
+import time
+
+SSE_QUEUE_MAX       = int(os.getenv("SSE_QUEUE_MAX", "256"))
+SSE_MAX_SUBSCRIBERS = int(os.getenv("SSE_MAX_SUBSCRIBERS", "20"))
+SSE_KEEPALIVE_SEC   = float(os.getenv("SSE_KEEPALIVE_SEC", "15"))
+SSE_MAX_LIFETIME_SEC = float(os.getenv("SSE_MAX_LIFETIME_SEC", "600"))
+
+
+class Subscriber:
+    __slots__ = ("q", "dropped", "since")
+
+    def __init__(self, maxsize):
+        self.q = queue.Queue(maxsize=maxsize)
+        self.dropped = False
+        self.since = time.time()
+
+
+class EventBroker:
+    def __init__(self, queue_max: int = SSE_QUEUE_MAX, max_subscribers: int = SSE_MAX_SUBSCRIBERS):
+        self.queue_max = queue_max
+        self.max_subscribers = max_subscribers
+        self._subs = set()
+        self._lock = threading.Lock()
+        self._seq = 0
+        self.published = 0
+        self.dropped = 0
+
+    # ---- 購読 ----
+
+    def subscribe(self):
+        """ 上限に達していたら None """
+        with self._lock:
+            if len(self._subs) >= self.max_subscribers:
+                return None
+            sub = Subscriber(self.queue_max)
+            self._subs.add(sub)
+            return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subs.discard(sub)
+
+    # ---- 配信 ----
+
+    def publish(self, kind: str, data: dict):
+        with self._lock:
+            if not self._subs:
+                return
+            self._seq += 1
+            msg = f"id: {self._seq}\nevent: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+            subs = list(self._subs)
+            self.published += 1
+        for sub in subs:
+            try:
+                sub.q.put_nowait(msg)
+            except queue.Full:
+                # 読むのが遅い購読者は切る（溜め込んでサーバのメモリを食わせない）
+                sub.dropped = True
+                with self._lock:
+                    self._subs.discard(sub)
+                    self.dropped += 1
+
+    def stream(self, sub):
+        """ Response に渡すジェネレータ。切断/ドロップで unsubscribe する """
+        deadline = sub.since + SSE_MAX_LIFETIME_SEC
+        try:
+            yield "retry: 3000\n: connected\n\n"
+            while not sub.dropped:
+                left = deadline - time.time()
+                if left <= 0:
+                    # 寿命。EventSource は retry 後に自分で繋ぎ直す（間の分は /positions で取り直す）
+                    yield "event: reconnect\ndata: {}\n\n"
+                    return
+                try:
+                    yield sub.q.get(timeout=min(SSE_KEEPALIVE_SEC, left))
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+            # 取りこぼしがあるので、クライアントは /positions で取り直してから繋ぎ直す
+            yield "event: dropped\ndata: {}\n\n"
+        finally:
+            self.unsubscribe(sub)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": len(self._subs),
+                "published": self.published,
+                "dropped": self.dropped,
+            }
+
+
+BROKER = EventBroker()
@@ -1,14 +1,13 @@
 # learning_logger.py
 #
 # ポジションがクローズしたときに、その内容を学習用ログとして追記保存する。
-# 出力形式は data/learning_log.jsonl に1行1JSONで積んでいく。
+# 保存先は learning_store（data/learning/ の日付別圧縮セグメント + 銘柄索引）。
 
-import os
-import json
 from datetime import datetime, timezone, timedelta
 
+import learning_store
+
 JST = timezone(timedelta(hours=9))
-LEARN_LOG_PATH = "data/learning_log.jsonl"
 
 
 def _now_jst_iso():
@@ -67,6 +66,4 @@ def log_position(final_pos: dict):
         "ticks": ticks,
     }
 
-    os.makedirs(os.path.dirname(LEARN_LOG_PATH), exist_ok=True)
-    with open(LEARN_LOG_PATH, "a", encoding="utf-8") as f:
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    learning_store.append(record)
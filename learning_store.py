@@ -0,0 +1,292 @@
+# learning_store.py
+# ===============================
+# 学習ログ（クローズしたポジ1件=1行）の保存先
+#
+# 旧: data/learning_log.jsonl に全部追記（tick 列ごと。ずっと太り続ける）
+# 新: 日付ごとの圧縮セグメント + 銘柄別のオフセット索引
+#
+#   data/learning/20251029.seg   1件ごとに独立した gzip メンバーを連結したもの
+#   data/learning/20251029.idx   1件1行  "銘柄<TAB>オフセット<TAB>バイト数<TAB>close_time"
+#
+# 日付はクローズ日（JST）。銘柄は "7203" / "7203.T" の揺れを "7203.T" に揃えて索引する。
+# 「7203.T の直近60日」は、範囲内の日付の .idx だけ読み、該当メンバーだけ seek して解凍する。
+# 全件読み（夜間の学習）はセグメントを頭から流し読みする。
+#
+#   import learning_store
+#   learning_store.append(row)
+#   for row in learning_store.iter_rows(symbol="7203.T", days=60): ...
+#   for row in learning_store.iter_rows(): ...            # 全部
+#
+# 書き込みは .seg と .idx の追記をまとめて fcntl.flock（<日付>.seg.lock）で囲み、
+# オフセットはロックを取ってから測る（gunicorn の複数ワーカーや migrate が同時に書いても索引がずれない）。
+#
+# 旧ファイルからの移行:
+#   python learning_store.py migrate [data/learning_log.jsonl]
+#   （移し終えたら元ファイルは .migrated に改名。二重に取り込まない）
+#   python learning_store.py reindex 20251029             # .idx を .seg から作り直す
+# ===============================
+
+import os
+import sys
+import gzip
+import json
+import threading
+import zlib
+from datetime import datetime, date, timezone, timedelta
+
+from utils.file_lock import locked
+from utils.jsonlog import get_logger
+
+log = get_logger("learning_store")
+
+JST = timezone(timedelta(hours=9))
+
+STORE_DIR = "data/learning"
+LEGACY_PATH = "data/learning_log.jsonl"
+
+_GZIP_MAGIC = b"\x1f\x8b\x08"
+
+_lock = threading.Lock()
+
+
+def norm_symbol(symbol) -> str:
+    """ "7203" / "285a" → "7203.T" / "285A.T"。それ以外は大文字にするだけ """
+    s = (symbol or "").strip().upper()
+    if "." not in s and len(s) == 4 and s.isalnum():
+        return s + ".T"
+    return s
+
+
+def _row_day(row) -> str:
+    for key in ("close_time", "entry_time"):
+        try:
+            return datetime.fromisoformat(row[key]).astimezone(JST).strftime("%Y%m%d")
+        except (KeyError, TypeError, ValueError):
+            continue
+    return datetime.now(JST).strftime("%Y%m%d")
+
+
+def _as_day(d) -> str:
+    if d is None:
+        return None
+    if isinstance(d, datetime):
+        return d.astimezone(JST).strftime("%Y%m%d") if d.tzinfo else d.strftime("%Y%m%d")
+    if isinstance(d, date):
+        return d.strftime("%Y%m%d")
+    return str(d).replace("-", "")[:8]
+
+
+def _paths(day, root):
+    return os.path.join(root, day + ".seg"), os.path.join(root, day + ".idx")
+
+
+# ---------------------------
+# 書き込み
+# ---------------------------
+
+def _member(row) -> bytes:
+    line = json.dumps(row, ensure_ascii=False) + "\n"
+    return gzip.compress(line.encode("utf-8"), compresslevel=6, mtime=0)
+
+
+def append(row: dict, root: str = STORE_DIR):
+    """
+    1件追記。.seg に gzip メンバーを足してから .idx に1行足す。
+    別プロセスの追記と混ざらないよう、2つの書き込みは同じファイルロックの中でやる。
+    途中で落ちて .idx に載らなかった分は reindex(day) で拾える。
+    """
+    day = _row_day(row)
+    seg, idx = _paths(day, root)
+    blob = _member(row)
+    os.makedirs(root, exist_ok=True)
+    with _lock, locked(seg):
+        with open(seg, "ab") as f:
+            # "ab" の tell() は開いた時点の末尾。ロックを取ってから末尾に合わせて測る
+            off = f.seek(0, os.SEEK_END)
+            f.write(blob)
+        with open(idx, "a", encoding="utf-8") as f:
+            f.write(f"{norm_symbol(row.get('symbol'))}\t{off}\t{len(blob)}\t{row.get('close_time') or ''}\n")
+    return day
+
+
+# ---------------------------
+# 読み出し
+# ---------------------------
+
+def list_days(root: str = STORE_DIR, since=None, until=None):
+    """ セグメントのある日付（古い順）。ファイル名だけ見る """
+    if not os.path.isdir(root):
+        return []
+    since, until = _as_day(since), _as_day(until)
+    out = []
+    for name in os.listdir(root):
+        if not name.endswith(".seg"):
+            continue
+        d = name[:-4]
+        if (since and d < since) or (until and d > until):
+            continue
+        out.append(d)
+    return sorted(out)
+
+
+def _read_index(idx_path):
+    entries = []
+    try:
+        with open(idx_path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) < 3:
+                    continue
+                try:
+                    entries.append((parts[0], int(parts[1]), int(parts[2])))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return entries
+
+
+def _read_members(seg_path, entries):
+    """ 索引の (offset, length) ごとに seek して1件ずつ解凍 """
+    with open(seg_path, "rb") as f:
+        for off, n in entries:
+            f.seek(off)
+            try:
+                yield json.loads(gzip.decompress(f.read(n)))
+            except (OSError, EOFError, ValueError, zlib.error):
+                continue
+
+
+def _scan_segment(seg_path, idx_path):
+    """
+    セグメントを頭から流し読み。
+    途中に壊れたメンバー（落ちたときの書きかけ）があれば、その先は索引を頼りに読む。
+    """
+    n = 0
+    try:
+        with gzip.open(seg_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                n += 1
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+        return
+    except (OSError, EOFError, zlib.error):
+        pass
+    rest = [(off, ln) for _, off, ln in _read_index(idx_path)[n:]]
+    yield from _read_members(seg_path, rest)
+
+
+def iter_rows(symbol=None, since=None, until=None, days=None, root: str = STORE_DIR):
+    """
+    symbol      : 指定すればその銘柄だけ（索引で該当メンバーだけ解凍）
+    since/until : 日付（"20251029" / "2025-10-29" / date / datetime）両端含む
+    days        : 今日から遡る日数（since の代わり）
+    """
+    if days is not None and since is None:
+        since = datetime.now(JST) - timedelta(days=days)
+    key = norm_symbol(symbol) if symbol else None
+
+    for d in list_days(root, since, until):
+        seg, idx = _paths(d, root)
+        if key is None:
+            yield from _scan_segment(seg, idx)
+            continue
+        hits = [(off, n) for sym, off, n in _read_index(idx) if sym == key]
+        if hits:
+            yield from _read_members(seg, hits)
+
+
+def symbols(since=None, until=None, root: str = STORE_DIR):
+    """ 期間内に出てくる銘柄（索引だけ読む） """
+    out = set()
+    for d in list_days(root, since, until):
+        out.update(sym for sym, _, _ in _read_index(_paths(d, root)[1]))
+    return sorted(out)
+
+
+# ---------------------------
+# 保守
+# ---------------------------
+
+def reindex(day, root: str = STORE_DIR) -> int:
+    """ .seg をメンバー単位でたどって .idx を作り直す。件数を返す """
+    seg, idx = _paths(_as_day(day), root)
+    with _lock, locked(seg):
+        # 読んでから書き直すまでの間に追記されると .idx から漏れるので、ロックの中で丸ごとやる
+        return _reindex_locked(seg, idx)
+
+
+def _reindex_locked(seg, idx):
+    with open(seg, "rb") as f:
+        data = f.read()
+    lines = []
+    pos = 0
+    while pos < len(data):
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            raw = d.decompress(data[pos:])
+            ok = d.eof
+        except zlib.error:
+            ok = False
+        if not ok:
+            # 書きかけのメンバー。次の gzip ヘッダまで読み飛ばす
+            nxt = data.find(_GZIP_MAGIC, pos + 1)
+            if nxt < 0:
+                break
+            pos = nxt
+            continue
+        n = len(data) - pos - len(d.unused_data)
+        try:
+            row = json.loads(raw)
+            lines.append(f"{norm_symbol(row.get('symbol'))}\t{pos}\t{n}\t{row.get('close_time') or ''}\n")
+        except ValueError:
+            pass
+        pos += n
+    tmp = idx + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+    os.replace(tmp, idx)
+    return len(lines)
+
+
+def migrate(src: str = LEGACY_PATH, root: str = STORE_DIR, keep: bool = False) -> int:
+    """ 旧 learning_log.jsonl をセグメントへ移す。移した件数を返す """
+    if not os.path.exists(src):
+        return 0
+    n = 0
+    with open(src, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            append(row, root)
+            n += 1
+    if not keep:
+        os.replace(src, src + ".migrated")
+    return n
+
+
+def main(argv=None):
+    args = list(argv if argv is not None else sys.argv[1:])
+    cmd = args.pop(0) if args else ""
+    if cmd == "migrate":
+        src = args[0] if args else LEGACY_PATH
+        n = migrate(src)
+        log.info("migrated", src=src, rows=n, dest=STORE_DIR)
+        return 0
+    if cmd == "reindex":
+        for d in (args or list_days()):
+            log.info("reindexed", day=d, rows=reindex(d))
+        return 0
+    print("usage: python learning_store.py migrate [src] | reindex [YYYYMMDD ...]")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,17 +2,31 @@
 # ===============================
 # ポジションとtick履歴をファイルで管理
 # data/positions_live.json : 現在の保有/監視状況
-# data/learning_log.jsonl  : 閉じたポジを学習ログとして追記
+# data/learning/           : 閉じたポジを学習ログとして追記（learning_store: 日付別の圧縮セグメント）
+#
+# 書き込みのたびに、ポジごとの要約（pct_now / peak / trough など、tick本体は含まない）を
+# 読み取り専用のスナップショットとして差し替える（copy-on-write）。
+# /positions などの読み手は snapshot() を読むだけ（ファイルは stat 1回、ロックは取らない）。
+# 変わった銘柄の要約だけ作り直し、他は前のスナップショットのものをそのまま使う。
+# gunicorn の別ワーカーが書いた分は、STATE_PATH の (inode, mtime) が変わっていたら読み直して拾う。
 # ===============================
 
 import os
 import json
+import threading
+from types import MappingProxyType
 from datetime import datetime, timezone, timedelta
 
+import ai_online_learner
+import learning_store
+import tick_downsample
+from utils.jsonlog import get_logger
+
+log = get_logger("position_manager")
+
 JST = timezone(timedelta(hours=9))
 
 STATE_PATH = "data/positions_live.json"
-LEARN_PATH = "data/learning_log.jsonl"
 
 
 def _now_iso():
@@ -29,16 +43,128 @@ def _load_all():
         return {}
 
 
-def _save_all(state):
+def _save_all(state, changed=None):
+    """
+    一時ファイルに書いてから差し替える（途中で読まれても壊れた JSON にならない）。
+    changed: 変わった銘柄（None なら全部作り直し）
+    """
     os.makedirs("data", exist_ok=True)
-    with open(STATE_PATH, "w", encoding="utf-8") as f:
+    tmp = f"{STATE_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, STATE_PATH)
+    _publish(state, changed, _file_stamp())
+
+
+# ---------------------------
+# スナップショット（読み手用）
+# ---------------------------
+
+_snapshot = None            # (version, {symbol: 要約}) 丸ごと差し替えるだけ
+_snapshot_stamp = None      # そのスナップショットの元になった STATE_PATH の (inode, mtime_ns)
+_publish_lock = threading.Lock()
+
+
+def _file_stamp():
+    """ 書き込みは os.replace なので、別プロセスが書けば inode か mtime が変わる """
+    try:
+        st = os.stat(STATE_PATH)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+
+def _num(v):
+    try:
+        return float(v) if v is not None and v != "" else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _summarize(pos, prev=None):
+    """ ポジ1件の要約。prev が1tick前の要約なら peak/trough は差分で更新 """
+    ticks = pos.get("ticks") or []
+    n = len(ticks)
+    if prev is not None and prev["n_ticks"] == n - 1 and prev["entry_time"] == pos.get("entry_time"):
+        peak, trough = prev["peak"], prev["trough"]
+        p = _num(ticks[-1].get("pct"))
+        if p is not None:
+            peak = p if peak is None else max(peak, p)
+            trough = p if trough is None else min(trough, p)
+    elif prev is not None and prev["n_ticks"] == n and prev["entry_time"] == pos.get("entry_time"):
+        peak, trough = prev["peak"], prev["trough"]
+    else:
+        pcts = [p for p in (_num(t.get("pct")) for t in ticks) if p is not None]
+        peak = max(pcts) if pcts else None
+        trough = min(pcts) if pcts else None
+
+    last = ticks[-1] if ticks else {}
+    return MappingProxyType({
+        "symbol": pos.get("symbol"),
+        "side": pos.get("side"),
+        "status": pos.get("status"),
+        "closed": bool(pos.get("closed")),
+        "entry_price": pos.get("entry_price"),
+        "entry_time": pos.get("entry_time"),
+        "close_time": pos.get("close_time"),
+        "close_reason": pos.get("close_reason"),
+        "close_price": pos.get("close_price"),
+        "price_now": _num(last.get("price")),
+        "pct_now": _num(last.get("pct")),
+        "mins_from_entry": _num(last.get("mins_from_entry")),
+        "peak": peak,
+        "trough": trough,
+        "n_ticks": n,
+        "last_tick_time": last.get("t"),
+    })
+
+
+def _publish(state, changed=None, stamp=None):
+    global _snapshot, _snapshot_stamp
+    with _publish_lock:
+        prev_ver, prev = _snapshot if _snapshot is not None else (0, {})
+        if changed is None or _snapshot is None:
+            summaries = {sym: _summarize(pos, prev.get(sym)) for sym, pos in state.items()}
+        else:
+            summaries = dict(prev)
+            for sym in changed:
+                if sym in state:
+                    summaries[sym] = _summarize(state[sym], prev.get(sym))
+                else:
+                    summaries.pop(sym, None)
+        _snapshot = (prev_ver + 1, MappingProxyType(summaries))
+        _snapshot_stamp = stamp
+
+
+def snapshot():
+    """
+    (version, {symbol: 要約}) を返す。どちらも読み取り専用で、以後の書き込みでは変わらない。
+    まだ作っていない / STATE_PATH が他のプロセスに書き換えられていたら、ファイルから作り直す。
+    """
+    snap = _snapshot
+    stamp = _file_stamp()
+    if snap is None or stamp != _snapshot_stamp:
+        # stat → 読み込みの間に書かれても、次の読みでまた作り直すだけ
+        _publish(_load_all(), stamp=stamp)
+        snap = _snapshot
+    return snap
+
+
+def minutes_open(summary, now=None):
+    """ エントリーからの経過分（閉じていればクローズまで）。壁時計ベース """
+    try:
+        start = datetime.fromisoformat(summary["entry_time"])
+        if summary.get("closed") and summary.get("close_time"):
+            end = datetime.fromisoformat(summary["close_time"])
+        else:
+            end = now or datetime.now(JST)
+        return round((end - start).total_seconds() / 60.0, 1)
+    except (TypeError, ValueError, KeyError):
+        return None
 
 
 def _append_learning_log(row: dict):
-    os.makedirs("data", exist_ok=True)
-    with open(LEARN_PATH, "a", encoding="utf-8") as f:
-        f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    learning_store.append(row)
 
 
 def start_position(symbol, side, price, accepted_real):
@@ -62,7 +188,7 @@ def start_position(symbol, side, price, accepted_real):
         "ticks": []
     }
 
-    _save_all(state)
+    _save_all(state, [symbol])
     return state[symbol]
 
 
@@ -90,13 +216,15 @@ def add_tick(symbol, tick_data: dict):
 
     pos["ticks"].append(tick_data)
     state[symbol] = pos
-    _save_all(state)
+    _save_all(state, [symbol])
     return pos
 
 
-def promote_to_real(symbol):
+def promote_to_real(symbol, real_limit=None):
     """
     shadow_pending → real に格上げ。
+    real_limit があれば、保有中 real がその数に達しているときは格上げしない
+    （戻り値の status が shadow_pending のまま）。
     """
     state = _load_all()
     if symbol not in state:
@@ -106,11 +234,16 @@ def promote_to_real(symbol):
     if pos.get("closed"):
         return pos
 
+    if real_limit is not None:
+        n_real = sum(1 for p in state.values() if not p.get("closed") and p.get("status") == "real")
+        if n_real >= real_limit:
+            return pos
+
     if pos.get("status") == "shadow_pending":
         pos["status"] = "real"
 
     state[symbol] = pos
-    _save_all(state)
+    _save_all(state, [symbol])
     return pos
 
 
@@ -118,7 +251,7 @@ def force_close(symbol, reason, price_now, pct_now=None):
     """
     AI側 or Pine側でクローズが決まったときに呼ぶ。
     - ポジをclosedにする
-    - 学習ログ(learning_log.jsonl)に行を追加して将来の学習に使う
+    - 学習ログ(learning_store)に行を追加して将来の学習に使う
     """
     state = _load_all()
     if symbol not in state:
@@ -141,7 +274,7 @@ def force_close(symbol, reason, price_now, pct_now=None):
             pct_now = None
 
     state[symbol] = pos
-    _save_all(state)
+    _save_all(state, [symbol])
 
     learn_row = {
         "symbol": pos.get("symbol"),
@@ -157,11 +290,41 @@ def force_close(symbol, reason, price_now, pct_now=None):
         "final_pct": pct_now,
         "ticks": pos.get("ticks", []),
     }
+    # 長いポジの tick 列は形を保ったまま間引いて残す（TICK_DS_TARGET。既定はオフ）
+    learn_row["ticks"], ds_info = tick_downsample.downsample(learn_row["ticks"])
+    if ds_info is not None:
+        learn_row["ticks_ds"] = ds_info
     _append_learning_log(learn_row)
 
+    # 夜間バッチを待たずに銘柄別しきい値を更新（失敗してもクローズは止めない）
+    try:
+        ai_online_learner.observe_close(learn_row)
+    except Exception as e:
+        log.error("online_learner_failed", symbol=symbol, exc=e)
+
     return pos
 
 
 def get_position(symbol):
     state = _load_all()
     return state.get(symbol)
+
+
+def open_positions():
+    """ 開いている（closed=False）ポジ全部（real / shadow_pending） """
+    return [pos for pos in _load_all().values() if not pos.get("closed")]
+
+
+def open_symbols():
+    """ 開いているポジの銘柄（スナップショットから。価格の先読みの優先枠用） """
+    _, snap = snapshot()
+    return [sym for sym, s in snap.items() if not s["closed"]]
+
+
+def count_open(status="real"):
+    """ 開いている（closed=False）ポジのうち status が一致する件数 """
+    state = _load_all()
+    return sum(
+        1 for pos in state.values()
+        if not pos.get("closed") and pos.get("status") == status
+    )
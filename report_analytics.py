@@ -0,0 +1,234 @@
+# report_analytics.py
+# ===============================
+# レポート用の集計エンジン（trade_log.csv を1回なめるだけ）
+#
+# - ENTRY行（pnl_pct が空）は「取引」として数えない。
+#   代わりに銘柄ごとのエントリー時刻として覚えておき、決済行の保有時間に使う。
+# - 集計は 全体 / 銘柄別 / 決済理由別 / AI決済 vs Pine保険決済 の4系統。
+#   各系統で 件数, 勝率, 損益率合計, 期待値(1トレ平均), PF, 最大DD, 平均保有分 を出す。
+# - 行はストリームで読むので、メモリは「銘柄数＋決済理由数＋未決済エントリー数」分だけ。
+# ===============================
+
+import os
+import csv
+from collections import deque
+from datetime import datetime, timezone
+
+RECENT_LIMIT = 20
+
+PINE_REASONS = ("TP", "SL", "TIMEOUT")
+
+
+def _parse_iso_utc(ts):
+    """
+    "2025-10-29T09:00:00+09:00" みたいなの or "2025-10-29T00:00:00"
+    → naive UTC の datetime。パースできなければ None。
+    """
+    try:
+        t = datetime.fromisoformat((ts or "").replace("Z", "+00:00"))
+    except Exception:
+        return None
+    if t.tzinfo is not None:
+        t = t.astimezone(timezone.utc).replace(tzinfo=None)
+    return t
+
+
+def _pnl(v):
+    if v is None or v == "":
+        return None
+    try:
+        return float(v)
+    except:
+        return None
+
+
+def exit_group(reason):
+    """ AI_* → "AI", Pine保険(TP/SL/TIMEOUT) → "PINE", それ以外 → "OTHER" """
+    reason = reason or ""
+    if reason.startswith("AI_"):
+        return "AI"
+    if reason in PINE_REASONS:
+        return "PINE"
+    return "OTHER"
+
+
+class Agg:
+    """ 1系統ぶんの集計。add() は O(1)。 """
+    __slots__ = ("n", "wins", "pnl_sum", "gross_win", "gross_loss",
+                 "cum", "peak", "max_dd", "hold_sum", "hold_n")
+
+    def __init__(self):
+        self.n = 0
+        self.wins = 0
+        self.pnl_sum = 0.0
+        self.gross_win = 0.0
+        self.gross_loss = 0.0
+        self.cum = 0.0      # 累積損益率カーブ
+        self.peak = 0.0
+        self.max_dd = 0.0
+        self.hold_sum = 0.0
+        self.hold_n = 0
+
+    def add(self, pnl, hold_min=None):
+        self.n += 1
+        self.pnl_sum += pnl
+        if pnl > 0:
+            self.wins += 1
+            self.gross_win += pnl
+        elif pnl < 0:
+            self.gross_loss += -pnl
+
+        self.cum += pnl
+        if self.cum > self.peak:
+            self.peak = self.cum
+        dd = self.peak - self.cum
+        if dd > self.max_dd:
+            self.max_dd = dd
+
+        if hold_min is not None:
+            self.hold_sum += hold_min
+            self.hold_n += 1
+
+    @property
+    def win_rate(self):
+        return self.wins / self.n * 100.0 if self.n else 0.0
+
+    @property
+    def expectancy(self):
+        return self.pnl_sum / self.n if self.n else 0.0
+
+    @property
+    def profit_factor(self):
+        """ 負けなしで勝ちがあれば inf、取引なし/勝ち負けなしは None """
+        if self.gross_loss > 0:
+            return self.gross_win / self.gross_loss
+        if self.gross_win > 0:
+            return float("inf")
+        return None
+
+    @property
+    def avg_hold_min(self):
+        return self.hold_sum / self.hold_n if self.hold_n else None
+
+
+class TradeSummary:
+    __slots__ = ("total", "by_symbol", "by_reason", "by_group", "recent")
+
+    def __init__(self):
+        self.total = Agg()
+        self.by_symbol = {}
+        self.by_reason = {}
+        self.by_group = {}
+        self.recent = deque(maxlen=RECENT_LIMIT)
+
+
+def iter_trade_rows(path):
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            yield r
+
+
+def summarize_trades(rows, since_dt):
+    """
+    rows     : trade_log.csv の行イテラブル（時系列順）
+    since_dt : naive UTC。これ以降に決済された行だけ集計する
+    """
+    s = TradeSummary()
+    open_entry = {}  # symbol -> エントリー時刻(naive UTC)
+
+    for r in rows:
+        sym = r.get("symbol", "?")
+        reason = r.get("reason", "")
+        t = _parse_iso_utc(r.get("timestamp", ""))
+
+        if reason == "ENTRY":
+            if t is not None:
+                open_entry[sym] = t
+            continue
+
+        pnl = _pnl(r.get("pnl_pct"))
+        entry_t = open_entry.pop(sym, None)
+        if pnl is None or t is None or t < since_dt:
+            continue
+
+        hold = None
+        if entry_t is not None and t >= entry_t:
+            hold = (t - entry_t).total_seconds() / 60.0
+
+        s.total.add(pnl, hold)
+        s.by_symbol.setdefault(sym, Agg()).add(pnl, hold)
+        s.by_reason.setdefault(reason or "?", Agg()).add(pnl, hold)
+        s.by_group.setdefault(exit_group(reason), Agg()).add(pnl, hold)
+
+        s.recent.append(
+            f"{r.get('timestamp','?')} {sym} {r.get('side','?')} "
+            f"IN:{r.get('entry_price','-')} -> OUT:{r.get('exit_price','-')} "
+            f"{reason or '?'} PnL%:{r.get('pnl_pct','')}"
+        )
+
+    return s
+
+
+def summarize_trade_log(path, since_dt):
+    return summarize_trades(iter_trade_rows(path), since_dt)
+
+
+# ---------------------------
+# 整形
+# ---------------------------
+
+def _fmt_pf(pf):
+    if pf is None:
+        return "---"
+    if pf == float("inf"):
+        return "∞"
+    return f"{pf:.2f}"
+
+
+def _fmt_hold(m):
+    return "---" if m is None else f"{m:.1f}分"
+
+
+def _line(label, a):
+    return (
+        f"{label}: {a.n}回 勝率{a.win_rate:.1f}% 合計{a.pnl_sum:+.2f}% "
+        f"期待値{a.expectancy:+.3f}% PF{_fmt_pf(a.profit_factor)} "
+        f"DD{a.max_dd:.2f}% 保有{_fmt_hold(a.avg_hold_min)}"
+    )
+
+
+def format_summary(s, symbol_limit=10):
+    """ レポート本文（ヘッダ以外）を作る """
+    t = s.total
+    lines = [
+        f"決済回数: {t.n}",
+        f"損益率合計: {t.pnl_sum:.2f}%",
+        f"期待値(1トレ平均): {t.expectancy:+.3f}%",
+        f"勝率: {t.win_rate:.2f}%",
+        f"PF: {_fmt_pf(t.profit_factor)}",
+        f"最大DD(累積%): {t.max_dd:.2f}%",
+        f"平均保有: {_fmt_hold(t.avg_hold_min)}",
+    ]
+
+    if s.by_group:
+        lines.append("\n--- AI決済 vs Pine保険 ---")
+        for g in ("AI", "PINE", "OTHER"):
+            if g in s.by_group:
+                lines.append(_line(g, s.by_group[g]))
+
+    if s.by_reason:
+        lines.append("\n--- 決済理由別 ---")
+        for reason, a in sorted(s.by_reason.items(), key=lambda x: -x[1].n):
+            lines.append(_line(reason, a))
+
+    if s.by_symbol:
+        lines.append(f"\n--- 銘柄別(損益上位{symbol_limit}) ---")
+        ranked = sorted(s.by_symbol.items(), key=lambda x: -x[1].pnl_sum)
+        for sym, a in ranked[:symbol_limit]:
+            lines.append(_line(sym, a))
+
+    lines.append(f"\n--- 最近の決済(最大{RECENT_LIMIT}件) ---")
+    lines.append("\n".join(s.recent))
+    return "\n".join(lines)
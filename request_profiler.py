@@ -0,0 +1,147 @@
+# request_profiler.py
+# ===============================
+# 本番の webhook 処理をその場でプロファイルする（普段はオフ）
+#
+# オンにする方法:
+#   - 環境変数  PROFILE_EVERY_N=50          → 50回に1回
+#   - 管理API   POST /admin/profile {"every": 50} / {"seconds": 60} / {"off": true}
+#               （seconds は「今から N 秒間は全部」）
+#
+# 1回ぶん（レーンの1バッチ or 同期モードの1イベント）を cProfile で取り、
+#   logs/profiles/20251029-090012_entry_37sym_18.4ms_0001.prof
+# のように「イベント種別・銘柄数・所要時間」入りの名前で pstats 形式で保存する。
+# 見るときは  python -m pstats logs/profiles/xxx.prof  → sort cumtime → stats 30
+# position_manager / ai_exit_logic はハンドラの中で呼ばれるのでそのまま出る。
+# Discord 送信は utils/notify.py の sink のスレッドで動くので出ない（cProfile は取ったスレッドしか見ない）。
+# ハンドラ側に出るのはキューに積む notify() だけ。送信の成否/リトライ数は /metrics の "notify" で見る。
+#
+# cProfile は同時に1本しか動かせないので、別スレッドで取っている最中の分はスキップする。
+# ===============================
+
+import os
+import time
+import threading
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
+
+from utils.jsonlog import get_logger
+
+log = get_logger("profiler")
+
+JST = timezone(timedelta(hours=9))
+
+PROFILE_DIR     = os.getenv("PROFILE_DIR", "logs/profiles")
+PROFILE_EVERY_N = int(os.getenv("PROFILE_EVERY_N", "0"))
+PROFILE_KEEP    = int(os.getenv("PROFILE_KEEP", "200"))   # これより古いファイルは消す
+
+
+class RequestProfiler:
+    def __init__(self, out_dir: str = PROFILE_DIR, every: int = PROFILE_EVERY_N, keep: int = PROFILE_KEEP):
+        self.out_dir = out_dir
+        self.every = every          # 0 ならサンプリングしない
+        self.until = 0.0            # この時刻(epoch)までは毎回
+        self.keep = keep
+        self._count = 0
+        self._seq = 0
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        self.written = 0
+        self.skipped_busy = 0
+        self.last_file = None
+
+    # ---- 設定 ----
+
+    def configure(self, every=None, seconds=None, off=False):
+        with self._lock:
+            if off:
+                self.every = 0
+                self.until = 0.0
+                return
+            if every is not None:
+                self.every = max(int(every), 0)
+                self._count = 0
+            if seconds is not None:
+                self.until = time.time() + max(float(seconds), 0.0)
+
+    def enabled(self) -> bool:
+        return self.every > 0 or time.time() < self.until
+
+    def _should_profile(self) -> bool:
+        with self._lock:
+            if time.time() < self.until:
+                return True
+            if self.every <= 0:
+                return False
+            self._count += 1
+            if self._count >= self.every:
+                self._count = 0
+                return True
+            return False
+
+    # ---- 計測 ----
+
+    @contextmanager
+    def profile(self, tag: str, n_symbols: int = 0):
+        """ with PROFILER.profile("real_tick", 12): ... 対象外なら何もしない """
+        if not self.enabled() or not self._should_profile():
+            yield
+            return
+        if not self._busy.acquire(blocking=False):
+            self.skipped_busy += 1
+            yield
+            return
+        prof = cProfile.Profile()
+        t0 = time.perf_counter()
+        try:
+            prof.enable()
+            try:
+                yield
+            finally:
+                prof.disable()
+            self._dump(prof, tag, n_symbols, (time.perf_counter() - t0) * 1000.0)
+        finally:
+            self._busy.release()
+
+    def _dump(self, prof, tag, n_symbols, elapsed_ms):
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            with self._lock:
+                self._seq += 1
+                seq = self._seq
+            stamp = datetime.now(JST).strftime("%Y%m%d-%H%M%S")
+            safe_tag = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in tag)
+            path = os.path.join(
+                self.out_dir, f"{stamp}_{safe_tag}_{n_symbols}sym_{elapsed_ms:.1f}ms_{seq:04d}.prof"
+            )
+            prof.dump_stats(path)
+            self.written += 1
+            self.last_file = path
+            self._prune()
+        except Exception as e:
+            log.error("profile_save_failed", exc=e)
+
+    def _prune(self):
+        if self.keep <= 0:
+            return
+        files = sorted(
+            (os.path.join(self.out_dir, f) for f in os.listdir(self.out_dir) if f.endswith(".prof")),
+            key=os.path.getmtime,
+        )
+        for path in files[:-self.keep]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "every": self.every,
+            "window_left_sec": max(round(self.until - time.time(), 1), 0.0),
+            "written": self.written,
+            "skipped_busy": self.skipped_busy,
+            "last_file": self.last_file,
+        }
+
+
+PROFILER = RequestProfiler()
@@ -0,0 +1,56 @@
+# run_reports.py
+# ==========================================
+# 日次/週次/月次レポをまとめて1プロセスで回す用
+#
+# 使い方:
+#   python run_reports.py daily
+#   python run_reports.py daily weekly monthly
+#   python run_reports.py all
+#
+# 各ジョブは run_reports_daily / run_reports_weekly / run_reports_monthly の
+# main() をそのまま呼ぶだけ。指定されたものだけ import するので、
+# 週次だけ回すときに学習側のモジュールまで読み込んだりはしない。
+#
+# 環境変数:
+#   DISCORD_WEBHOOK_REPORT
+# ==========================================
+
+import sys
+import importlib
+
+from utils.jsonlog import get_logger
+
+log = get_logger("run_reports")
+
+JOBS = {
+    "daily": "run_reports_daily",
+    "weekly": "run_reports_weekly",
+    "monthly": "run_reports_monthly",
+}
+
+
+def main(argv=None):
+    kinds = list(argv if argv is not None else sys.argv[1:]) or ["daily"]
+    if "all" in kinds:
+        kinds = list(JOBS.keys())
+
+    unknown = [k for k in kinds if k not in JOBS]
+    if unknown:
+        log.error("unknown_job", jobs=unknown, available=list(JOBS.keys()) + ["all"])
+        return 2
+
+    for kind in kinds:
+        try:
+            importlib.import_module(JOBS[kind]).main()
+        except Exception as e:
+            # 1つ落ちても残りのレポは出す
+            log.error("job_failed", job=kind, exc=e)
+
+    # 通知はハブのワーカーが送るので、終わる前に送り切る（送るものが無ければ読み込まない）
+    if "utils.notify" in sys.modules:
+        sys.modules["utils.notify"].flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
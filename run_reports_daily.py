@@ -11,17 +11,19 @@
 # ==========================================
 
 import os
-from datetime import datetime
-import pytz
 
 from ai_model_trainer import train_dynamic_thresholds, train_entry_thresholds
 from report_daily import generate_daily_report
+from utils import notify
 from utils.discord import send_discord
+from utils.time_utils import get_jst_now
+from utils.jsonlog import get_logger
+
+log = get_logger("run_reports_daily")
 
 
 def main():
-    JST = pytz.timezone("Asia/Tokyo")
-    now_jst = datetime.now(JST)
+    now_jst = get_jst_now()
 
     hook = os.getenv("DISCORD_WEBHOOK_REPORT", "")
 
@@ -32,9 +34,8 @@ def main():
         exit_model = train_dynamic_thresholds()
         entry_model = train_entry_thresholds()
 
-        print("[run_reports_daily] 学習モデル更新OK")
-        print("  EXITモデル銘柄:", list(exit_model.keys()))
-        print("  ENTRYモデル銘柄:", list(entry_model.keys()))
+        log.info("training_done", exit_symbols=list(exit_model.keys()),
+                 entry_symbols=list(entry_model.keys()))
 
         if hook:
             send_discord(
@@ -45,7 +46,7 @@ def main():
                 f"{now_jst.isoformat(timespec='seconds')}"
             )
     except Exception as e:
-        print("[run_reports_daily] 学習モデル更新エラー:", e)
+        log.error("training_failed", exc=e)
         if hook:
             send_discord(
                 hook,
@@ -59,14 +60,15 @@ def main():
         daily_msg = generate_daily_report()
     except Exception as e:
         daily_msg = f"⚠ 日次レポ生成中にエラー: {e}"
-        print("[run_reports_daily] 日次レポエラー:", e)
+        log.error("report_failed", report="daily", exc=e)
 
     if hook:
         send_discord(hook, daily_msg)
     else:
-        print("[run_reports_daily] ⚠ DISCORD_WEBHOOK_REPORT 未設定")
-        print(daily_msg)
+        log.warning("report_hook_missing", report="daily", text=daily_msg)
 
 
 if __name__ == "__main__":
     main()
+    # 通知はハブのワーカーが送るので、終わる前に送り切る
+    notify.flush()
@@ -10,16 +10,18 @@
 # ==========================================
 
 import os
-from datetime import datetime
-import pytz
 
 from report_monthly import generate_monthly_report
+from utils import notify
 from utils.discord import send_discord
+from utils.time_utils import get_jst_now
+from utils.jsonlog import get_logger
+
+log = get_logger("run_reports_monthly")
 
 
 def main():
-    JST = pytz.timezone("Asia/Tokyo")
-    now_jst = datetime.now(JST)
+    now_jst = get_jst_now()
 
     hook = os.getenv("DISCORD_WEBHOOK_REPORT", "")
 
@@ -28,14 +30,15 @@ def main():
         monthly_msg = generate_monthly_report()
     except Exception as e:
         monthly_msg = f"⚠ 月次レポ生成中にエラー: {e}"
-        print("[run_reports_monthly] 月次レポエラー:", e)
+        log.error("report_failed", report="monthly", exc=e)
 
     if hook:
         send_discord(hook, monthly_msg)
     else:
-        print("[run_reports_monthly] ⚠ DISCORD_WEBHOOK_REPORT 未設定(monthly)")
-        print(monthly_msg)
+        log.warning("report_hook_missing", report="monthly", text=monthly_msg)
 
 
 if __name__ == "__main__":
     main()
+    # 通知はハブのワーカーが送るので、終わる前に送り切る
+    notify.flush()
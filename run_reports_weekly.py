@@ -10,16 +10,18 @@
 # ==========================================
 
 import os
-from datetime import datetime
-import pytz
 
 from report_weekly import generate_weekly_report
+from utils import notify
 from utils.discord import send_discord
+from utils.time_utils import get_jst_now
+from utils.jsonlog import get_logger
+
+log = get_logger("run_reports_weekly")
 
 
 def main():
-    JST = pytz.timezone("Asia/Tokyo")
-    now_jst = datetime.now(JST)
+    now_jst = get_jst_now()
 
     hook = os.getenv("DISCORD_WEBHOOK_REPORT", "")
 
@@ -28,14 +30,15 @@ def main():
         weekly_msg = generate_weekly_report()
     except Exception as e:
         weekly_msg = f"⚠ 週次レポ生成中にエラー: {e}"
-        print("[run_reports_weekly] 週次レポエラー:", e)
+        log.error("report_failed", report="weekly", exc=e)
 
     if hook:
         send_discord(hook, weekly_msg)
     else:
-        print("[run_reports_weekly] ⚠ DISCORD_WEBHOOK_REPORT 未設定(weekly)")
-        print(weekly_msg)
+        log.warning("report_hook_missing", report="weekly", text=weekly_msg)
 
 
 if __name__ == "__main__":
     main()
+    # 通知はハブのワーカーが送るので、終わる前に送り切る
+    notify.flush()
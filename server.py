@@ -5,25 +5,42 @@
 # shadow（保留監視）は一切通知しない
 # さらに：shadow→real 昇格を実装（昇格通知あり）
 # 昇格は「エントリー発生から PROMOTION_WINDOW_MIN 分以内のみ」許可
+# 受けたペイロードは webhook_events で1回だけパース＆検証（型つきレコード）し、
+# 受けたイベントは event_lanes の優先レーンに積み、ワーカーが
+#   Pine保険決済 → ENTRY → 本ポジtick → shadow tick の順に処理する
+#
+# 起動: gunicorn -k gthread --threads 8 server:app（gevent でも可）
+#   /events（SSE）は繋いでいる間リクエストのスレッドを1本使う。既定の sync ワーカーだと
+#   ダッシュボード1枚で webhook のワーカーが埋まるので、sync では /events は 503 を返す。
 # ===============================
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from datetime import datetime, timezone, timedelta
-import os, json, requests, csv
+import os, json, csv, time
 
 # 既存モジュール
 import ai_entry_logic
 import ai_exit_logic
 import position_manager
 import orchestrator  # active_symbols など
+import event_lanes
+import timer_wheel
+import webhook_events
+from event_stream import BROKER as STREAM
+from request_profiler import PROFILER
+from utils import notify
+from utils import time_utils
+from utils.jsonlog import get_logger, stats as jsonlog_stats
+from ai.price_bus import PRICE_BUS
 
 JST = timezone(timedelta(hours=9))
 app = Flask(__name__)
+log = get_logger("server")
 
 # ----- 環境変数
 SECRET_TOKEN = os.getenv("TV_SHARED_SECRET", "super_secret_token_please_match")
 
-# メイン通知（必須）
+# メイン通知（必須）。送信は utils.notify のハブが読む（NOTIFY_SINKS で送り先を追加できる）
 DISCORD_WEBHOOK_MAIN = os.getenv("DISCORD_WEBHOOK_MAIN", "")
 
 # 取引ログ
@@ -34,6 +51,26 @@ PROMOTION_WINDOW_MIN = float(
     os.getenv("PROMOTION_WINDOW_MIN", os.getenv("AI_PROMOTE_WINDOW_MIN", "5"))
 )
 
+# 寄り付きのENTRYまとめ採否（この時間だけ溜めてから一括で採点する）
+ENTRY_ADMISSION_WINDOW_MS = float(os.getenv("ENTRY_ADMISSION_WINDOW_MS", "300"))
+ENTRY_ADMISSION_MAX       = int(os.getenv("ENTRY_ADMISSION_MAX", "500"))
+ENTRY_ADMISSION_BUDGET_MS = float(os.getenv("ENTRY_ADMISSION_BUDGET_MS", "20"))
+
+# 本ポジ tick のまとめ判定（REAL_TICK レーンから一度に取る最大件数）
+REAL_TICK_BATCH_MAX = int(os.getenv("REAL_TICK_BATCH_MAX", "500"))
+
+# タイマー: shadow の監視期限(分) / real のAIタイムアウト後の猶予(分) / tick途絶とみなす秒数
+SHADOW_EXPIRE_MIN = float(os.getenv("SHADOW_EXPIRE_MIN", "30"))
+TIMER_GRACE_MIN   = float(os.getenv("TIMER_GRACE_MIN", "1"))
+TICK_SILENCE_SEC  = float(os.getenv("TICK_SILENCE_SEC", "120"))
+
+# 価格の先読み（data/universe.txt を BUCKET の予算内で温めておく）
+if os.getenv("PRICE_PREFETCH", "0") == "1":
+    from ai.prefetcher import Prefetcher
+    PREFETCHER = Prefetcher(store=position_manager).start()   # 保有ポジの銘柄を優先
+else:
+    PREFETCHER = None
+
 # ---- 日本語銘柄名マップ
 SYMBOL_NAMES_PATH = "data/symbol_names.json"
 if os.path.exists(SYMBOL_NAMES_PATH):
@@ -67,25 +104,12 @@ def jst_now_str():
     return jst_now().strftime("%Y/%m/%d %H:%M:%S")
 
 def send_discord(msg: str, color: int = 0x00ccff):
-    """Embedでシンプル送信（失敗時はログに落とす）"""
-    if not DISCORD_WEBHOOK_MAIN:
-        print("⚠ Discord Webhook未設定\n", msg)
-        return
-    data = {
-        "embeds": [
-            {
-                "title": "AIりんご式トレード通知",
-                "description": msg,
-                "color": color,
-                "footer": {"text": "AIりんご式 | " + jst_now_str()},
-            }
-        ]
-    }
-    try:
-        resp = requests.post(DISCORD_WEBHOOK_MAIN, json=data, timeout=5)
-        print(f"Discord送信 status={resp.status_code}")
-    except Exception as e:
-        print(f"Discord送信エラー: {e}\nFAILED MSG >>> {msg}")
+    """
+    トレード通知。utils.notify のハブに積むだけ（Discord / file / http の各 sink が別スレッドで送る）。
+    レート制限待ちやリトライで webhook の処理を止めない。
+    """
+    if notify.notify("trade", msg, title="AIりんご式トレード通知", color=color) == 0:
+        log.warning("notify_no_sink", text=msg)
 
 def append_trade_log(row: dict):
     os.makedirs("data", exist_ok=True)
@@ -100,58 +124,48 @@ def append_trade_log(row: dict):
             writer.writeheader()
         writer.writerow(row)
 
-@app.route("/webhook", methods=["POST"])
-def webhook():
-    payload = request.get_json()
-    if not payload:
-        return jsonify({"status": "error", "reason": "no data"}), 400
-
-    if payload.get("secret") != SECRET_TOKEN:
-        return jsonify({"status": "error", "reason": "invalid secret"}), 403
-
-    event_type = payload.get("type", "")
-    symbol     = payload.get("symbol", "")
-    side       = payload.get("side", "")
-    price_now  = float(payload.get("price", 0))
-
-    # 変化率（%）は None も来る想定
-    pct_now = payload.get("pct_from_entry")
-    try:
-        pct_now = float(pct_now) if pct_now is not None else None
-    except:
-        pct_now = None
-
-    # Pine から来る「エントリー発生ms」（PRICE_TICKに添付されがち）
-    entry_ts_ms = payload.get("entry_ts")
-    try:
-        entry_ts_ms = int(entry_ts_ms) if entry_ts_ms is not None else None
-    except:
-        entry_ts_ms = None
-
-    print(f"[WEBHOOK] {event_type} {symbol} {side} {price_now} pct={pct_now} at {jst_now_str()}")
-
-    # ==========================
-    # 1) ENTRY_BUY / ENTRY_SELL
-    # ==========================
-    if event_type in ["ENTRY_BUY", "ENTRY_SELL"]:
-        # サーバ側のENTRY採否（real or shadow）
-        vol_mult  = float(payload.get("vol_mult", 1.0))
-        vwap      = float(payload.get("vwap", 0.0))
-        atr       = float(payload.get("atr", 0.0))
-        last_pct  = float(payload.get("last_pct", 0.0))
-
-        accept, reason = ai_entry_logic.should_accept_entry(
-            symbol, side, vol_mult, vwap, atr, last_pct
-        )  # accept: True=real / False(None)=shadow
-
+# ==========================
+# 1) ENTRY_BUY / ENTRY_SELL
+#    寄りのバーストに備えて、ENTRY はまとめて採否を決める
+#    （ENTRY_ADMISSION_WINDOW_MS の間に来たものを1回で採点し、
+#      本ポジ枠 TOP_LIMIT の残りぶんだけスコア上位を real、残りは shadow）
+# ==========================
+def _real_slots():
+    """ 本ポジ枠 TOP_LIMIT の残り """
+    return max(0, orchestrator.TOP_LIMIT - position_manager.count_open("real"))
+
+
+def handle_entry_batch(events):
+    t0 = time.perf_counter()
+    # 同じ銘柄が2回来ていたら最後の1件だけ（start_position は後のもので上書きになるので）
+    last_of = {ev.symbol: i for i, ev in enumerate(events)}
+    events = [ev for i, ev in enumerate(events) if last_of[ev.symbol] == i]
+    parsed = [(ev.symbol, ev.side, ev.price) for ev in events]
+    cands = [(ev.symbol, ev.side, ev.vol_mult, ev.vwap, ev.atr, ev.last_pct) for ev in events]
+
+    # サーバ側のENTRY採否（real or shadow）
+    slots = _real_slots()
+    decisions = ai_entry_logic.admit_entries(cands, slots)
+
+    elapsed_ms = (time.perf_counter() - t0) * 1000.0
+    if elapsed_ms > ENTRY_ADMISSION_BUDGET_MS:
+        log.warning("entry_admission_slow", n=len(cands), elapsed_ms=round(elapsed_ms, 1),
+                    budget_ms=ENTRY_ADMISSION_BUDGET_MS)
+
+    for (symbol, side, price_now), (accept, reason) in zip(parsed, decisions):
         pos_info = position_manager.start_position(
             symbol=symbol,
             side=side,
             price=price_now,
             accepted_real=bool(accept)
         )
+        schedule_position_timer(pos_info)
 
         orchestrator.mark_symbol_active(symbol)
+        STREAM.publish("entry", {
+            "symbol": symbol, "side": side, "price": price_now,
+            "status": pos_info.get("status"), "reason": reason, "time": pos_info.get("entry_time"),
+        })
 
         # 本採用（real）のみ通知＆ログ
         if accept:
@@ -176,167 +190,541 @@ def webhook():
             })
 
         # shadowはサイレント
-        return jsonify({"status": "ok"})
-
-    # ==========================
-    # 2) PRICE_TICK（昇格判定→AI決済判定）
-    # ==========================
-    elif event_type == "PRICE_TICK":
-        tick = {
-            "t": datetime.now(JST).isoformat(timespec="seconds"),
-            "price": price_now,
-            "pct": pct_now,
-            "volume": payload.get("volume"),
-            "vwap": payload.get("vwap"),
-            "atr": payload.get("atr"),
-            "mins_from_entry": payload.get("mins_from_entry"),
+    return {"status": "ok"}
+
+
+def handle_entry(ev):
+    return handle_entry_batch([ev])
+
+
+# ==========================
+# 2) PRICE_TICK（昇格判定→AI決済判定）
+# ==========================
+def handle_price_tick(ev):
+    symbol, price_now, pct_now, entry_ts_ms = ev.symbol, ev.price, ev.pct, ev.entry_ts
+    tick = ev.tick(datetime.now(JST).isoformat(timespec="seconds"))
+
+    pos_before = position_manager.add_tick(symbol, tick)
+    if not pos_before or pos_before.get("closed"):
+        return {"status": "ok"}
+
+    # ----- まず shadow の昇格判定 -----
+    if pos_before.get("status") == "shadow_pending":
+        # 昇格は「エントリー後 PROMOTION_WINDOW_MIN 分以内」だけ許可
+        mins_from_entry = ev.mins_from_entry
+
+        within_window = False
+        if mins_from_entry is not None:
+            # Pine 側で昼休み補正済の「経過分」
+            within_window = mins_from_entry <= PROMOTION_WINDOW_MIN
+        elif entry_ts_ms is not None:
+            # 念のためフォールバック（サーバ時刻とエントリーmsから算出）
+            now_ms = int(datetime.now(JST).timestamp() * 1000)
+            within_window = (now_ms - entry_ts_ms) <= int(PROMOTION_WINDOW_MIN * 60 * 1000)
+
+        if within_window and ai_entry_logic.should_promote_to_real(pos_before):
+            # 昇格実行（ENTRY の採否と同じく本ポジ枠 TOP_LIMIT を超えない）
+            promoted = position_manager.promote_to_real(symbol, real_limit=orchestrator.TOP_LIMIT)
+            if promoted and not promoted.get("closed") and promoted.get("status") == "real":
+                schedule_position_timer(promoted)
+                promote_side = promoted.get("side", pos_before.get("side", "BUY"))
+                STREAM.publish("promotion", {
+                    "symbol": symbol, "side": promote_side, "price": price_now,
+                    "pct": pct_now, "time": jst_now().isoformat(timespec="seconds"),
+                })
+                msg = (
+                    f"🟢エントリー確定（昇格）\n"
+                    f"銘柄: {symbol} {jp_name(symbol)}\n"
+                    f"方向: {'買い' if promote_side=='BUY' else '売り'}\n"
+                    f"価格: {price_now}\n"
+                    f"理由: 後追い監視から本採用に昇格\n"
+                    f"時刻: {jst_now_str()}"
+                )
+                send_discord(msg, 0x00ff00 if promote_side == "BUY" else 0xff3333)
+
+                append_trade_log({
+                    "timestamp": jst_now().isoformat(timespec="seconds"),
+                    "symbol": symbol,
+                    "side": promote_side,
+                    "entry_price": promoted.get("entry_price", price_now),
+                    "exit_price": "",
+                    "pnl_pct": "",
+                    "reason": "ENTRY",
+                })
+
+            # このTickで即決済は走らせない（次のTickからで十分）
+            return {"status": "ok"}
+        else:
+            # 昇格不可（時間外 or 条件不足） → 何もしない
+            return {"status": "ok"}
+
+    # ----- ここからは real のみ（AIのTP/SL/TOを判定） -----
+    if pos_before.get("status") != "real":
+        return {"status": "ok"}
+
+    wants_exit, exit_info = ai_exit_logic.should_exit_now(pos_before)
+    if wants_exit and exit_info:
+        exit_type, exit_price = exit_info  # exit_type: "AI_TP" / "AI_SL" / "AI_TIMEOUT"
+        close_ai_exit(symbol, exit_type, exit_price, pct_now)
+
+    return {"status": "ok"}
+
+
+def handle_price_tick_batch(events):
+    """
+    本ポジ(REAL_TICK レーン)の PRICE_TICK をまとめて処理する。
+    AI決済の判定は should_exit_batch の1回で済ませ、結果は1件ずつ handle_price_tick したのと同じ
+    （同じ銘柄の tick が複数あれば、先に決済になった時点で後ろは捨てる）。
+    その間に real でなくなったポジの tick は通常の handle_price_tick に回す。
+    """
+    states = {}
+    real = []
+    for ev in events:
+        symbol = ev.symbol
+        if symbol not in states:
+            states[symbol] = position_manager.get_position(symbol)
+        cur = states[symbol]
+        if (not cur) or cur.get("closed") or cur.get("status") != "real":
+            handle_price_tick(ev)
+            continue
+        tick = ev.tick(datetime.now(JST).isoformat(timespec="seconds"))
+        view = {
+            "symbol": symbol,
+            "side": cur.get("side"),
+            "entry_time": cur.get("entry_time"),
+            "closed": False,
+            "ticks": [tick],
         }
-
-        pos_before = position_manager.add_tick(symbol, tick)
-        if not pos_before or pos_before.get("closed"):
-            return jsonify({"status": "ok"})
-
-        # ----- まず shadow の昇格判定 -----
-        if pos_before.get("status") == "shadow_pending":
-            # 昇格は「エントリー後 PROMOTION_WINDOW_MIN 分以内」だけ許可
-            mins_from_entry = tick.get("mins_from_entry")
-            try:
-                mins_from_entry = float(mins_from_entry) if mins_from_entry is not None else None
-            except:
-                mins_from_entry = None
-
-            within_window = False
-            if mins_from_entry is not None:
-                # Pine 側で昼休み補正済の「経過分」
-                within_window = mins_from_entry <= PROMOTION_WINDOW_MIN
-            elif entry_ts_ms is not None:
-                # 念のためフォールバック（サーバ時刻とエントリーmsから算出）
-                now_ms = int(datetime.now(JST).timestamp() * 1000)
-                within_window = (now_ms - entry_ts_ms) <= int(PROMOTION_WINDOW_MIN * 60 * 1000)
-
-            if within_window and ai_entry_logic.should_promote_to_real(pos_before):
-                # 昇格実行
-                promoted = position_manager.promote_to_real(symbol)
-                if promoted and not promoted.get("closed"):
-                    promote_side = promoted.get("side", pos_before.get("side", "BUY"))
-                    msg = (
-                        f"🟢エントリー確定（昇格）\n"
-                        f"銘柄: {symbol} {jp_name(symbol)}\n"
-                        f"方向: {'買い' if promote_side=='BUY' else '売り'}\n"
-                        f"価格: {price_now}\n"
-                        f"理由: 後追い監視から本採用に昇格\n"
-                        f"時刻: {jst_now_str()}"
-                    )
-                    send_discord(msg, 0x00ff00 if promote_side == "BUY" else 0xff3333)
-
-                    append_trade_log({
-                        "timestamp": jst_now().isoformat(timespec="seconds"),
-                        "symbol": symbol,
-                        "side": promote_side,
-                        "entry_price": promoted.get("entry_price", price_now),
-                        "exit_price": "",
-                        "pnl_pct": "",
-                        "reason": "ENTRY",
-                    })
-
-                # このTickで即決済は走らせない（次のTickからで十分）
-                return jsonify({"status": "ok"})
-            else:
-                # 昇格不可（時間外 or 条件不足） → 何もしない
-                return jsonify({"status": "ok"})
-
-        # ----- ここからは real のみ（AIのTP/SL/TOを判定） -----
-        if pos_before.get("status") != "real":
-            return jsonify({"status": "ok"})
-
-        wants_exit, exit_info = ai_exit_logic.should_exit_now(pos_before)
+        real.append((symbol, tick, ev.pct, view))
+
+    decisions = ai_exit_logic.should_exit_batch([r[3] for r in real])
+
+    closed = set()
+    for (symbol, tick, pct_now, _), (wants_exit, exit_info) in zip(real, decisions):
+        if symbol in closed:
+            continue
+        pos = position_manager.add_tick(symbol, tick)
+        if not pos or pos.get("closed"):
+            closed.add(symbol)
+            continue
         if wants_exit and exit_info:
-            exit_type, exit_price = exit_info  # exit_type: "AI_TP" / "AI_SL" / "AI_TIMEOUT"
-            closed_pos = position_manager.force_close(
-                symbol, reason=exit_type, price_now=exit_price, pct_now=pct_now
-            )
-            orchestrator.mark_symbol_closed(symbol)
+            exit_type, exit_price = exit_info
+            close_ai_exit(symbol, exit_type, exit_price, pct_now)
+            closed.add(symbol)
 
-            if exit_type == "AI_TP":
-                kind_label = "AI利確🎯"; color = 0x33ccff
-            elif exit_type == "AI_SL":
-                kind_label = "AI損切り⚡"; color = 0xff6666
-            else:
-                kind_label = "AIタイムアウト⏱"; color = 0xcccc00
+    return {"status": "ok"}
 
-            msg = (
-                f"{kind_label}\n"
-                f"銘柄: {symbol} {jp_name(symbol)}\n"
-                f"決済価格: {exit_price}\n"
-                f"最終変化率: {round(pct_now,2) if pct_now is not None else '---'}%\n"
-                f"時刻: {jst_now_str()}"
-            )
-            send_discord(msg, color)
 
-            append_trade_log({
-                "timestamp": jst_now().isoformat(timespec="seconds"),
-                "symbol": symbol,
-                "side": closed_pos.get("side", "") if closed_pos else "",
-                "entry_price": closed_pos.get("entry_price", "") if closed_pos else "",
-                "exit_price": exit_price,
-                "pnl_pct": round(pct_now,2) if pct_now is not None else "",
-                "reason": exit_type,
-            })
+def _publish_exit(closed_pos, reason, exit_price, pct_now):
+    if not closed_pos:
+        return
+    STREAM.publish("exit", {
+        "symbol": closed_pos.get("symbol"), "side": closed_pos.get("side"),
+        "entry_price": closed_pos.get("entry_price"), "exit_price": exit_price,
+        "pct": pct_now, "reason": reason, "time": closed_pos.get("close_time"),
+    })
+
+
+def close_ai_exit(symbol, exit_type, exit_price, pct_now):
+    """ AI決済（tick判定 / タイマー）共通のクローズ＆通知＆ログ """
+    closed_pos = position_manager.force_close(
+        symbol, reason=exit_type, price_now=exit_price, pct_now=pct_now
+    )
+    orchestrator.mark_symbol_closed(symbol)
+    TIMERS.cancel(symbol)
+    _publish_exit(closed_pos, exit_type, exit_price, pct_now)
+
+    if exit_type == "AI_TP":
+        kind_label = "AI利確🎯"; color = 0x33ccff
+    elif exit_type == "AI_SL":
+        kind_label = "AI損切り⚡"; color = 0xff6666
+    else:
+        kind_label = "AIタイムアウト⏱"; color = 0xcccc00
+
+    msg = (
+        f"{kind_label}\n"
+        f"銘柄: {symbol} {jp_name(symbol)}\n"
+        f"決済価格: {exit_price}\n"
+        f"最終変化率: {round(pct_now,2) if pct_now is not None else '---'}%\n"
+        f"時刻: {jst_now_str()}"
+    )
+    send_discord(msg, color)
+
+    append_trade_log({
+        "timestamp": jst_now().isoformat(timespec="seconds"),
+        "symbol": symbol,
+        "side": closed_pos.get("side", "") if closed_pos else "",
+        "entry_price": closed_pos.get("entry_price", "") if closed_pos else "",
+        "exit_price": exit_price,
+        "pnl_pct": round(pct_now,2) if pct_now is not None else "",
+        "reason": exit_type,
+    })
+    return closed_pos
+
+
+# ==========================
+# 3) TP / SL / TIMEOUT  (Pine側の保険決済イベント)
+# ==========================
+def handle_pine_exit(ev):
+    event_type = ev.type
+    symbol, price_now, pct_now = ev.symbol, ev.price, ev.pct
+
+    # ここでシャドウや未保持は即スキップ（DiscordもCSVも触らない）
+    cur = position_manager.get_position(symbol) if hasattr(position_manager, "get_position") else None
+    if (not cur) or cur.get("closed") or (cur.get("status") != "real"):
+        return {"status": "ok"}
+
+    # real で開いている場合のみ「保険」として発火
+    closed_pos = position_manager.force_close(
+        symbol, reason=event_type, price_now=price_now, pct_now=pct_now
+    )
+    orchestrator.mark_symbol_closed(symbol)
+    TIMERS.cancel(symbol)
+
+    # すでにAIで閉じていれば二重通知しない（close_reasonが AI_ で始まる）
+    already_ai = closed_pos and str(closed_pos.get("close_reason", "")).startswith("AI_")
+    if not already_ai:
+        _publish_exit(closed_pos, event_type, price_now, pct_now)
+        if event_type == "TP":
+            kind_label = "利確🎯"; color = 0x33ccff
+        elif event_type == "SL":
+            kind_label = "損切り⚡"; color = 0xff6666
+        else:
+            kind_label = "タイムアウト⏱"; color = 0xcccc00
+
+        msg = (
+            f"{kind_label}\n"
+            f"銘柄: {symbol} {jp_name(symbol)}\n"
+            f"決済価格: {price_now}\n"
+            f"最終変化率: {round(pct_now,2) if pct_now is not None else '---'}%\n"
+            f"時刻: {jst_now_str()}"
+        )
+        send_discord(msg, color)
+
+        append_trade_log({
+            "timestamp": jst_now().isoformat(timespec="seconds"),
+            "symbol": symbol,
+            "side": closed_pos.get("side", "") if closed_pos else "",
+            "entry_price": closed_pos.get("entry_price", "") if closed_pos else "",
+            "exit_price": price_now,
+            "pnl_pct": round(pct_now,2) if pct_now is not None else "",
+            "reason": event_type,
+        })
+
+    return {"status": "ok"}
+
+
+# ==========================
+# 4) タイマー（tick が止まっても AIタイムアウト / shadow期限切れ を発火させる）
+# ==========================
+def _entry_dt(pos):
+    try:
+        return datetime.fromisoformat(pos.get("entry_time")).astimezone(JST)
+    except Exception:
+        return jst_now()
+
+
+def _real_deadline(pos):
+    """ real の期限: エントリーから場中の時計（昼休みを数えない。Pine の mins_from_entry と同じ）で AI_TIMEOUT_MIN + 猶予 """
+    mins = ai_exit_logic.AI_TIMEOUT_MIN + TIMER_GRACE_MIN
+    return time_utils.add_session_minutes(_entry_dt(pos), mins).timestamp()
 
-        return jsonify({"status": "ok"})
 
-    # ==========================
-    # 3) TP / SL / TIMEOUT  (Pine側の保険決済イベント)
-    # ==========================
-    elif event_type in ["TP", "SL", "TIMEOUT"]:
-        # ここでシャドウや未保持は即スキップ（DiscordもCSVも触らない）
-        cur = position_manager.get_position(symbol) if hasattr(position_manager, "get_position") else None
-        if (not cur) or cur.get("closed") or (cur.get("status") != "real"):
-            return jsonify({"status": "ok"})
+def schedule_position_timer(pos):
+    """ real → 場中の時計でエントリー + AI_TIMEOUT_MIN(+猶予)、shadow → エントリー + SHADOW_EXPIRE_MIN """
+    if not pos or pos.get("closed"):
+        return
+    if pos.get("status") == "real":
+        due = _real_deadline(pos)
+    else:
+        due = _entry_dt(pos).timestamp() + SHADOW_EXPIRE_MIN * 60
+    TIMERS.schedule(pos["symbol"], due, _on_timer)
 
-        # real で開いている場合のみ「保険」として発火
+
+def _on_timer(symbol):
+    # ホイールのスレッドからは積むだけ。処理は他の決済と同じ経路（EXITレーン）で
+    item = webhook_events.TimerEvent(symbol)
+    if LANES is None:
+        process_event(item)
+    else:
+        LANES.submit(event_lanes.LANE_EXIT, symbol, item)
+
+
+def handle_timer(ev):
+    symbol = ev.symbol
+    cur = position_manager.get_position(symbol)
+    if (not cur) or cur.get("closed"):
+        return {"status": "ok"}
+
+    ticks = cur.get("ticks") or []
+    last = ticks[-1] if ticks else {}
+
+    if cur.get("status") == "real":
+        # 昼休み・引け後は tick が来ないだけ。止まった価格で閉じず、場が開いたら見直す
+        now = jst_now()
+        if not time_utils.is_session_open(now):
+            due = max(time_utils.next_session_open(now).timestamp(), _real_deadline(cur))
+            TIMERS.schedule(symbol, due + 60, _on_timer)
+            return {"status": "ok"}
+
+        # tick が流れていて Pine の経過分(昼休み補正済)がまだ届いていないなら少し待つ
+        # tick は TickEvent.tick() で数値化済み（欠けは None）
+        mins = last.get("mins_from_entry")
+        try:
+            tick_age = time.time() - datetime.fromisoformat(last.get("t")).timestamp()
+        except (TypeError, ValueError):
+            tick_age = None
+        if mins is not None and mins < ai_exit_logic.AI_TIMEOUT_MIN and tick_age is not None and tick_age < TICK_SILENCE_SEC:
+            TIMERS.schedule(symbol, time.time() + 60, _on_timer)
+            return {"status": "ok"}
+
+        # 判定は tick と同じ評価器で（経過分だけ期限に進めた最後の tick）
+        view = dict(cur, ticks=[dict(last, mins_from_entry=max(mins or 0, ai_exit_logic.AI_TIMEOUT_MIN))])
+        if not last:
+            view["ticks"][0]["price"] = cur.get("entry_price")
+        (wants_exit, exit_info), = ai_exit_logic.should_exit_batch([view])
+        if wants_exit and exit_info:
+            exit_type, exit_price = exit_info
+        else:
+            exit_type, exit_price = "AI_TIMEOUT", last.get("price", cur.get("entry_price"))
+        close_ai_exit(symbol, exit_type, exit_price, last.get("pct"))
+    else:
+        # shadow は見送りパターンとして学習ログに残すだけ（Discord には通知しない）
         closed_pos = position_manager.force_close(
-            symbol, reason=event_type, price_now=price_now, pct_now=pct_now
+            symbol, reason="expired_pending", price_now=last.get("price", cur.get("entry_price"))
         )
-        orchestrator.mark_symbol_closed(symbol)
-
-        # すでにAIで閉じていれば二重通知しない（close_reasonが AI_ で始まる）
-        already_ai = closed_pos and str(closed_pos.get("close_reason", "")).startswith("AI_")
-        if not already_ai:
-            if event_type == "TP":
-                kind_label = "利確🎯"; color = 0x33ccff
-            elif event_type == "SL":
-                kind_label = "損切り⚡"; color = 0xff6666
-            else:
-                kind_label = "タイムアウト⏱"; color = 0xcccc00
+        STREAM.publish("shadow_expiry", {
+            "symbol": symbol, "side": cur.get("side"), "pct": last.get("pct"),
+            "time": closed_pos.get("close_time") if closed_pos else None,
+        })
+
+    return {"status": "ok"}
+
+
+HANDLERS = {
+    "ENTRY_BUY": handle_entry,
+    "ENTRY_SELL": handle_entry,
+    "PRICE_TICK": handle_price_tick,
+    "TP": handle_pine_exit,
+    "SL": handle_pine_exit,
+    "TIMEOUT": handle_pine_exit,
+    "TIMER": handle_timer,   # サーバ内部（_on_timer）からのみ
+}
+
+
+def process_event(ev):
+    """ イベント1件を処理する（同期モード / レーンのワーカー 共通）。ev は webhook_events のレコード """
+    return HANDLERS[ev.type](ev)
+
+
+# ==========================
+# 優先レーン（EVENT_LANES=0 で従来どおりリクエスト内で同期処理）
+# ==========================
+def _classify(event_type, symbol):
+    if event_type in ("TP", "SL", "TIMEOUT"):
+        return event_lanes.LANE_EXIT
+    if event_type in ("ENTRY_BUY", "ENTRY_SELL"):
+        return event_lanes.LANE_ENTRY
+    cur = position_manager.get_position(symbol)
+    if cur and not cur.get("closed") and cur.get("status") == "real":
+        return event_lanes.LANE_REAL_TICK
+    return event_lanes.LANE_SHADOW_TICK
+
+
+def _process_lane(lane, events):
+    # PROFILE_EVERY_N / POST /admin/profile でオンのときだけ、このバッチを丸ごとプロファイル
+    tag = "+".join(sorted({ev.type for ev in events}))
+    with PROFILER.profile(tag, len({ev.symbol for ev in events})):
+        if lane == event_lanes.LANE_ENTRY:
+            handle_entry_batch(events)
+            return
+        if lane == event_lanes.LANE_REAL_TICK:
+            handle_price_tick_batch(events)
+            return
+        for ev in events:
+            process_event(ev)
+
+
+if os.getenv("EVENT_LANES", "1") == "1":
+    LANES = event_lanes.LaneDispatcher(
+        _process_lane,
+        batch_lanes={
+            event_lanes.LANE_ENTRY: (ENTRY_ADMISSION_WINDOW_MS / 1000.0, ENTRY_ADMISSION_MAX),
+            # 本ポジ tick は待たずに、溜まっている分をまとめて1回で判定
+            event_lanes.LANE_REAL_TICK: (0.0, REAL_TICK_BATCH_MAX),
+        },
+    )
+else:
+    LANES = None
 
-            msg = (
-                f"{kind_label}\n"
-                f"銘柄: {symbol} {jp_name(symbol)}\n"
-                f"決済価格: {price_now}\n"
-                f"最終変化率: {round(pct_now,2) if pct_now is not None else '---'}%\n"
-                f"時刻: {jst_now_str()}"
-            )
-            send_discord(msg, color)
 
-            append_trade_log({
-                "timestamp": jst_now().isoformat(timespec="seconds"),
-                "symbol": symbol,
-                "side": closed_pos.get("side", "") if closed_pos else "",
-                "entry_price": closed_pos.get("entry_price", "") if closed_pos else "",
-                "exit_price": price_now,
-                "pnl_pct": round(pct_now,2) if pct_now is not None else "",
-                "reason": event_type,
-            })
+TIMERS = timer_wheel.TimerWheel().start()
 
-        return jsonify({"status": "ok"})
+# 再起動時: 開いているポジのタイマーを張り直す
+for _pos in position_manager.open_positions():
+    schedule_position_timer(_pos)
 
-    # ==========================
-    # 未対応
-    # ==========================
-    else:
-        print(f"[INFO] 未対応event {event_type} payload={payload}")
+
+@app.route("/webhook", methods=["POST"])
+def webhook():
+    # 受け口で1回だけパース＆検証。ダメなものは状態に触る前に返す
+    try:
+        payload = webhook_events.loads(request.get_data(cache=False))
+        webhook_events.check_secret(payload, SECRET_TOKEN)
+        ev = webhook_events.from_payload(payload)
+    except webhook_events.EventError as e:
+        return jsonify({"status": "error", "reason": e.reason}), e.status
+
+    if ev is None:
+        # 未対応
+        log.info("unhandled_event", event=payload.get("type", ""),
+                 payload={k: v for k, v in payload.items() if k != "secret"})
         return jsonify({"status": "ok", "note": "unhandled"})
 
+    event_type = ev.type
+    symbol     = ev.symbol
+
+    # PRICE_TICK は量が多いので LOG_SAMPLE_N 件に1件だけ
+    log.info("webhook", sample="PRICE_TICK" if event_type == "PRICE_TICK" else None,
+             event=event_type, symbol=symbol, side=ev.side, price=ev.price, pct=ev.pct)
+
+    if event_type == "PRICE_TICK":
+        # 後追い監視(TrailingAI)などプロセス内の購読者へ即配信（レーン待ちしない）
+        PRICE_BUS.publish(symbol, ev.price)
+
+    if LANES is None:
+        with PROFILER.profile(ev.type, 1):
+            result = process_event(ev)
+        return jsonify(result)
+
+    lane = _classify(event_type, symbol)
+    queued = LANES.submit(lane, symbol, ev)
+    return jsonify({"status": "ok", "lane": event_lanes.LANE_NAMES[lane], "queued": queued})
+
+
+# ==========================
+# 保有状況（position_manager のスナップショットを読むだけ）
+#   /positions            開いているポジ（?all=1 で閉じたものも、?status=real で絞り込み）
+#   /positions/<symbol>   1銘柄
+# 売買判断がそのまま見えるので webhook と同じ secret が要る
+#   ?secret=... か X-Secret ヘッダ（/events・/metrics も同じ。EventSource はヘッダを付けられないので query で）
+# ==========================
+def _secret_error():
+    """ secret が合わなければエラーレスポンス、合えば None """
+    given = request.args.get("secret") or request.headers.get("X-Secret")
+    try:
+        webhook_events.check_secret({"secret": given}, SECRET_TOKEN)
+    except webhook_events.EventError as e:
+        return jsonify({"status": "error", "reason": e.reason}), e.status
+    return None
+
+
+def _position_view(summary, now):
+    view = dict(summary)
+    view["minutes_open"] = position_manager.minutes_open(summary, now)
+    return view
+
+
+@app.route("/positions", methods=["GET"])
+def positions():
+    err = _secret_error()
+    if err is not None:
+        return err
+    version, snap = position_manager.snapshot()
+    include_closed = request.args.get("all", "0") == "1"
+    status = request.args.get("status")
+    now = jst_now()
+    rows = [
+        _position_view(s, now) for s in snap.values()
+        if (include_closed or not s["closed"]) and (status is None or s["status"] == status)
+    ]
+    return jsonify({"version": version, "as_of": now.isoformat(timespec="seconds"), "positions": rows})
+
+
+@app.route("/positions/<symbol>", methods=["GET"])
+def position_detail(symbol):
+    err = _secret_error()
+    if err is not None:
+        return err
+    version, snap = position_manager.snapshot()
+    summary = snap.get(symbol) or snap.get(symbol.upper())
+    if summary is None:
+        return jsonify({"status": "error", "reason": "not found"}), 404
+    now = jst_now()
+    return jsonify({"version": version, "as_of": now.isoformat(timespec="seconds"),
+                    "position": _position_view(summary, now)})
+
+
+# ==========================
+# イベントストリーム（SSE）: entry / promotion / exit / shadow_expiry / model_reload
+# ==========================
+ai_exit_logic.add_reload_listener(
+    lambda gen, n: STREAM.publish("model_reload", {
+        "model": "exit", "generation": gen, "symbols": n,
+        "time": jst_now().isoformat(timespec="seconds"),
+    })
+)
+
+
+@app.route("/events", methods=["GET"])
+def events():
+    err = _secret_error()
+    if err is not None:
+        return err
+    # sync ワーカー（1ワーカー1リクエスト）で繋ぎっぱなしにすると webhook が待たされる
+    if not request.environ.get("wsgi.multithread"):
+        return jsonify({"status": "error", "reason": "/events needs a threaded worker (gunicorn -k gthread)"}), 503
+    sub = STREAM.subscribe()
+    if sub is None:
+        return jsonify({"status": "error", "reason": "too many subscribers"}), 503
+    return Response(
+        stream_with_context(STREAM.stream(sub)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ==========================
+# プロファイラの切り替え（要 secret）
+#   {"every": 50}   50回に1回   / {"seconds": 60} 今から60秒は全部 / {"off": true}
+# ==========================
+@app.route("/admin/profile", methods=["GET", "POST"])
+def admin_profile():
+    try:
+        if request.method == "GET":
+            webhook_events.check_secret({"secret": request.args.get("secret")}, SECRET_TOKEN)
+        else:
+            body = webhook_events.loads(request.get_data(cache=False))
+            webhook_events.check_secret(body, SECRET_TOKEN)
+            PROFILER.configure(
+                every=body.get("every"), seconds=body.get("seconds"), off=bool(body.get("off")),
+            )
+    except webhook_events.EventError as e:
+        return jsonify({"status": "error", "reason": e.reason}), e.status
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "reason": "bad every/seconds"}), 400
+    return jsonify({"status": "ok", "profiler": PROFILER.stats()})
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    err = _secret_error()
+    if err is not None:
+        return err
+    from ai.net_guard import CACHE, bucket_stats
+    return jsonify({
+        "lanes": LANES.stats() if LANES is not None else None,
+        "buckets": bucket_stats(),
+        "price_cache": CACHE.stats(),
+        "prefetcher": PREFETCHER.stats() if PREFETCHER is not None else None,
+        "timers": TIMERS.stats(),
+        "exit_eval": ai_exit_logic.stats(),
+        "events": STREAM.stats(),
+        "profiler": PROFILER.stats(),
+        "notify": notify.get_hub().stats(),
+        "log": jsonlog_stats(),
+    })
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", "10000")))
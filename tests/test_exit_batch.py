@@ -0,0 +1,115 @@
+# tests/test_exit_batch.py
+# ===============================
+# should_exit_batch（NumPy まとめ判定 + 帯の事前ふるい）が
+# should_exit_now と同じ答えを返すかの乱数テスト（2万ケース）
+#
+#   python -m pytest -q tests/test_exit_batch.py
+#
+# 基準は「毎回帯を捨てて全判定した should_exit_now」。
+# 同じ tick 列を should_exit_now を順に / should_exit_batch でまとめて 流して、3つが一致すること、
+# まとめ判定でも帯で飛ばした件数が 0 でないことを見る。
+# ===============================
+
+import json
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import ai_exit_logic  # noqa: E402
+
+N_SYMBOLS = 200
+N_STEPS = 100      # 200銘柄 × 100 tick = 2万ケース
+
+
+@pytest.fixture(autouse=True)
+def _isolated(tmp_path, monkeypatch):
+    """ モデル/オンライン統計は tmp に。帯・件数・モデルキャッシュも空から """
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    model = {f"S{i:03d}": {"tp": round(0.5 + (i % 7) * 0.4, 2), "sl": round(-0.3 - (i % 5) * 0.3, 2)}
+             for i in range(0, N_SYMBOLS, 2)}      # 半分はモデル無し（既定の 3.0 / -1.5）
+    path = tmp_path / "data" / "ai_dynamic_thresholds.json"
+    path.write_text(json.dumps(model), encoding="utf-8")
+    monkeypatch.setattr(ai_exit_logic, "MODEL_PATH", str(path))
+    monkeypatch.setattr(ai_exit_logic, "_model_cache", {"key": None, "model": {}, "gen": 0})
+    monkeypatch.setattr(ai_exit_logic, "_bands", {})
+    monkeypatch.setattr(ai_exit_logic, "_stats", {"skipped": 0, "full": 0, "rebuilt": 0, "batch": 0})
+
+
+def _scenario(seed=20251029):
+    """ steps[k] = その時点の各銘柄のポジ（ticks の末尾が判定対象の tick） """
+    rng = random.Random(seed)
+    state = []
+    for i in range(N_SYMBOLS):
+        state.append({
+            "symbol": f"S{i:03d}",
+            "side": rng.choice(["BUY", "SELL", "BUY", "?"]),
+            "entry_time": f"2025-10-29T09:{i % 60:02d}:00+09:00",
+            "price": rng.uniform(100, 5000),
+            "pct": rng.uniform(-0.3, 0.3),
+            "vwap": rng.uniform(100, 5000),
+        })
+    steps = []
+    for k in range(N_STEPS):
+        snap = []
+        for st in state:
+            st["pct"] += rng.gauss(0, 0.15)
+            st["price"] *= 1 + rng.gauss(0, 0.001)
+            if rng.random() < 0.1:
+                st["vwap"] = st["price"] * rng.uniform(0.99, 1.01)
+            tick = {
+                "pct": round(st["pct"], 3),
+                "price": round(st["price"], 1),
+                "mins_from_entry": float(k) * rng.uniform(0.2, 0.4),
+                "volume": rng.choice([0, rng.uniform(0, 3e4)]),
+                "atr": rng.choice([0, rng.uniform(0.5, 3)]),
+                "vwap": rng.choice([0, round(st["vwap"], 1)]),
+            }
+            snap.append({
+                "symbol": st["symbol"], "side": st["side"], "entry_time": st["entry_time"],
+                "closed": False, "ticks": [tick],
+            })
+        steps.append(snap)
+    return steps
+
+
+def test_batch_matches_scalar():
+    steps = _scenario()
+
+    reference = []
+    for snap in steps:
+        row = []
+        for p in snap:
+            ai_exit_logic._bands.clear()        # 帯を使わない全判定
+            row.append(ai_exit_logic.should_exit_now(p))
+        reference.append(row)
+
+    ai_exit_logic._bands.clear()
+    scalar = [[ai_exit_logic.should_exit_now(p) for p in snap] for snap in steps]
+
+    ai_exit_logic._bands.clear()
+    before = dict(ai_exit_logic._stats)
+    batch = [ai_exit_logic.should_exit_batch(snap) for snap in steps]
+    skipped = ai_exit_logic._stats["skipped"] - before["skipped"]
+
+    n = sum(len(s) for s in steps)
+    assert n == 20000
+    assert scalar == reference
+    assert batch == reference
+    assert any(d for row in reference for d, _ in row)
+    # 既定の経路（EVENT_LANES=1 はまとめ判定）でも帯が効いていること
+    assert skipped > 0
+    assert ai_exit_logic._stats["batch"] - before["batch"] == n - skipped
+
+
+def test_batch_skips_closed_and_empty():
+    out = ai_exit_logic.should_exit_batch([
+        None,
+        {"symbol": "X", "closed": True, "ticks": [{"pct": 10}]},
+        {"symbol": "Y", "ticks": []},
+        {"symbol": "Z", "side": "BUY", "entry_time": "t", "ticks": [{"pct": 10, "price": 1}]},
+    ])
+    assert out[:3] == [(False, None)] * 3
+    assert out[3] == (True, ("AI_TP", 1.0))
@@ -0,0 +1,151 @@
+# tick_downsample.py
+# ===============================
+# クローズ時に学習ログへ残す tick 列を間引く（形を保つ LTTB）
+#
+#   TICK_DS_TARGET=300   → tick が 300 本を超えるポジだけ 300 本前後まで間引く（0 ならしない）
+#
+# 必ず残す tick: エントリー（先頭）/ ピーク（pct 最大）/ ボトム（pct 最小）/ 決済（末尾）
+# その間の区間ごとに、区間の長さに比例した本数を LTTB（Largest-Triangle-Three-Buckets）で選ぶ。
+# 横軸は mins_from_entry（欠けていたり戻っていたら tick の番号）、縦軸は pct。
+#
+# 間引きでどれだけ変わったかは学習ログの行に "ticks_ds" として残す:
+#   {"raw": 1840, "kept": 300, "mfe": 1.82, "mae": -0.41, "mfe_err": 0.0, "mae_err": 0.0, "max_dev": 0.037}
+#   mfe/mae   : 元の tick 列での最大含み益 / 最大含み損（pct）
+#   *_err     : 間引いた後の列で測った値との差（ピーク/ボトムを残すので通常 0）
+#   max_dev   : 捨てた tick の pct と、残した tick を結んだ線との最大のずれ
+# ===============================
+
+import os
+
+TICK_DS_TARGET = int(os.getenv("TICK_DS_TARGET", "0"))
+
+
+def _num(v):
+    try:
+        return float(v) if v is not None and v != "" else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _series(ticks):
+    """ (xs, ys)。pct が無い tick は前の値で埋める """
+    ys = []
+    last = 0.0
+    for t in ticks:
+        p = _num(t.get("pct"))
+        if p is not None:
+            last = p
+        ys.append(last)
+
+    xs = [_num(t.get("mins_from_entry")) for t in ticks]
+    ok = all(x is not None for x in xs) and all(a <= b for a, b in zip(xs, xs[1:]))
+    if not ok:
+        xs = [float(i) for i in range(len(ticks))]
+    return xs, ys
+
+
+def lttb(xs, ys, target, lo=0, hi=None):
+    """
+    xs[lo..hi]（両端含む）から target 点を選んだ添字を返す。両端は必ず入る。
+    """
+    if hi is None:
+        hi = len(xs) - 1
+    n = hi - lo + 1
+    if target >= n:
+        return list(range(lo, hi + 1))
+    if target < 3:
+        return [lo, hi]
+
+    out = [lo]
+    every = (n - 2) / (target - 2)
+    a = lo
+    for i in range(target - 2):
+        # 次のバケツの平均（三角形の3点目）
+        s = lo + int((i + 1) * every) + 1
+        e = min(lo + int((i + 2) * every) + 1, hi + 1)
+        if s >= e:
+            s, e = hi, hi + 1
+        cnt = e - s
+        avg_x = sum(xs[s:e]) / cnt
+        avg_y = sum(ys[s:e]) / cnt
+
+        # このバケツから、a と平均点で作る三角形が一番大きくなる点
+        b0 = lo + int(i * every) + 1
+        b1 = lo + int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        best, best_area = b0, -1.0
+        for j in range(b0, b1):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        out.append(best)
+        a = best
+    out.append(hi)
+    return out
+
+
+def select(ticks, target):
+    """ 残す tick の添字（昇順） """
+    n = len(ticks)
+    if target <= 0 or n <= target:
+        return list(range(n))
+    xs, ys = _series(ticks)
+    anchors = sorted({0, n - 1, ys.index(max(ys)), ys.index(min(ys))})
+
+    # アンカー以外の本数を、アンカー間の区間の長さに比例して配る
+    budget = max(target - len(anchors), 0)
+    inner = sum(b - a - 1 for a, b in zip(anchors, anchors[1:]))
+    keep = set(anchors)
+    for a, b in zip(anchors, anchors[1:]):
+        gap = b - a - 1
+        if gap <= 0 or inner <= 0:
+            continue
+        k = round(budget * gap / inner)
+        if k > 0:
+            keep.update(lttb(xs, ys, k + 2, a, b))
+    return sorted(keep)
+
+
+def _extremes(ys):
+    return (max(ys), min(ys)) if ys else (None, None)
+
+
+def _max_dev(xs, ys, idx):
+    """ 捨てた点と、残した点を結んだ折れ線との縦方向の最大差 """
+    dev = 0.0
+    for a, b in zip(idx, idx[1:]):
+        if b - a <= 1:
+            continue
+        x0, y0, x1, y1 = xs[a], ys[a], xs[b], ys[b]
+        span = x1 - x0
+        for j in range(a + 1, b):
+            y = y0 if span == 0 else y0 + (y1 - y0) * (xs[j] - x0) / span
+            dev = max(dev, abs(ys[j] - y))
+    return dev
+
+
+def downsample(ticks, target=None):
+    """
+    (間引いた tick 列, 情報 dict) を返す。
+    対象外（オフ / 本数が target 以下）なら (元の列, None)。
+    """
+    if target is None:
+        target = TICK_DS_TARGET
+    ticks = ticks or []
+    if target <= 0 or len(ticks) <= target:
+        return ticks, None
+
+    idx = select(ticks, target)
+    xs, ys = _series(ticks)
+    mfe, mae = _extremes(ys)
+    ds_mfe, ds_mae = _extremes([ys[i] for i in idx])
+    info = {
+        "raw": len(ticks),
+        "kept": len(idx),
+        "mfe": round(mfe, 4),
+        "mae": round(mae, 4),
+        "mfe_err": round(abs(mfe - ds_mfe), 4),
+        "mae_err": round(abs(mae - ds_mae), 4),
+        "max_dev": round(_max_dev(xs, ys, idx), 4),
+    }
+    return [ticks[i] for i in idx], info
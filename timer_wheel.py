@@ -0,0 +1,160 @@
+# timer_wheel.py
+# ===============================
+# 階層タイマーホイール（AIタイムアウト / shadow期限切れ用）
+#
+# 保有中ポジごとに「この時刻になったら見に行く」を1個ずつ持つ。
+# 全ポジを毎秒なめる代わりに、1秒刻みの 64スロット × 3段 のホイールに入れておき、
+#   段0: 1秒 × 64   (〜1分)
+#   段1: 64秒 × 64  (〜68分)
+#   段2: 4096秒 × 64 (〜72時間)
+# 時計が進んだスロットの分だけ処理する。登録/取消/発火はどれも O(1)（段の繰り下げ込みで償却）。
+#
+#   wheel = TimerWheel().start()
+#   wheel.schedule("7203.T", deadline_epoch, callback)   # 同じ key は上書き
+#   wheel.cancel("7203.T")
+# callback はホイールのスレッドで呼ばれるので、重い処理は別キューに回すこと。
+# ===============================
+
+import time
+import threading
+
+from utils.jsonlog import get_logger
+
+log = get_logger("timer_wheel")
+
+SLOT_BITS = 6
+SLOTS = 1 << SLOT_BITS
+LEVELS = 3
+
+
+class _Timer:
+    __slots__ = ("key", "expire_tick", "callback", "cancelled")
+
+    def __init__(self, key, expire_tick, callback):
+        self.key = key
+        self.expire_tick = expire_tick
+        self.callback = callback
+        self.cancelled = False
+
+
+class TimerWheel:
+    def __init__(self, tick_sec: float = 1.0):
+        self.tick_sec = tick_sec
+        self._wheels = [[[] for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self._by_key = {}
+        self._lock = threading.Lock()
+        self._now_tick = self._tick_of(time.time())
+        self._stop = threading.Event()
+        self._thread = None
+        self.fired = 0
+        self.cancelled = 0
+
+    def _tick_of(self, ts: float) -> int:
+        return int(ts // self.tick_sec)
+
+    # ---- 登録 ----
+
+    def _place_locked(self, t: _Timer, cascading: bool = False):
+        delta = t.expire_tick - self._now_tick
+        if delta <= 0:
+            # 繰り下げ中なら今の tick のスロット（この直後に処理される）、
+            # 外からの登録なら今の tick は処理済みなので次の tick で発火
+            off = 0 if cascading else 1
+            self._wheels[0][(self._now_tick + off) & (SLOTS - 1)].append(t)
+            return
+        for level in range(LEVELS):
+            if delta < (1 << (SLOT_BITS * (level + 1))) or level == LEVELS - 1:
+                idx = (t.expire_tick >> (SLOT_BITS * level)) & (SLOTS - 1)
+                if level == LEVELS - 1 and delta >= (1 << (SLOT_BITS * LEVELS)):
+                    # 最上段より遠いものは一番遠いスロットに置いて、降りてきたら置き直す
+                    idx = ((self._now_tick >> (SLOT_BITS * level)) - 1) & (SLOTS - 1)
+                self._wheels[level][idx].append(t)
+                return
+
+    def schedule(self, key, deadline_ts: float, callback):
+        """ key の期限を deadline_ts（epoch秒）に設定する。既存の同じ key は取り消す """
+        with self._lock:
+            old = self._by_key.pop(key, None)
+            if old is not None:
+                old.cancelled = True
+            t = _Timer(key, self._tick_of(deadline_ts), callback)
+            self._by_key[key] = t
+            self._place_locked(t)
+        return t
+
+    def cancel(self, key) -> bool:
+        with self._lock:
+            t = self._by_key.pop(key, None)
+            if t is None:
+                return False
+            t.cancelled = True
+            self.cancelled += 1
+            return True
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._by_key)
+
+    # ---- 時計を進める ----
+
+    def _cascade_locked(self, level: int):
+        idx = (self._now_tick >> (SLOT_BITS * level)) & (SLOTS - 1)
+        timers = self._wheels[level][idx]
+        self._wheels[level][idx] = []
+        for t in timers:
+            if not t.cancelled:
+                self._place_locked(t, cascading=True)
+        return idx
+
+    def advance(self, now: float = None):
+        """ now までの tick を全部処理して、期限が来た callback を呼ぶ """
+        now_tick = self._tick_of(time.time() if now is None else now)
+        due = []
+        with self._lock:
+            while self._now_tick < now_tick:
+                self._now_tick += 1
+                # 下の段が一周したら上の段の今のスロットを下ろしてくる
+                for level in range(1, LEVELS):
+                    mask = (1 << (SLOT_BITS * level)) - 1
+                    if self._now_tick & mask:
+                        break
+                    self._cascade_locked(level)
+
+                idx = self._now_tick & (SLOTS - 1)
+                slot = self._wheels[0][idx]
+                self._wheels[0][idx] = []
+                for t in slot:
+                    if t.cancelled:
+                        continue
+                    if t.expire_tick > self._now_tick:
+                        self._place_locked(t)  # まだ先（最上段から降りてきた遠いもの）
+                        continue
+                    if self._by_key.get(t.key) is t:
+                        del self._by_key[t.key]
+                    due.append(t)
+
+        for t in due:
+            self.fired += 1
+            try:
+                t.callback(t.key)
+            except Exception as e:
+                log.error("timer_callback_failed", key=t.key, exc=e)
+
+    # ---- スレッド ----
+
+    def _loop(self):
+        while not self._stop.wait(self.tick_sec):
+            self.advance()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="timer-wheel", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {"pending": self.pending(), "fired": self.fired, "cancelled": self.cancelled}
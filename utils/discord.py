@@ -1,16 +1,17 @@
-import requests
-import json
+from utils import notify
+from utils.jsonlog import get_logger
 
-def send_discord(webhook_url: str, text: str):
-    if not webhook_url:
-        print("[Discord MOCK]", text)
-        return
+log = get_logger("discord")
 
-    headers = {"Content-Type": "application/json"}
-    payload = {"content": text}
 
-    try:
-        requests.post(webhook_url, headers=headers, data=json.dumps(payload), timeout=5)
-    except Exception as e:
-        print("[Discord ERROR]", e)
-        print("FAILED CONTENT >>>", text)
+def send_discord(webhook_url: str, text: str):
+    """
+    レポ用の送信口（互換）。実際の送信は utils.notify のハブに積むだけで、
+    Discord のレート制限待ち・リトライは sink のワーカーがやる。
+    cron の最後に notify.flush() で送り切ること。
+    """
+    hub = notify.get_hub()
+    if webhook_url:
+        hub.ensure_discord(webhook_url, "report")
+    if hub.notify("report", text) == 0:
+        log.info("discord_mock", text=text)
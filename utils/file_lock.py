@@ -0,0 +1,33 @@
+# utils/file_lock.py
+# ===============================
+# プロセスをまたぐ排他（fcntl.flock）
+#
+# gunicorn の複数ワーカー / cron / 手で流す移行スクリプトが同じファイルを書くとき用。
+# threading.Lock はプロセス内しか守らないので、読んで→足して→書く 区間はこれで囲む。
+#
+#   from utils.file_lock import locked
+#   with locked("data/online_stats.json"):
+#       ...                                  # "data/online_stats.json.lock" を握っている間
+#
+# ロック用のファイルは消さずに置いておく（消すと別のプロセスが別の inode を握れてしまう）。
+# ===============================
+
+import os
+import fcntl
+from contextlib import contextmanager
+
+
+@contextmanager
+def locked(path: str):
+    """ path + ".lock" を排他ロックしている間だけ中を実行する（同じプロセス内の再入は不可） """
+    lock_path = path + ".lock"
+    d = os.path.dirname(lock_path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
@@ -0,0 +1,167 @@
+# utils/jsonlog.py
+# ===============================
+# 構造化(JSON 1行)ログ。書き出しは別スレッド
+#
+#   from utils.jsonlog import get_logger
+#   log = get_logger("server")
+#   log.info("webhook", event="ENTRY_BUY", symbol="7203", price=1234.5)
+#   log.info("webhook", sample="PRICE_TICK", event="PRICE_TICK", ...)   # N件に1件だけ出す
+#   log.error("notify_failed", exc=e)      # "error" と（あれば）"exc" にトレースバック
+#
+# 呼び出し側はレコードをキューに積むだけ（QueueHandler）。
+# JSON 化と stdout / ファイルへの書き込みは QueueListener のスレッドでやるので、
+# webhook の処理が stdout の詰まりで待たされることはない。
+#
+#   LOG_LEVEL          DEBUG / INFO / WARNING / ERROR（既定 INFO）。レベル外は積む前に捨てる
+#   LOG_FILE           指定があれば stdout の代わりにこのファイルへ追記
+#   LOG_SAMPLE_N       sample= を付けたログは N 件に1件（既定 100、1 なら全部）
+#   LOG_QUEUE_MAX      キューの上限。溢れた分は捨てて数える
+#
+# 出力: {"ts": "...+09:00", "level": "INFO", "logger": "server", "msg": "webhook", ...fields}
+# sample= で間引いたログには "sampled": N が付く（件数を見積もるときは N 倍する）。
+# ===============================
+
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+import traceback
+import logging.handlers
+from datetime import datetime, timezone, timedelta
+
+JST = timezone(timedelta(hours=9))
+
+LOG_LEVEL     = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE      = os.getenv("LOG_FILE", "")
+LOG_SAMPLE_N  = int(os.getenv("LOG_SAMPLE_N", "100"))
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", "10000"))
+
+ROOT_NAME = "bot"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        out = {
+            "ts": datetime.fromtimestamp(record.created, JST).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name[len(ROOT_NAME) + 1:] if record.name.startswith(ROOT_NAME + ".") else record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            out.update(fields)
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """ キューが満杯なら待たずに捨てる """
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # 例外のトレースバック文字列化だけ呼び出し側で（exc_info は別スレッドに渡せないため）
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return record
+
+
+_setup_lock = threading.Lock()
+_handler = None
+_listener = None
+
+
+def setup():
+    """ 初回の get_logger で呼ばれる。何度呼んでも1回だけ """
+    global _handler, _listener
+    with _setup_lock:
+        if _handler is not None:
+            return
+        q = queue.Queue(maxsize=LOG_QUEUE_MAX)
+        if LOG_FILE:
+            d = os.path.dirname(LOG_FILE)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            out = logging.FileHandler(LOG_FILE, encoding="utf-8")
+        else:
+            out = logging.StreamHandler(sys.stdout)
+        out.setFormatter(JsonFormatter())
+
+        root = logging.getLogger(ROOT_NAME)
+        root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        root.propagate = False
+        _handler = _DroppingQueueHandler(q)
+        root.addHandler(_handler)
+
+        _listener = logging.handlers.QueueListener(q, out)
+        _listener.start()
+        # 終了前にキューを書き切る
+        atexit.register(_listener.stop)
+
+
+class JsonLogger:
+    """ log.info("msg", key=value, ...) の形で書ける薄いラッパー """
+
+    def __init__(self, name):
+        self._logger = logging.getLogger(f"{ROOT_NAME}.{name}")
+        self._sample_counts = {}
+        self._sample_lock = threading.Lock()
+
+    def _sampled(self, key, every):
+        with self._sample_lock:
+            n = self._sample_counts.get(key, 0) + 1
+            self._sample_counts[key] = n
+        return (n - 1) % every == 0
+
+    def log(self, level, msg, sample=None, exc=None, **fields):
+        if not self._logger.isEnabledFor(level):
+            return
+        if sample is not None and LOG_SAMPLE_N > 1:
+            if not self._sampled(sample, LOG_SAMPLE_N):
+                return
+            fields["sampled"] = LOG_SAMPLE_N
+        exc_info = None
+        if exc is not None:
+            fields["error"] = str(exc)
+            if isinstance(exc, BaseException) and exc.__traceback__ is not None:
+                exc_info = (type(exc), exc, exc.__traceback__)
+        self._logger.log(level, msg, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, msg, **fields):
+        self.log(logging.DEBUG, msg, **fields)
+
+    def info(self, msg, **fields):
+        self.log(logging.INFO, msg, **fields)
+
+    def warning(self, msg, **fields):
+        self.log(logging.WARNING, msg, **fields)
+
+    def error(self, msg, **fields):
+        self.log(logging.ERROR, msg, **fields)
+
+
+def get_logger(name):
+    setup()
+    return JsonLogger(name)
+
+
+def stats():
+    return {
+        "queued": _handler.queue.qsize() if _handler is not None else 0,
+        "dropped": _handler.dropped if _handler is not None else 0,
+        "level": LOG_LEVEL,
+        "sample_n": LOG_SAMPLE_N,
+    }
@@ -0,0 +1,342 @@
+# utils/notify.py
+# ===============================
+# 通知ハブ（1つの通知を複数の送り先へ）
+#
+#   from utils import notify
+#   notify.notify("trade", msg, title="AIりんご式トレード通知", color=0x00ff00)
+#   notify.notify("report", daily_msg)
+#   notify.flush()        # cron の終わりに。キューが空になるまで待つ
+#
+# 送り先（sink）ごとにキュー・ワーカースレッド・リトライ設定を持つので、
+# 1つが遅い/落ちていても他の sink や webhook の処理は待たされない。
+# notify() はキューに積むだけ（満杯ならその sink の分だけ捨てて数える）。
+#
+# channel: "trade"（server の本エントリー/決済）/ "report"（日次・週次・月次）
+#
+# sink の設定:
+#   DISCORD_WEBHOOK_MAIN   → discord sink（trade）   ※従来どおり
+#   DISCORD_WEBHOOK_REPORT → discord sink（report）  ※従来どおり
+#   NOTIFY_SINKS に JSON で追加:
+#     [{"type": "discord", "url": "https://...", "channels": ["trade"]},
+#      {"type": "file", "path": "logs/notifications.jsonl"},
+#      {"type": "http", "url": "http://127.0.0.1:8080/notify", "retries": 5}]
+#   channels を省略したら全部。retries / queue_max も sink ごとに書ける。
+#
+# Discord の送信レート制限は discord sink のワーカーが自分の URL ごとのバケツで待つ。
+# ===============================
+
+import os
+import abc
+import json
+import time
+import queue
+import random
+import atexit
+import threading
+from datetime import datetime, timezone, timedelta
+
+from utils.jsonlog import get_logger
+
+log = get_logger("notify")
+
+JST = timezone(timedelta(hours=9))
+
+NOTIFY_QUEUE_MAX = int(os.getenv("NOTIFY_QUEUE_MAX", "1000"))
+NOTIFY_FLUSH_SEC = float(os.getenv("NOTIFY_FLUSH_SEC", "30"))
+
+
+class Notice:
+    __slots__ = ("channel", "text", "title", "color", "time")
+
+    def __init__(self, channel, text, title=None, color=None):
+        self.channel = channel
+        self.text = text
+        self.title = title
+        self.color = color
+        self.time = datetime.now(JST)
+
+    def as_dict(self):
+        return {
+            "time": self.time.isoformat(timespec="seconds"),
+            "channel": self.channel,
+            "title": self.title,
+            "text": self.text,
+            "color": self.color,
+        }
+
+
+class SendError(Exception):
+    """ retry_after があればその秒数待ってからやり直す。retry=False ならやり直さない """
+
+    def __init__(self, msg, retry=True, retry_after=None):
+        super().__init__(msg)
+        self.retry = retry
+        self.retry_after = retry_after
+
+
+# ---------------------------
+# sink
+# ---------------------------
+
+class Sink(abc.ABC):
+    kind = "sink"
+
+    def __init__(self, name, channels=None, retries=3, queue_max=NOTIFY_QUEUE_MAX, retry_base=1.0):
+        self.name = name
+        self.channels = set(channels) if channels else None   # None なら全部
+        self.retries = retries
+        self.retry_base = retry_base
+        self.q = queue.Queue(maxsize=queue_max)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+
+    def accepts(self, notice: Notice) -> bool:
+        return self.channels is None or notice.channel in self.channels
+
+    @abc.abstractmethod
+    def send(self, notice: Notice):
+        ...
+
+    # ---- キュー/ワーカー ----
+
+    def offer(self, notice: Notice) -> bool:
+        try:
+            self.q.put_nowait(notice)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self._ensure_thread()
+        return True
+
+    def _ensure_thread(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name=f"notify-{self.name}", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            notice = self.q.get()
+            try:
+                self._deliver(notice)
+            finally:
+                self.q.task_done()
+
+    def _deliver(self, notice: Notice):
+        attempt = 0
+        while True:
+            try:
+                self.send(notice)
+                self.sent += 1
+                return
+            except Exception as e:
+                retry = getattr(e, "retry", True)
+                if not retry or attempt >= self.retries:
+                    self.failed += 1
+                    log.error("notify_failed", sink=self.name, attempts=attempt + 1, text=notice.text, exc=e)
+                    return
+                attempt += 1
+                self.retried += 1
+                wait = getattr(e, "retry_after", None)
+                if wait is None:
+                    wait = min(self.retry_base * (2 ** (attempt - 1)), 30) + random.uniform(0, 0.25)
+                time.sleep(wait)
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "queued": self.q.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "dropped": self.dropped,
+        }
+
+
+def _check_response(resp):
+    if resp.status_code == 429:
+        try:
+            after = float(resp.headers.get("Retry-After", "1"))
+        except ValueError:
+            after = 1.0
+        raise SendError("rate limited (429)", retry_after=after)
+    if resp.status_code >= 500:
+        raise SendError(f"status={resp.status_code}")
+    if resp.status_code >= 400:
+        raise SendError(f"status={resp.status_code}", retry=False)
+
+
+class DiscordSink(Sink):
+    """ title があれば embed（server の通知の見た目）、無ければ content のみ（レポ） """
+    kind = "discord"
+
+    def __init__(self, url, name=None, **kw):
+        super().__init__(name or "discord", **kw)
+        self.url = url
+        from ai.net_guard import get_bucket, DISCORD_BUCKET
+        # Discord のレート制限は webhook URL ごと。既定の1本目は従来の "discord" バケツを使う
+        self.bucket = DISCORD_BUCKET if self.name == "discord" else get_bucket(
+            f"discord:{self.name}", capacity=DISCORD_BUCKET.capacity, window_sec=60
+        )
+
+    def payload(self, notice: Notice):
+        if notice.title:
+            return {
+                "embeds": [
+                    {
+                        "title": notice.title,
+                        "description": notice.text,
+                        "color": notice.color if notice.color is not None else 0x00ccff,
+                        "footer": {"text": "AIりんご式 | " + notice.time.strftime("%Y/%m/%d %H:%M:%S")},
+                    }
+                ]
+            }
+        return {"content": notice.text}
+
+    def send(self, notice: Notice):
+        import requests  # cron の起動を軽くするため送る時だけ読む
+        # 枠が空かなければ送らずにリトライへ回す（黙って超過送信しない）
+        if not self.bucket.wait(timeout=60):
+            raise SendError("discord rate budget exhausted", retry_after=self.bucket.next_token_in())
+        resp = requests.post(self.url, json=self.payload(notice), timeout=5)
+        _check_response(resp)
+
+
+class HttpSink(Sink):
+    """ ローカルの受け口などへ Notice をそのまま JSON で POST """
+    kind = "http"
+
+    def __init__(self, url, name=None, **kw):
+        super().__init__(name or "http", **kw)
+        self.url = url
+
+    def send(self, notice: Notice):
+        import requests
+        resp = requests.post(self.url, json=notice.as_dict(), timeout=5)
+        _check_response(resp)
+
+
+class FileSink(Sink):
+    """ 1通知1行の JSONL に追記 """
+    kind = "file"
+
+    def __init__(self, path, name=None, **kw):
+        kw.setdefault("retries", 1)
+        super().__init__(name or "file", **kw)
+        self.path = path
+
+    def send(self, notice: Notice):
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(notice.as_dict(), ensure_ascii=False) + "\n")
+
+
+SINK_TYPES = {"discord": DiscordSink, "http": HttpSink, "file": FileSink}
+
+
+# ---------------------------
+# hub
+# ---------------------------
+
+class NotifyHub:
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+        self._lock = threading.Lock()
+
+    def add(self, sink: Sink):
+        with self._lock:
+            self.sinks.append(sink)
+        return sink
+
+    def ensure_discord(self, url, channel):
+        """ url の discord sink が無ければ channel 専用で足す（utils.discord の互換用） """
+        with self._lock:
+            for s in self.sinks:
+                if isinstance(s, DiscordSink) and s.url == url:
+                    return s
+            sink = DiscordSink(url, name=f"discord-{channel}-{len(self.sinks)}", channels=[channel])
+            self.sinks.append(sink)
+            return sink
+
+    def notify(self, channel, text, title=None, color=None) -> int:
+        """ 受け取った sink の数を返す（0 なら送り先なし） """
+        notice = Notice(channel, text, title, color)
+        n = 0
+        for s in list(self.sinks):
+            if s.accepts(notice) and s.offer(notice):
+                n += 1
+        return n
+
+    def flush(self, timeout=NOTIFY_FLUSH_SEC) -> bool:
+        """ 全 sink のキューが空になるまで待つ。timeout 内に終われば True """
+        deadline = time.time() + timeout
+        for s in list(self.sinks):
+            while s.q.unfinished_tasks:
+                if time.time() >= deadline:
+                    return False
+                time.sleep(0.05)
+        return True
+
+    def stats(self):
+        return {s.name: s.stats() for s in list(self.sinks)}
+
+
+def build_sinks_from_env():
+    sinks = []
+    main = os.getenv("DISCORD_WEBHOOK_MAIN", "")
+    if main:
+        sinks.append(DiscordSink(main, name="discord", channels=["trade"]))
+    report = os.getenv("DISCORD_WEBHOOK_REPORT", "")
+    if report:
+        if main == report:
+            sinks[0].channels = None
+        else:
+            sinks.append(DiscordSink(report, name="discord-report", channels=["report"]))
+
+    raw = os.getenv("NOTIFY_SINKS", "").strip()
+    if raw:
+        try:
+            conf = json.loads(raw)
+        except ValueError as e:
+            log.error("notify_sinks_invalid", exc=e)
+            conf = []
+        for i, c in enumerate(conf):
+            cls = SINK_TYPES.get(c.get("type"))
+            if cls is None:
+                log.error("notify_sink_unknown_type", type=c.get("type"))
+                continue
+            target = c.get("path") if cls is FileSink else c.get("url")
+            if not target:
+                continue
+            kw = {k: c[k] for k in ("channels", "retries", "queue_max", "retry_base") if k in c}
+            sinks.append(cls(target, name=c.get("name") or f"{c['type']}-{i}", **kw))
+    return sinks
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub() -> NotifyHub:
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = NotifyHub(build_sinks_from_env())
+                # 取りこぼし防止（cron で flush し忘れても、終了前に少しだけ待つ）
+                atexit.register(_hub.flush, 10)
+    return _hub
+
+
+def notify(channel, text, title=None, color=None) -> int:
+    return get_hub().notify(channel, text, title, color)
+
+
+def flush(timeout=NOTIFY_FLUSH_SEC) -> bool:
+    return get_hub().flush(timeout)
@@ -1,7 +1,7 @@
-from datetime import datetime
-import pytz
+from datetime import datetime, timezone, timedelta
 
-JST = pytz.timezone("Asia/Tokyo")
+# 日本は夏時間なしなので固定オフセットで十分（pytz の import を省いて起動を軽くする）
+JST = timezone(timedelta(hours=9))
 
 def get_jst_now():
     return datetime.now(JST)
@@ -30,3 +30,46 @@ def is_market_closed_now_jst(market_close_hhmm: str) -> bool:
     if now.hour == close_h and now.minute >= close_m:
         return True
     return False
+
+
+# ---- 場中の時計（Pine の mins_from_entry と同じく昼休みを数えない）
+# 前場 9:00-11:30 / 後場 12:30-15:30（分, JST）。土日は場が無い扱い（祝日は見ない）
+SESSIONS = ((9 * 60, 11 * 60 + 30), (12 * 60 + 30, 15 * 60 + 30))
+
+
+def _session_spans(day):
+    """ その日の場中の (開始, 終了) datetime。土日は空 """
+    if day.weekday() >= 5:
+        return []
+    base = datetime(day.year, day.month, day.day, tzinfo=JST)
+    return [(base + timedelta(minutes=a), base + timedelta(minutes=b)) for a, b in SESSIONS]
+
+
+def is_session_open(now=None) -> bool:
+    now = (now or get_jst_now()).astimezone(JST)
+    return any(a <= now < b for a, b in _session_spans(now.date()))
+
+
+def next_session_open(now=None) -> datetime:
+    """ now 以降で最初に場が開く時刻（場中なら now そのもの） """
+    now = (now or get_jst_now()).astimezone(JST)
+    day = now.date()
+    for _ in range(8):
+        for a, b in _session_spans(day):
+            if now < b:
+                return max(a, now)
+        day += timedelta(days=1)
+    return now
+
+
+def add_session_minutes(start, mins) -> datetime:
+    """ start から場中の時間だけで mins 分進めた時刻（昼休み・引け後・土日は飛ばす） """
+    t = next_session_open(start)
+    left = timedelta(minutes=max(mins, 0))
+    for _ in range(16):
+        span_end = next(b for a, b in _session_spans(t.date()) if a <= t < b)
+        if t + left <= span_end:
+            return t + left
+        left -= span_end - t
+        t = next_session_open(span_end)
+    return t + left
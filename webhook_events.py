@@ -0,0 +1,213 @@
+# webhook_events.py
+# ===============================
+# webhook ペイロードの型つきレコード（受け口で1回だけパース＆検証する）
+#
+#   ev = webhook_events.decode(request.get_data(), SECRET_TOKEN)
+#
+# - JSON は orjson があればそれで、無ければ標準 json で読む
+# - 壊れた JSON / secret 不一致 / 必須項目が数値でない … は EventError（HTTPステータス付き）
+#   ここで落とすので、レーンやポジ状態には一切触らない
+# - 未対応の type は None（server 側で "unhandled" を返す）
+# - 数値は float / int / None に揃えて持つ。Pine の "NaN" や空文字は「値なし」扱い
+#
+# 以降のハンドラ・tick 保存・AI 判定は record の属性を読むだけ。
+# ===============================
+
+import hmac
+import json
+import math
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _loads = json.loads
+
+MAX_BODY_BYTES = 64 * 1024
+
+
+class EventError(Exception):
+    """ 受け付けない webhook。status は返す HTTP ステータス """
+
+    def __init__(self, reason, status=400):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+
+
+# ---------------------------
+# 値の読み取り
+# ---------------------------
+
+def _num(payload, key, default=None, required=False):
+    v = payload.get(key)
+    if v is None or v == "":
+        if required:
+            raise EventError(f"missing {key}")
+        return default
+    if isinstance(v, bool):
+        raise EventError(f"bad {key}")
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        raise EventError(f"bad {key}")
+    if math.isnan(f) or math.isinf(f):
+        if required:
+            raise EventError(f"bad {key}")
+        return default
+    return f
+
+
+def _int(payload, key):
+    f = _num(payload, key)
+    return int(f) if f is not None else None
+
+
+def _side(payload, default=""):
+    side = payload.get("side") or default
+    if not isinstance(side, str):
+        raise EventError("bad side")
+    return side.upper()
+
+
+# ---------------------------
+# レコード
+# ---------------------------
+
+class Event:
+    __slots__ = ("type", "symbol", "side", "price", "pct", "entry_ts")
+
+    def __init__(self, type, symbol, side="", price=0.0, pct=None, entry_ts=None):
+        self.type = type
+        self.symbol = symbol
+        self.side = side
+        self.price = price
+        self.pct = pct            # pct_from_entry（SELLは下落でプラスになるようPine側で正規化済み）
+        self.entry_ts = entry_ts  # Pine の「エントリー発生ms」
+
+    def __repr__(self):
+        fields = ", ".join(f"{k}={getattr(self, k)!r}" for k in _all_slots(type(self)))
+        return f"{type(self).__name__}({fields})"
+
+
+class EntryEvent(Event):
+    """ ENTRY_BUY / ENTRY_SELL """
+    __slots__ = ("vol_mult", "vwap", "atr", "last_pct")
+
+    @classmethod
+    def parse(cls, ev_type, symbol, payload):
+        ev = cls(ev_type, symbol, _side(payload, "BUY" if ev_type == "ENTRY_BUY" else "SELL"),
+                 _num(payload, "price", required=True), _num(payload, "pct_from_entry"),
+                 _int(payload, "entry_ts"))
+        ev.vol_mult = _num(payload, "vol_mult", 1.0)
+        ev.vwap     = _num(payload, "vwap", 0.0)
+        ev.atr      = _num(payload, "atr", 0.0)
+        ev.last_pct = _num(payload, "last_pct", 0.0)
+        return ev
+
+
+class TickEvent(Event):
+    """ PRICE_TICK """
+    __slots__ = ("volume", "vwap", "atr", "mins_from_entry")
+
+    @classmethod
+    def parse(cls, ev_type, symbol, payload):
+        ev = cls(ev_type, symbol, _side(payload), _num(payload, "price", required=True),
+                 _num(payload, "pct_from_entry"), _int(payload, "entry_ts"))
+        ev.volume          = _num(payload, "volume")
+        ev.vwap            = _num(payload, "vwap")
+        ev.atr             = _num(payload, "atr")
+        ev.mins_from_entry = _num(payload, "mins_from_entry")  # Pine 側で昼休み補正済
+        return ev
+
+    def tick(self, t):
+        """ position_manager.add_tick に積む形（t は JST の ISO 時刻） """
+        return {
+            "t": t,
+            "price": self.price,
+            "pct": self.pct,
+            "volume": self.volume,
+            "vwap": self.vwap,
+            "atr": self.atr,
+            "mins_from_entry": self.mins_from_entry,
+        }
+
+
+class ExitEvent(Event):
+    """ Pine 保険決済 TP / SL / TIMEOUT """
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, ev_type, symbol, payload):
+        return cls(ev_type, symbol, _side(payload), _num(payload, "price", required=True),
+                   _num(payload, "pct_from_entry"), _int(payload, "entry_ts"))
+
+
+class TimerEvent(Event):
+    """ サーバ内部（timer_wheel）からだけ作る。webhook では受けない """
+    __slots__ = ()
+
+    def __init__(self, symbol):
+        super().__init__("TIMER", symbol)
+
+
+def _all_slots(cls):
+    out = []
+    for c in reversed(cls.__mro__):
+        out.extend(getattr(c, "__slots__", ()))
+    return out
+
+
+PARSERS = {
+    "ENTRY_BUY":  EntryEvent.parse,
+    "ENTRY_SELL": EntryEvent.parse,
+    "PRICE_TICK": TickEvent.parse,
+    "TP":         ExitEvent.parse,
+    "SL":         ExitEvent.parse,
+    "TIMEOUT":    ExitEvent.parse,
+}
+
+
+# ---------------------------
+# 受け口
+# ---------------------------
+
+def loads(body):
+    """ bytes/str → dict。壊れていたら EventError """
+    if not body:
+        raise EventError("no data")
+    if len(body) > MAX_BODY_BYTES:
+        raise EventError("too large", 413)
+    try:
+        payload = _loads(body)
+    except ValueError:
+        raise EventError("bad json")
+    if not isinstance(payload, dict) or not payload:
+        raise EventError("no data")
+    return payload
+
+
+def check_secret(payload, secret):
+    given = payload.get("secret")
+    if not isinstance(given, str) or not hmac.compare_digest(given.encode(), secret.encode()):
+        raise EventError("invalid secret", 403)
+
+
+def from_payload(payload):
+    """ 検証済みの dict → レコード。未対応の type は None """
+    ev_type = payload.get("type", "")
+    parser = PARSERS.get(ev_type)
+    if parser is None:
+        return None
+    symbol = payload.get("symbol")
+    if not symbol or not isinstance(symbol, str):
+        raise EventError("missing symbol")
+    return parser(ev_type, symbol, payload)
+
+
+def decode(body, secret):
+    """ 生のリクエストボディ → レコード（未対応 type は None）。受け付けないものは EventError """
+    payload = loads(body)
+    check_secret(payload, secret)
+    return from_payload(payload)